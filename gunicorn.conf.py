@@ -0,0 +1,9 @@
+"""
+gunicorn settings, read from the working directory
+"""
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a worker that exited from the metrics files
+    multiprocess.mark_process_dead(worker.pid)
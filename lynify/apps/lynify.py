@@ -1,6 +1,5 @@
 import os
 import threading
-import time
 
 from django.apps import AppConfig
 
@@ -10,38 +9,11 @@ class LynifyApp(AppConfig):
     name = "lynify"
     is_polling = False
 
-    @staticmethod
-    def poll_for_playing_history():
-        print("Polling for playing history")
-        from lynify.models.history import HistoryModel
-        from lynify.models.tokens import AccessToken
-        from lynify.models.tracks import TrackModel
-
-        token = AccessToken.get_token()
-        if token is None:
-            print("Failed to get token")
-            return False
-        currently_playing = token.get_currently_playing()
-        if currently_playing is None:
-            print("No currently playing track")
-            return False
-        elif isinstance(currently_playing, Exception):
-            print("Issue with token: " + str(currently_playing))
-            return False
-        elif currently_playing["is_playing"]:
-            TrackModel.from_spotify(currently_playing["item"]["id"])
-            HistoryModel.from_spotify(currently_playing)
-        return True
-
     @staticmethod
     def polling_loop():
-        while True:
-            try:
-                if LynifyApp.poll_for_playing_history():
-                    print("Polled for playing history")
-            except Exception as e:
-                print(e)
-            time.sleep(60)
+        from lynify.poller import polling_loop
+
+        polling_loop()
 
     def ready(self):
         # avoid running multiple polling threads
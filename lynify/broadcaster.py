@@ -0,0 +1,81 @@
+"""
+Fan out of now playing changes to the open event streams
+
+The poller publishes snapshots to the now_playing table, possibly from
+another process. Each web process has one broadcaster per event loop which,
+while any browser is listening, checks the table for changed snapshots
+every NOW_PLAYING_CHECK_INTERVAL seconds with one indexed query, and hands
+the rendered snapshot to every listener of that user. Database and spotify
+load stay the same however many browsers are listening.
+"""
+import asyncio
+import datetime
+import weakref
+from collections import defaultdict
+from typing import Dict, Set
+
+from asgiref.sync import sync_to_async
+
+from lynify.models.now_playing import NowPlayingModel
+from lynify.settings import NOW_PLAYING_CHECK_INTERVAL
+from lynify.views.html import now_playing_html
+
+# changed_at to look for changes after when no snapshot has been published yet
+NO_CHANGE = datetime.datetime.min.replace(tzinfo=datetime.UTC)
+
+
+class NowPlayingBroadcaster:
+    def __init__(self):
+        self.listeners: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self.task = None
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """
+        Returns a queue receiving the html of the user's snapshot whenever it changes
+        """
+        # only the latest snapshot matters, a listener that fell behind skips to it
+        queue = asyncio.Queue(maxsize=1)
+        self.listeners[user_id].add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.listeners.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.listeners[user_id]
+
+    async def run(self):
+        # listeners get the current snapshot when they connect, so only later changes are sent
+        changed_at = await sync_to_async(NowPlayingModel.latest_change)() or NO_CHANGE
+        while self.listeners:
+            await asyncio.sleep(NOW_PLAYING_CHECK_INTERVAL)
+            try:
+                snapshots = await sync_to_async(NowPlayingModel.changed_since)(changed_at, list(self.listeners))
+                for snapshot in snapshots:
+                    changed_at = max(changed_at, snapshot.changed_at)
+                    html = await sync_to_async(now_playing_html)(snapshot)
+                    for queue in self.listeners.get(snapshot.user_id, ()):
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(html)
+            except Exception as e:
+                print(e)
+
+
+# asyncio queues belong to the event loop they are used on, so keep one broadcaster per loop
+_broadcasters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, NowPlayingBroadcaster]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_broadcaster() -> NowPlayingBroadcaster:
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = NowPlayingBroadcaster()
+        _broadcasters[loop] = broadcaster
+    return broadcaster
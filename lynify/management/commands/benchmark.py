@@ -0,0 +1,322 @@
+import contextlib
+import datetime
+import html
+import json
+import math
+import random
+import re
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+from lynify.models.history import HistoryModel
+from lynify.models.partitions import create_partitions
+from lynify.models.stats import rebuild_play_counters, rebuild_rollups
+from lynify.models.tokens import AccessToken
+from lynify.models.tracks import TrackModel
+from lynify.poller import poll_for_playing_history, poll_recently_played
+from lynify.settings import SPOTIFY_API_URL
+from lynify.utils.fake_spotify import FakeSpotify
+from lynify.utils.spotify import use_api_url
+
+BENCHMARK_USER = "benchmark"
+# seeded plays are this far apart
+PLAY_INTERVAL_SECONDS = 210
+# ingested plays are longer apart than the longest fake track, so none count as a repeat of the previous play
+INGESTED_PLAY_INTERVAL_MS = 400 * 1000
+
+# Statements filling the benchmark database with a synthetic library.
+# Plays are skewed towards low track ids, so some tracks are played far more
+# than others like in a real history.
+SEED_SQL = [
+    "SELECT setseed(0.5)",
+    """
+    INSERT INTO genres (genre_name) SELECT 'genre ' || g FROM generate_series(0, %(genres)s - 1) g
+    """,
+    """
+    INSERT INTO artists (artist_id, artist_name, artist_popularity, artist_followers,
+                         artist_play_count, artist_total_ms_played, artist_refreshed_at)
+    SELECT 'a' || i, 'Artist ' || i, i * 37 %% 101, i * 7919 %% 1000000, 0, 0, now()
+    FROM generate_series(0, %(artists)s - 1) i
+    """,
+    """
+    INSERT INTO artists_artist_genres (artistmodel_id, genremodel_id)
+    SELECT 'a' || i, 'genre ' || g
+    FROM generate_series(0, %(artists)s - 1) i,
+         LATERAL (VALUES (i %% %(genres)s), ((i * 7 + 3) %% %(genres)s)) genre(g)
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO tracks (track_id, track_name, track_album, track_duration, track_popularity, track_release_date,
+                        track_explicit, track_play_count, track_total_ms_played, track_refreshed_at)
+    SELECT 't' || i, 'Track ' || i, 'Album ' || i / 10, 120000 + i * 7919 %% 240000, i * 31 %% 101,
+           date '1960-01-01' + i * 13 %% 23000, i %% 5 = 0, 0, 0, now()
+    FROM generate_series(0, %(tracks)s - 1) i
+    """,
+    """
+    INSERT INTO tracks_track_artists (trackmodel_id, artistmodel_id)
+    SELECT 't' || i, 'a' || a
+    FROM generate_series(0, %(tracks)s - 1) i,
+         LATERAL (VALUES (i %% %(artists)s), (CASE WHEN i %% 3 = 0 THEN (i * 17 + 1) %% %(artists)s END)) artist(a)
+    WHERE a IS NOT NULL
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO history (user_id, timestamp, track_id, ms_played)
+    SELECT %(user)s, now() - (%(history)s - i) * make_interval(secs => %(interval)s),
+           't' || floor(%(tracks)s * random() ^ 3)::int, CASE WHEN i %% 4 = 0 THEN NULL ELSE 30000 + i %% 150000 END
+    FROM generate_series(1, %(history)s) i
+    """,
+]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    # nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def counting_queries(function: Callable):
+    """
+    Call function, returning its result and the number of queries it ran
+    """
+    queries = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        result = function()
+    return result, queries
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the pages and the poller against a synthetic library in a separate database "
+        "(the test database), with a local stand-in for the spotify api. "
+        "Prints latency percentiles, queries per request and api calls per play as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--history", type=int, default=1000000, help="plays to seed")
+        parser.add_argument("--tracks", type=int, default=100000, help="tracks to seed")
+        parser.add_argument("--artists", type=int, default=30000, help="artists to seed")
+        parser.add_argument("--genres", type=int, default=500, help="genres to seed")
+        parser.add_argument("--pages", type=int, default=10, help="pages requested per way of viewing a page")
+        parser.add_argument("--plays", type=int, default=200, help="plays ingested per poll mode")
+        parser.add_argument(
+            "--new-tracks", type=float, default=0.3, help="share of ingested plays of tracks not stored yet"
+        )
+        parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake api takes per request")
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="keep the benchmark database, and reuse its library if already seeded",
+        )
+        parser.add_argument("--output", help="write the results to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"])
+        fake = FakeSpotify(latency=options["latency"], artists=options["artists"])
+        fake.start()
+        use_api_url(fake.api_url)
+        try:
+            if not HistoryModel.objects.filter(user_id=BENCHMARK_USER).exists():
+                self.seed(options)
+            else:
+                self.stderr.write("Reusing the seeded library")
+            results = {
+                "parameters": {
+                    name: options[name]
+                    for name in ("history", "tracks", "artists", "genres", "pages", "plays", "new_tracks", "latency")
+                },
+                "views": self.benchmark_views(options["pages"], options["tracks"]),
+                "ingestion": {
+                    "recently_played": self.benchmark_recently_played(fake, options["plays"], options["new_tracks"]),
+                    "currently_playing": self.benchmark_currently_playing(
+                        fake, options["plays"], options["new_tracks"]
+                    ),
+                },
+            }
+        finally:
+            use_api_url(SPOTIFY_API_URL)
+            fake.stop()
+            if not options["keepdb"]:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as fp:
+                fp.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def seed(self, options):
+        self.stderr.write("Seeding " + str(options["history"]) + " plays")
+        start = time.monotonic()
+        params = {
+            "user": BENCHMARK_USER,
+            "interval": PLAY_INTERVAL_SECONDS,
+            **{name: options[name] for name in ("history", "tracks", "artists", "genres")},
+        }
+        # partitions for the seeded months, like an import creates them
+        now = datetime.datetime.now(tz=datetime.UTC)
+        first = now - datetime.timedelta(seconds=options["history"] * PLAY_INTERVAL_SECONDS)
+        create_partitions([now] + [first + datetime.timedelta(days=days) for days in range(0, (now - first).days, 28)])
+        with connection.cursor() as cursor:
+            for sql in SEED_SQL:
+                cursor.execute(sql, params)
+        TrackModel.update_search()
+        rebuild_rollups()
+        rebuild_play_counters()
+        AccessToken.objects.create(
+            user_id=BENCHMARK_USER,
+            access_token="benchmark",
+            refresh_token="benchmark",
+            expires_at=int((time.time() + 10 * 365 * 24 * 3600) * 1000),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.stderr.write("Seeded in " + str(round(time.monotonic() - start, 1)) + "s")
+
+    def benchmark_views(self, pages: int, tracks: int) -> Dict[str, dict]:
+        """
+        Walk `pages` pages deep into every way of viewing each page, following
+        its Next links, and request `pages` track pages
+        """
+        client = Client(HTTP_HOST="localhost")
+        session = client.session
+        session["user_id"] = BENCHMARK_USER
+        session.save()
+
+        views = {
+            "history": [
+                "/history/",
+                "/history/?genre=genre+1",
+                "/history/?date=" + datetime.datetime.now(tz=datetime.UTC).strftime("%Y-%m"),
+            ],
+            "tracks": ["/tracks/?sort=" + sort for sort in ("popularity", "plays", "last_played")]
+            + ["/tracks/?genre=genre+1"],
+            "artists": ["/artists/?sort=" + sort for sort in ("followers", "plays", "last_played")]
+            + ["/artists/?genre=genre+1"],
+        }
+        results = {}
+        for view, urls in views.items():
+            timings = []
+            for url in urls:
+                path = url.split("?")[0]
+                for _ in range(pages):
+                    timing = self.timed_get(client, url)
+                    timings.append(timing)
+                    next_link = re.search(r'href="[^"]*\?([^"]*)"[^>]*>Next<', timing["content"])
+                    if next_link is None:
+                        break
+                    url = path + "?" + html.unescape(next_link.group(1))
+            results[view] = summary(timings)
+        track_urls = ["/track/?track_id=t" + str(int(tracks * random.random() ** 3)) for _ in range(pages)]
+        results["track"] = summary([self.timed_get(client, url) for url in track_urls])
+        return results
+
+    def timed_get(self, client: Client, url: str) -> dict:
+        start = time.perf_counter()
+        response, queries = counting_queries(lambda: client.get(url))
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            self.stderr.write(url + " answered " + str(response.status_code))
+        return {"seconds": elapsed, "queries": queries, "content": response.content.decode()}
+
+    def ingestion_track_ids(self, plays: int, new_tracks: float) -> List[str]:
+        stored = TrackModel.objects.count()
+        # unique per run, so tracks new to a kept database are new again
+        run = str(int(time.time()))
+        return [
+            "n" + run + "x" + str(i) if random.random() < new_tracks else "t" + str(int(stored * random.random() ** 3))
+            for i in range(plays)
+        ]
+
+    def benchmark_recently_played(self, fake: FakeSpotify, plays: int, new_tracks: float) -> dict:
+        """
+        Serve `plays` new plays on the recently played feed and poll it
+        """
+        start_ms = ingestion_start_ms()
+        fake.recently_played = [
+            (start_ms + i * INGESTED_PLAY_INTERVAL_MS, track_id)
+            for i, track_id in enumerate(self.ingestion_track_ids(plays, new_tracks))
+        ]
+        return self.ingestion_run(fake, [lambda: poll_recently_played(BENCHMARK_USER)])
+
+    def benchmark_currently_playing(self, fake: FakeSpotify, plays: int, new_tracks: float) -> dict:
+        """
+        Poll once per play while `plays` new plays are played one after another
+        """
+        start_ms = ingestion_start_ms()
+
+        def poll(timestamp: int, track_id: str):
+            def run():
+                fake.playing = {
+                    "is_playing": True,
+                    "timestamp": timestamp,
+                    "progress_ms": 1000,
+                    "item": fake.track(track_id),
+                }
+                return poll_for_playing_history(BENCHMARK_USER)
+
+            return run
+
+        polls = [
+            poll(start_ms + i * INGESTED_PLAY_INTERVAL_MS, track_id)
+            for i, track_id in enumerate(self.ingestion_track_ids(plays, new_tracks))
+        ]
+        return self.ingestion_run(fake, polls)
+
+    def ingestion_run(self, fake: FakeSpotify, polls: List[Callable]) -> dict:
+        before = HistoryModel.objects.filter(user_id=BENCHMARK_USER).count()
+        fake.reset_calls()
+        queries = 0
+        start = time.perf_counter()
+        # keep the poller's progress lines out of the results
+        with contextlib.redirect_stdout(sys.stderr):
+            for poll in polls:
+                queries += counting_queries(poll)[1]
+        elapsed = time.perf_counter() - start
+        recorded = HistoryModel.objects.filter(user_id=BENCHMARK_USER).count() - before
+        api_calls = sum(fake.calls.values())
+        return {
+            "plays_recorded": recorded,
+            "seconds": round(elapsed, 3),
+            "seconds_per_play": round(elapsed / recorded, 4) if recorded else None,
+            "api_calls": api_calls,
+            "api_calls_by_endpoint": dict(fake.calls),
+            "api_calls_per_play": round(api_calls / recorded, 3) if recorded else None,
+            "queries_per_play": round(queries / recorded, 2) if recorded else None,
+        }
+
+
+def ingestion_start_ms() -> int:
+    """
+    Returns a time an hour after the benchmark user's last play, in ms
+    """
+    last = HistoryModel.objects.filter(user_id=BENCHMARK_USER).latest("timestamp").timestamp
+    return int(last.timestamp() + 3600) * 1000
+
+
+def summary(timings: List[dict]) -> dict:
+    seconds = [timing["seconds"] for timing in timings]
+    queries = [timing["queries"] for timing in timings]
+    return {
+        "requests": len(timings),
+        "p50_ms": round(percentile(seconds, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 2),
+        "mean_ms": round(statistics.mean(seconds) * 1000, 2),
+        "queries_per_request": round(statistics.mean(queries), 2),
+        "max_queries": max(queries),
+    }
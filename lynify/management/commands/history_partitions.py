@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lynify.models.partitions import create_partitions_ahead, detach_partitions, is_partitioned, partitions
+from lynify.settings import HISTORY_PARTITIONS_AHEAD
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly history partitions ahead of time and move plays out of the default partition. "
+        "With --detach-before, detach the partitions of older months, leaving tables that can be dumped and dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead", type=int, default=HISTORY_PARTITIONS_AHEAD, help="months to create partitions for ahead"
+        )
+        parser.add_argument("--detach-before", help="YYYY-MM, detach the partitions of the months before it")
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("history is not partitioned, run the migrations first")
+        created = create_partitions_ahead(options["ahead"])
+        self.stdout.write("Created " + str(len(created)) + " partitions")
+        if options["detach_before"]:
+            try:
+                before = datetime.datetime.strptime(options["detach_before"], "%Y-%m").replace(tzinfo=datetime.UTC)
+            except ValueError:
+                raise CommandError("--detach-before is not a YYYY-MM month: " + options["detach_before"])
+            detached = detach_partitions(before)
+            self.stdout.write("Detached " + str(len(detached)) + " partitions")
+        self.stdout.write(str(len(partitions())) + " monthly partitions attached")
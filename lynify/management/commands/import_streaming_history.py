@@ -0,0 +1,189 @@
+import datetime
+import glob
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lynify.models.history import HistoryModel
+from lynify.models.partitions import create_partitions
+from lynify.models.tokens import AccessToken
+from lynify.models.tracks import TrackModel
+from lynify.settings import SPOTIFY_USER_ID
+from lynify.utils.json_stream import iter_json_array
+
+# plays resolved and inserted together
+IMPORT_BATCH_SIZE = 5000
+EXPORT_FILE_PATTERN = "Streaming_History_Audio_*.json"
+TRACK_URI_PREFIX = "spotify:track:"
+
+
+class Command(BaseCommand):
+    help = (
+        "Import plays from the Streaming_History_Audio_*.json files of spotify's extended streaming history export. "
+        "Files are streamed, tracks are resolved in batches and plays inserted in bulk. "
+        "Progress is checkpointed, so an interrupted import can be run again and picks up where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="export files, or directories holding them")
+        parser.add_argument("--user", default=SPOTIFY_USER_ID, help="user the plays belong to")
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="import every play, not only ones from before the user's first recorded play",
+        )
+        parser.add_argument("--min-ms-played", type=int, default=0, help="skip plays shorter than this")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument(
+            "--checkpoint", help="file recording progress, by default next to the first export file for the user"
+        )
+
+    def handle(self, *args, **options):
+        user_id = options["user"]
+        if not user_id:
+            raise CommandError("No user, pass --user or set SPOTIFY_USER_ID")
+        if AccessToken.get_token(user_id) is None:
+            raise CommandError("No access token for " + user_id + ", log in first")
+        files = export_files(options["paths"])
+        if not files:
+            raise CommandError("No " + EXPORT_FILE_PATTERN + " files found")
+        checkpoint_path = options["checkpoint"] or os.path.join(
+            os.path.dirname(files[0]), ".lynify_import_" + user_id + ".json"
+        )
+        checkpoint = load_checkpoint(checkpoint_path)
+
+        before = None
+        if not options["all"]:
+            # plays from when the poller was running are already recorded, with slightly different timestamps.
+            # The poller doesn't know how long a play lasted, imported plays do, so the cutoff stays the
+            # first polled play when resuming an import that stopped after recording older plays.
+            before = (
+                HistoryModel.objects.filter(user_id=user_id, ms_played__isnull=True)
+                .order_by("timestamp")
+                .values_list("timestamp", flat=True)
+                .first()
+            )
+            if before is not None:
+                self.stdout.write("Importing plays from before " + before.isoformat())
+
+        totals = {"read": 0, "inserted": 0}
+        start = time.monotonic()
+        for path in files:
+            name = os.path.basename(path)
+            done = checkpoint.get(name, 0)
+            if done == -1:
+                self.stdout.write(name + ": already imported")
+                continue
+            self.stdout.write(name + (": resuming after " + str(done) + " rows" if done else ""))
+            for batch in read_batches(path, options["batch_size"], done):
+                inserted = self.import_batch(batch, user_id, before, options["min_ms_played"])
+                done += len(batch)
+                checkpoint[name] = done
+                save_checkpoint(checkpoint_path, checkpoint)
+                totals["read"] += len(batch)
+                totals["inserted"] += inserted
+                self.stdout.write("  " + progress(totals, time.monotonic() - start))
+            checkpoint[name] = -1
+            save_checkpoint(checkpoint_path, checkpoint)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write("Done in " + str(round(elapsed, 1)) + "s: " + progress(totals, elapsed))
+
+    def import_batch(
+        self, batch: List[dict], user_id: str, before: Optional[datetime.datetime], min_ms_played: int
+    ) -> int:
+        """
+        Resolve the tracks of a batch of export rows and record them as plays.
+        Returns how many plays were inserted.
+        """
+        plays = []
+        for row in batch:
+            play = parse_play(row)
+            if play is None:
+                continue
+            track_id, timestamp, ms_played = play
+            if ms_played < min_ms_played or (before is not None and timestamp >= before):
+                continue
+            plays.append(play)
+        tracks = TrackModel.from_spotify_many((track_id for track_id, _, _ in plays), user_id=user_id)
+        entries = []
+        for track_id, timestamp, ms_played in plays:
+            track = tracks.get(track_id)
+            if track is None:
+                continue
+            history_model = HistoryModel()
+            history_model.user_id = user_id
+            history_model.timestamp = timestamp
+            history_model.track = track
+            history_model.ms_played = ms_played
+            entries.append(history_model)
+        # old months usually have no partition yet, create them rather than fill the default partition
+        create_partitions(entry.timestamp for entry in entries)
+        return len(HistoryModel.record(entries))
+
+
+def export_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, EXPORT_FILE_PATTERN)))
+        else:
+            files.append(path)
+    return files
+
+
+def parse_play(row: dict) -> Optional[Tuple[str, datetime.datetime, int]]:
+    """
+    Returns the track id, start time and ms played of an export row,
+    or None if it isn't a track play (e.g. a podcast episode)
+    """
+    uri = row.get("spotify_track_uri")
+    if not uri or not uri.startswith(TRACK_URI_PREFIX):
+        return None
+    ms_played = int(row.get("ms_played") or 0)
+    # ts is when the play ended, history is keyed by when it started
+    ended = datetime.datetime.fromisoformat(row["ts"])
+    return uri[len(TRACK_URI_PREFIX) :], ended - datetime.timedelta(milliseconds=ms_played), ms_played
+
+
+def progress(totals: Dict[str, int], elapsed: float) -> str:
+    rate = round(totals["read"] / elapsed) if elapsed else 0
+    return str(totals["read"]) + " rows read, " + str(totals["inserted"]) + " plays inserted, " + str(rate) + " rows/s"
+
+
+def read_batches(path: str, batch_size: int, skip: int) -> Iterator[List[dict]]:
+    """
+    Yield the rows of an export file in batches, after skipping `skip` rows
+    """
+    with open(path, encoding="utf-8") as fp:
+        batch = []
+        for i, row in enumerate(iter_json_array(fp)):
+            if i < skip:
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def load_checkpoint(path: str) -> Dict[str, int]:
+    """
+    Returns the rows already imported per export file, -1 for finished files
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, int]):
+    # replace the file in one step, so a crash can't leave it half written
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(tmp_path, path)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from lynify.models.stats import rebuild_play_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute the play counters on tracks and artists from the raw history"
+
+    def handle(self, *args, **options):
+        rebuild_play_counters()
+        self.stdout.write("Rebuilt play counters")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from lynify.models.stats import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily listening rollups from the raw history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="only rebuild this user's rollups")
+
+    def handle(self, *args, **options):
+        rebuild_rollups(options["user"])
+        self.stdout.write("Rebuilt rollups" + (" for " + options["user"] if options["user"] else ""))
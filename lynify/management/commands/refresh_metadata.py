@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from lynify.poller import refresh_metadata
+from lynify.settings import METADATA_REFRESH_REQUESTS_PER_HOUR
+
+
+class Command(BaseCommand):
+    help = "Refresh the metadata of the stalest tracks and artists, most played first"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=METADATA_REFRESH_REQUESTS_PER_HOUR,
+            help="maximum number of spotify api requests, 50 tracks or artists each",
+        )
+        parser.add_argument("--user", help="user whose token is used, the default user if not given")
+
+    def handle(self, *args, **options):
+        requests = refresh_metadata(options["requests"], options["user"])
+        self.stdout.write("Refreshed metadata with " + str(requests) + " requests")
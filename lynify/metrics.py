@@ -0,0 +1,159 @@
+"""
+Prometheus metrics
+
+Metrics are kept per process. With PROMETHEUS_MULTIPROC_DIR set, as in the
+Procfile, every web worker and poll.py write theirs to files in that
+directory, and /metrics serves them all combined. Without it /metrics serves
+the answering process' own, including the poller's when it runs as a thread
+of the app, and a poller started with poll.py can serve its own on
+POLLER_METRICS_PORT.
+"""
+import re
+import time
+from contextvars import ContextVar
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+VIEW_LATENCY = Histogram(
+    "lynify_view_latency_seconds", "Time to produce a response, per view", ["view", "method", "status"]
+)
+VIEW_QUERIES = Histogram(
+    "lynify_view_db_queries",
+    "Database queries per request, per view",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf")),
+)
+
+SPOTIFY_REQUESTS = Counter(
+    "lynify_spotify_requests_total", "Spotify api requests, by final response status", ["endpoint", "status"]
+)
+SPOTIFY_RETRIES = Counter(
+    "lynify_spotify_retries_total", "Spotify api responses that were retried (429s, 5xx)", ["endpoint", "status"]
+)
+SPOTIFY_LATENCY = Histogram(
+    "lynify_spotify_request_latency_seconds", "Spotify api request latency, including retries", ["endpoint"]
+)
+
+POLLS = Counter("lynify_polls_total", "Polls of spotify for a user's plays", ["mode", "result"])
+POLL_DURATION = Histogram("lynify_poll_duration_seconds", "Time spent running a poll", ["mode"])
+POLL_LAG = Histogram(
+    "lynify_poll_lag_seconds",
+    "Time from a play showing on spotify (currently playing: its start, recently played: its end) to it being recorded",
+    ["mode"],
+    buckets=(1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float("inf")),
+)
+# summed over the live processes in multiprocess mode, only the poller's is ever set
+POLL_BACKLOG = Gauge("lynify_poll_backlog", "Polls waiting for a free poller thread", multiprocess_mode="livesum")
+TOKEN_REFRESHES = Counter("lynify_token_refreshes_total", "Access token refreshes", ["result"])
+
+# spotify ids in api paths, replaced so endpoints don't get a label per id
+SPOTIFY_ID_PATTERN = re.compile(r"/[0-9A-Za-z]{22}(?=/|$)")
+
+
+def spotify_endpoint(url: str) -> str:
+    return SPOTIFY_ID_PATTERN.sub("/{id}", urlsplit(url).path)
+
+
+class MetricsRetry(urllib3.Retry):
+    """
+    Retry policy counting each retried response
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and url is not None:
+            SPOTIFY_RETRIES.labels(spotify_endpoint(url), str(response.status)).inc()
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class MetricsAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter timing and counting requests by endpoint and status
+    """
+
+    def send(self, request, *args, **kwargs):
+        endpoint = spotify_endpoint(request.url)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = super().send(request, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            SPOTIFY_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+            SPOTIFY_REQUESTS.labels(endpoint, status).inc()
+
+
+# queries run for the current request, a list so threads running its
+# database calls (sync_to_async copies the context) add to the same count
+_request_queries: ContextVar[Optional[List[int]]] = ContextVar("request_queries", default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def add_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+class MetricsMiddleware:
+    """
+    Record each request's latency and number of database queries
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = [0]
+        reset = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        record_request(request, response, time.perf_counter() - start, queries[0])
+        return response
+
+    async def __acall__(self, request):
+        queries = [0]
+        reset = _request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(reset)
+        record_request(request, response, time.perf_counter() - start, queries[0])
+        return response
+
+
+def record_request(request, response, elapsed: float, queries: int):
+    # streamed responses are timed until they start streaming
+    match = request.resolver_match
+    view = match.url_name if match is not None and match.url_name else "unmatched"
+    VIEW_LATENCY.labels(view, request.method, str(response.status_code)).observe(elapsed)
+    VIEW_QUERIES.labels(view).observe(queries)
+
+
+def start_metrics_server(port: int):
+    print("Serving metrics on port " + str(port))
+    start_http_server(port)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="artistmodel",
+            options={"managed": True, "ordering": ["-artist_followers", "-artist_id"]},
+        ),
+        migrations.AlterModelOptions(
+            name="trackmodel",
+            options={"managed": True, "ordering": ["-track_popularity", "-track_id"]},
+        ),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=models.Index(fields=["-artist_followers", "-artist_id"], name="artists_followers_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=models.Index(fields=["-track_popularity", "-track_id"], name="tracks_popularity_idx"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0002_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accesstoken",
+            name="recently_played_after",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_history_user(apps, schema_editor):
+    """
+    Existing history belongs to the single configured user
+    """
+    AccessToken = apps.get_model("lynify", "AccessToken")
+    HistoryModel = apps.get_model("lynify", "HistoryModel")
+    user_id = settings.SPOTIFY_USER_ID
+    if not user_id:
+        user_ids = list(AccessToken.objects.values_list("user_id", flat=True)[:2])
+        user_id = user_ids[0] if len(user_ids) == 1 else ""
+    HistoryModel.objects.update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0003_token_recently_played_after"),
+    ]
+
+    operations = [
+        # timestamp stops being the primary key, plays are identified by (user_id, timestamp)
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=[
+                        "ALTER TABLE history DROP CONSTRAINT history_pkey",
+                        "ALTER TABLE history ADD COLUMN id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY",
+                    ],
+                    reverse_sql=[
+                        "ALTER TABLE history DROP COLUMN id",
+                        "ALTER TABLE history ADD PRIMARY KEY (timestamp)",
+                    ],
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="historymodel",
+                    name="timestamp",
+                    field=models.DateTimeField(),
+                ),
+                migrations.AddField(
+                    model_name="historymodel",
+                    name="id",
+                    field=models.BigAutoField(primary_key=True, serialize=False),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="historymodel",
+            name="user_id",
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(set_history_user, migrations.RunPython.noop),
+        # run the deferred track foreign key checks from the update before altering the table again
+        migrations.RunSQL("SET CONSTRAINTS ALL IMMEDIATE", reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name="historymodel",
+            name="user_id",
+            field=models.TextField(),
+        ),
+        migrations.AddConstraint(
+            model_name="historymodel",
+            constraint=models.UniqueConstraint(fields=("user_id", "timestamp"), name="history_user_timestamp_uniq"),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0004_history_per_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historymodel",
+            name="ms_played",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="DailyTrackStatsModel",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("user_id", models.TextField()),
+                ("day", models.DateField()),
+                ("play_count", models.IntegerField(default=0)),
+                ("ms_played", models.BigIntegerField(default=0)),
+                ("track", models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to="lynify.trackmodel")),
+            ],
+            options={
+                "db_table": "daily_track_stats",
+                "managed": True,
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyArtistStatsModel",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("user_id", models.TextField()),
+                ("day", models.DateField()),
+                ("play_count", models.IntegerField(default=0)),
+                ("ms_played", models.BigIntegerField(default=0)),
+                ("artist", models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to="lynify.artistmodel")),
+            ],
+            options={
+                "db_table": "daily_artist_stats",
+                "managed": True,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailytrackstatsmodel",
+            constraint=models.UniqueConstraint(fields=("user_id", "day", "track"), name="daily_track_stats_uniq"),
+        ),
+        migrations.AddConstraint(
+            model_name="dailyartiststatsmodel",
+            constraint=models.UniqueConstraint(fields=("user_id", "day", "artist"), name="daily_artist_stats_uniq"),
+        ),
+        # fill the rollups from the existing history
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO daily_track_stats (user_id, day, track_id, play_count, ms_played)
+                SELECT h.user_id, (h.timestamp AT TIME ZONE 'UTC')::date, h.track_id,
+                       count(*), sum(COALESCE(h.ms_played, t.track_duration, 0))
+                FROM history h JOIN tracks t ON t.track_id = h.track_id
+                GROUP BY 1, 2, 3
+                """,
+                """
+                INSERT INTO daily_artist_stats (user_id, day, artist_id, play_count, ms_played)
+                SELECT h.user_id, (h.timestamp AT TIME ZONE 'UTC')::date, ta.artistmodel_id,
+                       count(*), sum(COALESCE(h.ms_played, t.track_duration, 0))
+                FROM history h
+                JOIN tracks t ON t.track_id = h.track_id
+                JOIN tracks_track_artists ta ON ta.trackmodel_id = h.track_id
+                GROUP BY 1, 2, 3
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
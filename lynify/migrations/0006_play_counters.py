@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0005_daily_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artistmodel",
+            name="artist_last_played_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="artistmodel",
+            name="artist_play_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="artistmodel",
+            name="artist_total_ms_played",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="trackmodel",
+            name="track_last_played_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trackmodel",
+            name="track_play_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="trackmodel",
+            name="track_total_ms_played",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=models.Index(fields=["-artist_play_count", "-artist_id"], name="artists_play_count_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=models.Index(fields=["-artist_last_played_at", "-artist_id"], name="artists_last_played_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=models.Index(fields=["-track_play_count", "-track_id"], name="tracks_play_count_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=models.Index(fields=["-track_last_played_at", "-track_id"], name="tracks_last_played_idx"),
+        ),
+        # count the existing history
+        migrations.RunSQL(
+            sql=[
+                """
+                UPDATE tracks SET
+                    track_play_count = c.plays,
+                    track_total_ms_played = c.ms_played,
+                    track_last_played_at = c.last_played_at
+                FROM (
+                    SELECT h.track_id, count(*) AS plays,
+                           sum(COALESCE(h.ms_played, t.track_duration, 0)) AS ms_played,
+                           max(h.timestamp) AS last_played_at
+                    FROM history h JOIN tracks t ON t.track_id = h.track_id
+                    GROUP BY 1
+                ) c
+                WHERE tracks.track_id = c.track_id
+                """,
+                """
+                UPDATE artists SET
+                    artist_play_count = c.plays,
+                    artist_total_ms_played = c.ms_played,
+                    artist_last_played_at = c.last_played_at
+                FROM (
+                    SELECT ta.artistmodel_id AS artist_id, count(*) AS plays,
+                           sum(COALESCE(h.ms_played, t.track_duration, 0)) AS ms_played,
+                           max(h.timestamp) AS last_played_at
+                    FROM history h
+                    JOIN tracks t ON t.track_id = h.track_id
+                    JOIN tracks_track_artists ta ON ta.trackmodel_id = h.track_id
+                    GROUP BY 1
+                ) c
+                WHERE artists.artist_id = c.artist_id
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,83 @@
+import ast
+
+from django.db import migrations, models
+
+
+def parse_genres(value):
+    """
+    Genres were stored as the repr of a python list
+    """
+    try:
+        genres = ast.literal_eval(value or "[]")
+    except (ValueError, SyntaxError):
+        return []
+    if not isinstance(genres, (list, tuple)):
+        return []
+    return [genre for genre in genres if isinstance(genre, str)]
+
+
+def split_genres(apps, schema_editor):
+    ArtistModel = apps.get_model("lynify", "ArtistModel")
+    GenreModel = apps.get_model("lynify", "GenreModel")
+    ArtistGenre = ArtistModel.artist_genres.through
+    artist_genres = {}
+    for artist_id, value in ArtistModel.objects.values_list("artist_id", "artist_genres_text").iterator():
+        artist_genres[artist_id] = parse_genres(value)
+    genre_names = {genre for genres in artist_genres.values() for genre in genres}
+    GenreModel.objects.bulk_create([GenreModel(genre_name=genre) for genre in genre_names], ignore_conflicts=True)
+    ArtistGenre.objects.bulk_create(
+        [
+            ArtistGenre(artistmodel_id=artist_id, genremodel_id=genre)
+            for artist_id, genres in artist_genres.items()
+            for genre in genres
+        ],
+        batch_size=5000,
+        ignore_conflicts=True,
+    )
+
+
+def join_genres(apps, schema_editor):
+    ArtistModel = apps.get_model("lynify", "ArtistModel")
+    ArtistGenre = ArtistModel.artist_genres.through
+    artist_genres = {}
+    for artist_id, genre in ArtistGenre.objects.order_by("id").values_list("artistmodel_id", "genremodel_id"):
+        artist_genres.setdefault(artist_id, []).append(genre)
+    artists = list(ArtistModel.objects.only("artist_id"))
+    for artist in artists:
+        artist.artist_genres_text = str(artist_genres.get(artist.artist_id, []))
+    ArtistModel.objects.bulk_update(artists, ["artist_genres_text"], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0006_play_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GenreModel",
+            fields=[
+                ("genre_name", models.TextField(primary_key=True, serialize=False)),
+            ],
+            options={
+                "db_table": "genres",
+                "ordering": ["genre_name"],
+                "managed": True,
+            },
+        ),
+        migrations.RenameField(
+            model_name="artistmodel",
+            old_name="artist_genres",
+            new_name="artist_genres_text",
+        ),
+        migrations.AddField(
+            model_name="artistmodel",
+            name="artist_genres",
+            field=models.ManyToManyField(to="lynify.genremodel"),
+        ),
+        migrations.RunPython(split_genres, join_genres),
+        migrations.RemoveField(
+            model_name="artistmodel",
+            name="artist_genres_text",
+        ),
+    ]
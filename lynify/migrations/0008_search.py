@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0007_genres"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trackmodel",
+            name="track_search",
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        # index the existing tracks
+        migrations.RunSQL(
+            sql="""
+                UPDATE tracks SET track_search =
+                    setweight(to_tsvector('simple', COALESCE(track_name, '')), 'A')
+                    || setweight(to_tsvector('simple', COALESCE((
+                        SELECT string_agg(a.artist_name, ' ')
+                        FROM tracks_track_artists ta JOIN artists a ON a.artist_id = ta.artistmodel_id
+                        WHERE ta.trackmodel_id = tracks.track_id
+                    ), '')), 'B')
+                    || setweight(to_tsvector('simple', COALESCE(track_album, '')), 'C')
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector("artist_name", config="simple"), name="artists_search_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=django.contrib.postgres.indexes.GinIndex(fields=["track_search"], name="tracks_search_idx"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0008_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artistmodel",
+            name="artist_refreshed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="trackmodel",
+            name="track_refreshed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=models.Index(
+                models.OrderBy(models.F("artist_refreshed_at"), nulls_first=True),
+                models.OrderBy(models.F("artist_play_count"), descending=True),
+                name="artists_refreshed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=models.Index(
+                models.OrderBy(models.F("track_refreshed_at"), nulls_first=True),
+                models.OrderBy(models.F("track_play_count"), descending=True),
+                name="tracks_refreshed_idx",
+            ),
+        ),
+    ]
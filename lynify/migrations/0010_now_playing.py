@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0009_metadata_refresh"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NowPlayingModel",
+            fields=[
+                ("user_id", models.TextField(primary_key=True, serialize=False)),
+                ("is_playing", models.BooleanField(default=False)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("progress_ms", models.IntegerField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField()),
+                ("changed_at", models.DateTimeField()),
+                (
+                    "track",
+                    models.ForeignKey(
+                        blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to="lynify.trackmodel"
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "now_playing",
+                "managed": True,
+                "indexes": [models.Index(fields=["changed_at"], name="now_playing_changed_idx")],
+            },
+        ),
+    ]
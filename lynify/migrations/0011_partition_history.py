@@ -0,0 +1,103 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+HISTORY_COLUMNS = "timestamp, track_id, id, user_id, ms_played"
+
+# history's constraints and indexes, recreated on the new table once the plays are copied
+HISTORY_CONSTRAINTS_SQL = [
+    "ALTER TABLE history ADD CONSTRAINT history_user_timestamp_uniq UNIQUE (user_id, timestamp)",
+    "CREATE INDEX history_track_id_1dd58b53 ON history (track_id)",
+    "CREATE INDEX history_track_id_1dd58b53_like ON history (track_id text_pattern_ops)",
+    "ALTER TABLE history ADD CONSTRAINT history_track_id_1dd58b53_fk_tracks_track_id"
+    " FOREIGN KEY (track_id) REFERENCES tracks (track_id) DEFERRABLE INITIALLY DEFERRED",
+]
+
+PARTITION_SQL = [
+    """
+    CREATE TABLE history_partitioned (
+        timestamp timestamp with time zone NOT NULL,
+        track_id text NOT NULL,
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        user_id text NOT NULL,
+        ms_played integer
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "CREATE TABLE history_default PARTITION OF history_partitioned DEFAULT",
+    # a partition per UTC month with plays, and for the current and next three months,
+    # the poller and the history_partitions command create later ones
+    """
+    DO $$
+    DECLARE
+        month timestamp;
+    BEGIN
+        FOR month IN
+            SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC') FROM history
+            UNION
+            SELECT generate_series(
+                date_trunc('month', now() AT TIME ZONE 'UTC'),
+                date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+                interval '1 month'
+            )
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF history_partitioned FOR VALUES FROM (%L) TO (%L)',
+                'history_' || to_char(month, 'YYYY_MM'),
+                month AT TIME ZONE 'UTC',
+                (month + interval '1 month') AT TIME ZONE 'UTC'
+            );
+        END LOOP;
+    END $$
+    """,
+    "INSERT INTO history_partitioned (" + HISTORY_COLUMNS + ") SELECT " + HISTORY_COLUMNS + " FROM history",
+    "SELECT setval(pg_get_serial_sequence('history_partitioned', 'id'), (SELECT max(id) FROM history))",
+    "DROP TABLE history",
+    "ALTER TABLE history_partitioned RENAME TO history",
+    "ALTER SEQUENCE history_partitioned_id_seq RENAME TO history_id_seq",
+    # unique constraints of a partitioned table have to include the partition key
+    "ALTER TABLE history ADD CONSTRAINT history_pkey PRIMARY KEY (id, timestamp)",
+    *HISTORY_CONSTRAINTS_SQL,
+    # plays are appended in timestamp order, so a block range index finds a time range at a fraction of a btree's size
+    "CREATE INDEX history_timestamp_brin ON history USING brin (timestamp)",
+]
+
+# back to a plain table, with the plays of the attached partitions
+UNPARTITION_SQL = [
+    """
+    CREATE TABLE history_unpartitioned (
+        timestamp timestamp with time zone NOT NULL,
+        track_id text NOT NULL,
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        user_id text NOT NULL,
+        ms_played integer
+    )
+    """,
+    "INSERT INTO history_unpartitioned (" + HISTORY_COLUMNS + ") SELECT " + HISTORY_COLUMNS + " FROM history",
+    "SELECT setval(pg_get_serial_sequence('history_unpartitioned', 'id'), (SELECT max(id) FROM history))",
+    "DROP TABLE history",
+    "ALTER TABLE history_unpartitioned RENAME TO history",
+    "ALTER SEQUENCE history_unpartitioned_id_seq RENAME TO history_id_seq",
+    "ALTER TABLE history ADD CONSTRAINT history_pkey PRIMARY KEY (id)",
+    *HISTORY_CONSTRAINTS_SQL,
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0010_now_playing"),
+    ]
+
+    operations = [
+        # history becomes partitioned by month, its plays are copied over.
+        # The primary key is (id, timestamp) in the database, id stays the model's primary key.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(sql=PARTITION_SQL, reverse_sql=UNPARTITION_SQL)],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="historymodel",
+                    index=django.contrib.postgres.indexes.BrinIndex(
+                        fields=["timestamp"], name="history_timestamp_brin"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:33
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lynify", "0011_partition_history"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name="artistmodel",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["artist_name"], name="artists_name_trgm_idx", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["track_name"], name="tracks_name_trgm_idx", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trackmodel",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["track_album"], name="tracks_album_trgm_idx", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+    ]
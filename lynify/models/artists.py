@@ -1,34 +1,253 @@
-from django.db import models
-from spotipy import Spotify
+import asyncio
+import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from lynify.models.genres import GenreModel
 from lynify.models.tokens import AccessToken
+from lynify.settings import METADATA_REFRESH_MIN_AGE
+from lynify.utils.async_spotify import get_async_spotify
+from lynify.utils.spotify import get_spotify
+
+# maximum number of ids accepted by spotify's several-artists endpoint
+ARTISTS_PER_REQUEST = 50
 
 
 class ArtistModel(models.Model):
     artist_id = models.TextField(primary_key=True)
     artist_name = models.TextField(blank=True, null=True)
-    artist_genres = models.TextField(blank=True, null=True)
+    # the artist_genres through table is indexed on genre, for filtering by genre
+    artist_genres = models.ManyToManyField(GenreModel)
     artist_popularity = models.IntegerField(blank=True, null=True)
     artist_followers = models.IntegerField(blank=True, null=True)
+    # listening counters, kept up to date as history is recorded
+    artist_play_count = models.IntegerField(default=0)
+    artist_total_ms_played = models.BigIntegerField(default=0)
+    artist_last_played_at = models.DateTimeField(blank=True, null=True)
+    # when the metadata was last fetched from spotify, null if before this was recorded
+    artist_refreshed_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         managed = True
         db_table = "artists"
-        ordering = ["-artist_followers"]
+        ordering = ["-artist_followers", "-artist_id"]
+        indexes = [
+            models.Index(fields=["-artist_followers", "-artist_id"], name="artists_followers_idx"),
+            models.Index(fields=["-artist_play_count", "-artist_id"], name="artists_play_count_idx"),
+            models.Index(fields=["-artist_last_played_at", "-artist_id"], name="artists_last_played_idx"),
+            GinIndex(SearchVector("artist_name", config="simple"), name="artists_search_idx"),
+            GinIndex(fields=["artist_name"], opclasses=["gin_trgm_ops"], name="artists_name_trgm_idx"),
+            models.Index(
+                F("artist_refreshed_at").asc(nulls_first=True),
+                F("artist_play_count").desc(),
+                name="artists_refreshed_idx",
+            ),
+        ]
+
+    @staticmethod
+    def from_spotify(artist_id, user_id: Optional[str] = None):
+        return ArtistModel.from_spotify_many([artist_id], user_id=user_id).get(artist_id)
 
     @staticmethod
-    def from_spotify(artist_id):
-        access_token = AccessToken.get_token()
+    def from_spotify_many(artist_ids: Iterable[str], user_id: Optional[str] = None) -> Dict[str, "ArtistModel"]:
+        """
+        Get artists by id, returning a dict of artist id to artist.
+        Artists already in the database are not fetched again, the rest are
+        fetched from spotify in batches of ARTISTS_PER_REQUEST.
+        Ids that could not be resolved are left out of the result.
+        Requests are made with user_id's token, the default user's if not given.
+        """
+        artists, artist_responses = ArtistModel.fetch_missing(artist_ids, user_id)
+        artists.update(ArtistModel.store(artist_responses))
+        return artists
+
+    @staticmethod
+    async def afrom_spotify_many(artist_ids: Iterable[str], user_id: Optional[str] = None) -> Dict[str, "ArtistModel"]:
+        """
+        Async version of from_spotify_many, making the batched requests
+        concurrently and without blocking
+        """
+        artists, artist_responses = await ArtistModel.afetch_missing(artist_ids, user_id)
+        artists.update(await sync_to_async(ArtistModel.store)(artist_responses))
+        return artists
+
+    @staticmethod
+    def fetch_missing(
+        artist_ids: Iterable[str], user_id: Optional[str] = None
+    ) -> Tuple[Dict[str, "ArtistModel"], Dict[str, dict]]:
+        """
+        Returns the stored artists among artist_ids by id, and spotify's
+        responses for the rest by requested id, without storing anything
+        """
+        artist_ids = list(dict.fromkeys(artist_ids))
+        artists = ArtistModel.objects.in_bulk(artist_ids)
+        missing = [artist_id for artist_id in artist_ids if artist_id not in artists]
+        if not missing:
+            return artists, {}
+        access_token = AccessToken.get_token(user_id)
+        if access_token is None:
+            return artists, {}
+        spotify = get_spotify(access_token.user_id)
+
+        artist_responses = {}
+        for i in range(0, len(missing), ARTISTS_PER_REQUEST):
+            batch = missing[i : i + ARTISTS_PER_REQUEST]
+            response = spotify.artists(batch)
+            if response is None:
+                continue
+            for artist_id, artist_response in zip(batch, response["artists"]):
+                if artist_response is not None:
+                    artist_responses[artist_id] = artist_response
+        return artists, artist_responses
+
+    @staticmethod
+    async def afetch_missing(
+        artist_ids: Iterable[str], user_id: Optional[str] = None
+    ) -> Tuple[Dict[str, "ArtistModel"], Dict[str, dict]]:
+        """
+        Async version of fetch_missing, making the batched requests concurrently
+        """
+        artist_ids = list(dict.fromkeys(artist_ids))
+        artists = await ArtistModel.objects.ain_bulk(artist_ids)
+        missing = [artist_id for artist_id in artist_ids if artist_id not in artists]
+        if not missing:
+            return artists, {}
+        access_token = await sync_to_async(AccessToken.get_token)(user_id)
         if access_token is None:
-            return None
-        artist_response = Spotify(access_token.access_token).artist(artist_id)
-        if artist_response is None:
-            return None
-        artist = ArtistModel()
-        artist.artist_id = artist_response["id"]
-        artist.artist_name = artist_response["name"]
-        artist.artist_genres = str(artist_response["genres"])
-        artist.artist_popularity = artist_response["popularity"]
-        artist.artist_followers = artist_response["followers"]["total"]
-        artist.save()
-        return artist
+            return artists, {}
+        spotify = get_async_spotify(access_token.user_id)
+
+        batches = [missing[i : i + ARTISTS_PER_REQUEST] for i in range(0, len(missing), ARTISTS_PER_REQUEST)]
+        responses = await asyncio.gather(*(spotify.artists(batch) for batch in batches))
+        artist_responses = {}
+        for batch, response in zip(batches, responses):
+            if response is None:
+                continue
+            for artist_id, artist_response in zip(batch, response["artists"]):
+                if artist_response is not None:
+                    artist_responses[artist_id] = artist_response
+        return artists, artist_responses
+
+    @staticmethod
+    def store(artist_responses: Dict[str, dict]) -> Dict[str, "ArtistModel"]:
+        """
+        Insert artists from spotify responses, keyed by the requested id,
+        with their genres, in one transaction of bulk inserts (joining the
+        caller's transaction if there is one). Returns the new artists by
+        requested id.
+        """
+        if not artist_responses:
+            return {}
+        new_artists = {}
+        new_genres = {}
+        now = timezone.now()
+        for artist_id, artist_response in artist_responses.items():
+            artist = ArtistModel()
+            artist.artist_id = artist_response["id"]
+            artist.set_metadata(artist_response, now)
+            new_artists[artist_id] = artist
+            new_genres[artist.artist_id] = artist_response["genres"]
+        with transaction.atomic(savepoint=False):
+            ArtistModel.objects.bulk_create(new_artists.values(), ignore_conflicts=True)
+            ArtistModel.add_genres(new_genres)
+        return new_artists
+
+    def set_metadata(self, artist_response: dict, refreshed_at: datetime.datetime):
+        self.artist_name = artist_response["name"]
+        self.artist_popularity = artist_response["popularity"]
+        self.artist_followers = artist_response["followers"]["total"]
+        self.artist_refreshed_at = refreshed_at
+
+    @staticmethod
+    def stale(limit: int) -> List["ArtistModel"]:
+        """
+        Returns up to limit artists whose metadata is older than
+        METADATA_REFRESH_MIN_AGE, the stalest first and the most played
+        first among equally stale ones
+        """
+        stale_before = timezone.now() - datetime.timedelta(seconds=METADATA_REFRESH_MIN_AGE)
+        return list(
+            ArtistModel.objects.filter(
+                Q(artist_refreshed_at__isnull=True) | Q(artist_refreshed_at__lt=stale_before)
+            ).order_by(F("artist_refreshed_at").asc(nulls_first=True), "-artist_play_count")[:limit]
+        )
+
+    @staticmethod
+    def refresh_stale(max_requests: int, user_id: Optional[str] = None) -> int:
+        """
+        Fetch the metadata of the stalest artists again, with at most
+        max_requests batched requests, and write it back with bulk updates.
+        Requests are made with user_id's token, the default user's if not given.
+        Returns the number of requests made.
+        """
+        artists = ArtistModel.stale(max_requests * ARTISTS_PER_REQUEST)
+        if not artists:
+            return 0
+        access_token = AccessToken.get_token(user_id)
+        if access_token is None:
+            return 0
+        spotify = get_spotify(access_token.user_id)
+
+        requests = 0
+        renamed = []
+        genres = {}
+        now = timezone.now()
+        for i in range(0, len(artists), ARTISTS_PER_REQUEST):
+            batch = artists[i : i + ARTISTS_PER_REQUEST]
+            response = spotify.artists([artist.artist_id for artist in batch])
+            requests += 1
+            if response is None:
+                continue
+            for artist, artist_response in zip(batch, response["artists"]):
+                # artists gone from spotify keep their metadata, but aren't retried until they're stale again
+                artist.artist_refreshed_at = now
+                if artist_response is None:
+                    continue
+                if artist_response["name"] != artist.artist_name:
+                    renamed.append(artist.artist_id)
+                artist.set_metadata(artist_response, now)
+                genres[artist.artist_id] = artist_response["genres"]
+        with transaction.atomic():
+            ArtistModel.objects.bulk_update(
+                artists,
+                ["artist_name", "artist_popularity", "artist_followers", "artist_refreshed_at"],
+                batch_size=ARTISTS_PER_REQUEST * 10,
+            )
+            # replace the genres, an artist's genres change over time
+            ArtistModel.artist_genres.through.objects.filter(artistmodel_id__in=list(genres)).delete()
+            ArtistModel.add_genres(genres)
+            if renamed:
+                # artist names are part of their tracks' search documents
+                from lynify.models.tracks import TrackModel
+
+                TrackModel.update_search(
+                    list(
+                        TrackModel.track_artists.through.objects.filter(artistmodel_id__in=renamed)
+                        .values_list("trackmodel_id", flat=True)
+                        .distinct()
+                    )
+                )
+        return requests
+
+    @staticmethod
+    def add_genres(artist_genres: Dict[str, List[str]]):
+        """
+        Store the genres of artists, given a dict of artist id to genre names
+        """
+        genre_names = {genre for genres in artist_genres.values() for genre in genres}
+        GenreModel.objects.bulk_create([GenreModel(genre_name=genre) for genre in genre_names], ignore_conflicts=True)
+        ArtistGenre = ArtistModel.artist_genres.through
+        ArtistGenre.objects.bulk_create(
+            [
+                ArtistGenre(artistmodel_id=artist_id, genremodel_id=genre)
+                for artist_id, genres in artist_genres.items()
+                for genre in genres
+            ],
+            ignore_conflicts=True,
+        )
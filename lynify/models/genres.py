@@ -0,0 +1,10 @@
+from django.db import models
+
+
+class GenreModel(models.Model):
+    genre_name = models.TextField(primary_key=True)
+
+    class Meta:
+        managed = True
+        db_table = "genres"
+        ordering = ["genre_name"]
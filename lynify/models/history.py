@@ -1,35 +1,193 @@
 import datetime
+from typing import Dict, List, Optional
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import connection, models
 
+from lynify.metrics import POLL_LAG
+from lynify.settings import SPOTIFY_USER_ID
+
+from .stats import ADD_ARTIST_COUNTERS_SQL, ADD_ARTIST_STATS_SQL, ADD_TRACK_COUNTERS_SQL, ADD_TRACK_STATS_SQL
 from .tracks import TrackModel
 
+# plays inserted per statement
+RECORD_BATCH_SIZE = 1000
+
 
 class HistoryModel(models.Model):
-    timestamp = models.DateTimeField(primary_key=True)
+    id = models.BigAutoField(primary_key=True)
+    user_id = models.TextField()
+    timestamp = models.DateTimeField()
     track = models.ForeignKey(TrackModel, on_delete=models.DO_NOTHING)
+    # how long the track was listened to, if known
+    ms_played = models.IntegerField(blank=True, null=True)
 
     class Meta:
         managed = True
         db_table = "history"
         ordering = ["-timestamp"]
+        constraints = [models.UniqueConstraint(fields=["user_id", "timestamp"], name="history_user_timestamp_uniq")]
+        # the table is partitioned by month of timestamp (see partitions.py), so its
+        # primary key is (id, timestamp) in the database
+        indexes = [BrinIndex(fields=["timestamp"], name="history_timestamp_brin")]
 
     @staticmethod
-    def from_spotify(history):
+    def from_spotify(history, user_id: Optional[str] = None):
+        """
+        Record a currently playing response as a play of the user.
+        The user's last play is kept in memory, so polling the same play again
+        doesn't touch the database, and the insert ignores plays that are
+        already stored (e.g. by another poller).
+        """
+        if user_id is None:
+            user_id = SPOTIFY_USER_ID
+        timestamp = _playing_timestamp(history)
+        item = history["item"]
+        last_play = _last_play(user_id)
+        # if the last track is the same and started less than its duration ago, it's the same play
+        if (
+            last_play is not None
+            and last_play.track_id == item["id"]
+            and datetime.timedelta(0)
+            <= timestamp - last_play.timestamp
+            < datetime.timedelta(milliseconds=item["duration_ms"])
+        ):
+            return last_play
         history_model = HistoryModel()
-        history_model.timestamp = datetime.datetime.fromtimestamp(history["timestamp"] / 1000.0, tz=datetime.UTC)
-        history_model.track = TrackModel.from_spotify(history["item"]["id"])
-        # get most recent entry in history
-        try:
-            most_recent = HistoryModel.objects.all()[0]
-            # if the most recent track is the same, check duration
-            if most_recent.track.track_id == history_model.track.track_id:
-                # if the duration is the same, don't save
-                if (history_model.timestamp - most_recent.timestamp) < datetime.timedelta(
-                    milliseconds=history_model.track.track_duration
-                ):
-                    return most_recent
-        except IndexError:
-            pass
-        history_model.save()
+        history_model.user_id = user_id
+        history_model.timestamp = timestamp
+        history_model.track = TrackModel.from_spotify(item["id"], user_id=user_id)
+        if HistoryModel.record([history_model]):
+            now = datetime.datetime.now(tz=datetime.UTC)
+            POLL_LAG.labels("currently_playing").observe((now - timestamp).total_seconds())
+        _last_plays[user_id] = history_model
         return history_model
+
+    @staticmethod
+    async def afrom_spotify(history, user_id: Optional[str] = None):
+        """
+        Async version of from_spotify, fetching an unknown track without blocking
+        """
+        await TrackModel.afrom_spotify_many([history["item"]["id"]], user_id=user_id)
+        # the track is stored now, so recording the play only queries the database
+        return await sync_to_async(HistoryModel.from_spotify)(history, user_id=user_id)
+
+    @staticmethod
+    async def aplaying(history, user_id: Optional[str] = None) -> Optional["HistoryModel"]:
+        """
+        The play of a currently playing response, fetching an unknown track,
+        without recording it. None if the track can't be resolved.
+        """
+        if user_id is None:
+            user_id = SPOTIFY_USER_ID
+        track = await TrackModel.afrom_spotify(history["item"]["id"], user_id=user_id)
+        if track is None:
+            return None
+        history_model = HistoryModel()
+        history_model.user_id = user_id
+        history_model.timestamp = _playing_timestamp(history)
+        history_model.track = track
+        return history_model
+
+    @staticmethod
+    def from_recently_played(items: List[dict], user_id: str) -> List["HistoryModel"]:
+        """
+        Record plays from spotify's recently played endpoint in one bulk insert,
+        resolving all of their tracks together. Plays already recorded are ignored.
+        """
+        items = [item for item in items if item["track"]["id"] is not None]
+        tracks = TrackModel.from_spotify_many((item["track"]["id"] for item in items), user_id=user_id)
+        entries = []
+        played_ats = {}
+        for item in items:
+            track = tracks.get(item["track"]["id"])
+            if track is None:
+                continue
+            # played_at is when the track finished, history is keyed by when it started
+            played_at = datetime.datetime.fromisoformat(item["played_at"])
+            history_model = HistoryModel()
+            history_model.user_id = user_id
+            history_model.timestamp = played_at - datetime.timedelta(milliseconds=track.track_duration or 0)
+            history_model.track = track
+            entries.append(history_model)
+            played_ats[history_model.timestamp] = played_at
+        now = datetime.datetime.now(tz=datetime.UTC)
+        for entry in HistoryModel.record(entries):
+            POLL_LAG.labels("recently_played").observe((now - played_ats[entry.timestamp]).total_seconds())
+        return entries
+
+    @staticmethod
+    def record(entries: List["HistoryModel"]) -> List["HistoryModel"]:
+        """
+        Insert plays, ignoring ones already stored, and add the new ones to the
+        daily rollups and play counters in the same statement.
+        Returns the plays that were new.
+        """
+        # one entry per play, a repeated play would be ignored by the insert anyway
+        entries = list({(entry.user_id, entry.timestamp): entry for entry in entries}.values())
+        inserted = []
+        with connection.cursor() as cursor:
+            for i in range(0, len(entries), RECORD_BATCH_SIZE):
+                batch = entries[i : i + RECORD_BATCH_SIZE]
+                params = []
+                for entry in batch:
+                    params += [entry.user_id, entry.timestamp, entry.track_id, entry.ms_played]
+                cursor.execute(_record_sql(len(batch)), params)
+                ids = {(user_id, timestamp): history_id for history_id, user_id, timestamp in cursor.fetchall()}
+                for entry in batch:
+                    history_id = ids.get((entry.user_id, entry.timestamp))
+                    if history_id is not None:
+                        entry.id = history_id
+                        inserted.append(entry)
+        return inserted
+
+    @staticmethod
+    def last_played_at(user_id: str) -> Optional[int]:
+        """
+        Unix ms time the user's most recent recorded play ended, if there is one
+        """
+        most_recent = HistoryModel.objects.filter(user_id=user_id).select_related("track").first()
+        if most_recent is None:
+            return None
+        return int(most_recent.timestamp.timestamp() * 1000) + (most_recent.track.track_duration or 0)
+
+
+def _playing_timestamp(history: dict) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(history["timestamp"] / 1000.0, tz=datetime.UTC)
+
+
+def _record_sql(rows: int) -> str:
+    """
+    A single statement inserting rows of (user_id, timestamp, track_id, ms_played)
+    into history and adding the inserted ones to the rollups and play counters,
+    returning the inserted rows
+    """
+    values = ", ".join(["(%s, %s::timestamptz, %s, %s::integer)"] * rows)
+    return (
+        "WITH new_plays AS ("
+        " INSERT INTO history (user_id, timestamp, track_id, ms_played) VALUES " + values + ""
+        " ON CONFLICT (user_id, timestamp) DO NOTHING"
+        " RETURNING id, user_id, timestamp, track_id, ms_played"
+        "), track_stats AS (" + ADD_TRACK_STATS_SQL.format(plays="new_plays") + ""
+        "), artist_stats AS (" + ADD_ARTIST_STATS_SQL.format(plays="new_plays") + ""
+        "), track_counters AS (" + ADD_TRACK_COUNTERS_SQL.format(plays="new_plays") + ""
+        "), artist_counters AS (" + ADD_ARTIST_COUNTERS_SQL.format(plays="new_plays") + ""
+        ") SELECT id, user_id, timestamp FROM new_plays"
+    )
+
+
+# each user's last play recorded by this process
+_last_plays: Dict[str, HistoryModel] = {}
+
+
+def _last_play(user_id: str) -> Optional[HistoryModel]:
+    """
+    Returns the user's last play, reading it from the database only the first time
+    """
+    if user_id not in _last_plays:
+        most_recent = HistoryModel.objects.filter(user_id=user_id).first()
+        if most_recent is None:
+            return None
+        _last_plays[user_id] = most_recent
+    return _last_plays[user_id]
@@ -0,0 +1,100 @@
+import datetime
+from typing import List, Optional, Union
+
+from django.db import connection, models
+from django.utils import timezone
+
+from .tracks import TrackModel
+
+# Stores a user's snapshot, moving changed_at only when what is playing
+# changed, so readers can look for changes without comparing snapshots
+PUBLISH_SQL = """
+    INSERT INTO now_playing (user_id, is_playing, track_id, started_at, progress_ms, error, updated_at, changed_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE SET
+        is_playing = EXCLUDED.is_playing,
+        track_id = EXCLUDED.track_id,
+        started_at = EXCLUDED.started_at,
+        progress_ms = EXCLUDED.progress_ms,
+        error = EXCLUDED.error,
+        updated_at = EXCLUDED.updated_at,
+        changed_at = CASE
+            WHEN (now_playing.is_playing, now_playing.track_id, now_playing.started_at, now_playing.error)
+                IS DISTINCT FROM (EXCLUDED.is_playing, EXCLUDED.track_id, EXCLUDED.started_at, EXCLUDED.error)
+            THEN EXCLUDED.changed_at
+            ELSE now_playing.changed_at
+        END
+    RETURNING changed_at
+"""
+
+
+class NowPlayingModel(models.Model):
+    """
+    The latest currently playing snapshot of each user, published by the
+    poller so pages can show it without calling spotify
+    """
+
+    user_id = models.TextField(primary_key=True)
+    is_playing = models.BooleanField(default=False)
+    track = models.ForeignKey(TrackModel, on_delete=models.DO_NOTHING, blank=True, null=True)
+    # when the playing track started, and how far into it playback was when polled
+    started_at = models.DateTimeField(blank=True, null=True)
+    progress_ms = models.IntegerField(blank=True, null=True)
+    # the spotify api error of the last poll, if it failed
+    error = models.TextField(blank=True, null=True)
+    # when the snapshot was last polled, and when what is playing last changed
+    updated_at = models.DateTimeField()
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = "now_playing"
+        indexes = [models.Index(fields=["changed_at"], name="now_playing_changed_idx")]
+
+    @staticmethod
+    def publish(user_id: str, currently_playing: Union[dict, Exception, None], history=None) -> "NowPlayingModel":
+        """
+        Store the snapshot of a currently playing response, with the play it
+        was recorded as if a track is playing
+        """
+        now = timezone.now()
+        snapshot = NowPlayingModel(user_id=user_id, updated_at=now, changed_at=now)
+        if isinstance(currently_playing, Exception):
+            snapshot.error = str(currently_playing)
+        elif history is not None:
+            snapshot.is_playing = True
+            snapshot.track = history.track
+            snapshot.started_at = history.timestamp
+            snapshot.progress_ms = currently_playing["progress_ms"]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                PUBLISH_SQL,
+                [
+                    snapshot.user_id,
+                    snapshot.is_playing,
+                    snapshot.track_id,
+                    snapshot.started_at,
+                    snapshot.progress_ms,
+                    snapshot.error,
+                    snapshot.updated_at,
+                    snapshot.changed_at,
+                ],
+            )
+            snapshot.changed_at = cursor.fetchone()[0]
+        return snapshot
+
+    @staticmethod
+    def latest_change() -> Optional[datetime.datetime]:
+        return NowPlayingModel.objects.aggregate(latest=models.Max("changed_at"))["latest"]
+
+    @staticmethod
+    def changed_since(changed_at: datetime.datetime, user_ids: List[str]) -> List["NowPlayingModel"]:
+        """
+        Returns the snapshots of users that changed after changed_at, oldest change first
+        """
+        return list(
+            NowPlayingModel.objects.filter(user_id__in=user_ids, changed_at__gt=changed_at)
+            .select_related("track")
+            .defer("track__track_search")
+            .order_by("changed_at")
+        )
@@ -0,0 +1,171 @@
+"""
+Monthly partitions of the history table
+
+history is partitioned by the UTC month of its timestamp, with one partition
+per month named history_YYYY_MM, and a default partition catching plays of
+months without one. Partitions are created ahead of time by the poller and
+the history_partitions command, and for the months an import reaches, so the
+default partition stays small.
+
+Old months can be detached, leaving a standalone table that can be dumped
+and dropped, without rewriting anything.
+
+Creating and detaching a partition both need brief exclusive locks, so they
+give up after PARTITION_LOCK_TIMEOUT seconds instead of queueing the queries
+behind them while a long one runs, and try again later. Once it has its
+locks, attaching holds the default partition while scanning it, one more
+reason to keep it small.
+"""
+import datetime
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from django.db import OperationalError, connection, transaction
+
+PARTITION_PREFIX = "history_"
+DEFAULT_PARTITION = "history_default"
+# seconds creating or detaching a partition waits for a lock before backing off, and attempts before giving up
+PARTITION_LOCK_TIMEOUT = 2
+PARTITION_ATTEMPTS = 5
+
+IS_PARTITIONED_SQL = "SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = 'history'::regclass)"
+# the monthly partitions attached to history
+PARTITIONS_SQL = """
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'history'::regclass AND c.relname ~ '^history_[0-9]{4}_[0-9]{2}$'
+    ORDER BY c.relname
+"""
+# months with plays in the default partition
+DEFAULT_PARTITION_MONTHS_SQL = (
+    "SELECT DISTINCT date_trunc('month', timestamp AT TIME ZONE 'UTC') FROM " + DEFAULT_PARTITION
+)
+# Creates a month's partition as a plain table, moves the month's plays out of
+# the default partition into it and attaches it. Unlike creating a partition in
+# place, attaching one only takes a SHARE UPDATE EXCLUSIVE lock on history, but
+# it takes an ACCESS EXCLUSIVE lock on the default partition while checking that
+# none of its rows belong to the month, blocking every query that reaches it.
+CREATE_PARTITION_SQL = [
+    "CREATE TABLE {partition} (LIKE history INCLUDING DEFAULTS)",
+    "WITH moved AS ("
+    " DELETE FROM " + DEFAULT_PARTITION + " WHERE timestamp >= %s AND timestamp < %s RETURNING *"
+    ") INSERT INTO {partition} SELECT * FROM moved",
+    "ALTER TABLE history ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)",
+]
+DETACH_PARTITION_SQL = "ALTER TABLE history DETACH PARTITION {partition}"
+
+
+def month_start(timestamp: datetime.datetime) -> datetime.datetime:
+    return timestamp.astimezone(datetime.UTC).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month: datetime.datetime) -> datetime.datetime:
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return PARTITION_PREFIX + month.strftime("%Y_%m")
+
+
+def partition_month(name: str) -> datetime.datetime:
+    return datetime.datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y_%m").replace(tzinfo=datetime.UTC)
+
+
+def is_partitioned() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute(IS_PARTITIONED_SQL)
+        return cursor.fetchone()[0]
+
+
+def partitions() -> List[str]:
+    """
+    Returns the names of history's monthly partitions, oldest first
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def execute_with_lock_timeout(action: str, statements: List[Tuple[str, Optional[list]]]):
+    """
+    Run statements in a transaction waiting at most PARTITION_LOCK_TIMEOUT
+    seconds for each lock, retried with a growing wait when one times out
+    """
+    for attempt in range(PARTITION_ATTEMPTS):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", [str(PARTITION_LOCK_TIMEOUT) + "s"])
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+            return
+        except OperationalError as e:
+            if attempt == PARTITION_ATTEMPTS - 1:
+                raise
+            print(action + " failed, retrying: " + str(e).strip())
+            time.sleep(PARTITION_LOCK_TIMEOUT * 2**attempt)
+
+
+def create_partitions(months: Iterable[datetime.datetime]) -> List[str]:
+    """
+    Create the missing partitions of the months of some timestamps,
+    returns the names of the created partitions
+    """
+    if not is_partitioned():
+        return []
+    existing = set(partitions())
+    created = []
+    for month in sorted({month_start(timestamp) for timestamp in months}):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        partition = connection.ops.quote_name(name)
+        execute_with_lock_timeout(
+            "Creating " + name,
+            [
+                (sql.format(partition=partition), [month, next_month(month)] if "%s" in sql else None)
+                for sql in CREATE_PARTITION_SQL
+            ],
+        )
+        existing.add(name)
+        created.append(name)
+        print("Created history partition " + name)
+    return created
+
+
+def create_partitions_ahead(months_ahead: int, now: Optional[datetime.datetime] = None) -> List[str]:
+    """
+    Create the partitions of the current month and the months_ahead months
+    after it, and of the months that have plays in the default partition
+    """
+    if not is_partitioned():
+        return []
+    month = month_start(now or datetime.datetime.now(tz=datetime.UTC))
+    months = [month]
+    for _ in range(months_ahead):
+        month = next_month(month)
+        months.append(month)
+    with connection.cursor() as cursor:
+        cursor.execute(DEFAULT_PARTITION_MONTHS_SQL)
+        months += [row[0].replace(tzinfo=datetime.UTC) for row in cursor.fetchall()]
+    return create_partitions(months)
+
+
+def detach_partitions(before: datetime.datetime) -> List[str]:
+    """
+    Detach the partitions of the months before `before`'s month, leaving them
+    as standalone tables, returns the names of the detached partitions.
+    Detaching only changes the catalog, but needs a brief exclusive lock on
+    history, taken with a lock timeout and retried.
+    """
+    if not is_partitioned():
+        return []
+    before = month_start(before)
+    detached = []
+    for name in partitions():
+        if partition_month(name) >= before:
+            continue
+        execute_with_lock_timeout(
+            "Detaching " + name, [(DETACH_PARTITION_SQL.format(partition=connection.ops.quote_name(name)), None)]
+        )
+        detached.append(name)
+        print("Detached history partition " + name)
+    return detached
@@ -0,0 +1,129 @@
+"""
+Daily listening rollups
+
+Per user and day, the number of plays and milliseconds listened of each track
+and artist. They are updated in the same statement that inserts new history
+rows, so stats can be read from them without scanning the history table.
+The same statement keeps the all time play counters on tracks and artists.
+"""
+from typing import Optional
+
+from django.db import connection, models, transaction
+
+from .artists import ArtistModel
+from .tracks import TrackModel
+
+# Upserts adding a set of plays to the rollups. `{plays}` is a relation with
+# user_id, timestamp, track_id and ms_played columns; plays without a known
+# ms_played count as the whole track.
+ADD_TRACK_STATS_SQL = """
+    INSERT INTO daily_track_stats (user_id, day, track_id, play_count, ms_played)
+    SELECT p.user_id, (p.timestamp AT TIME ZONE 'UTC')::date, p.track_id,
+           count(*), sum(COALESCE(p.ms_played, t.track_duration, 0))
+    FROM {plays} p JOIN tracks t ON t.track_id = p.track_id
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, day, track_id) DO UPDATE SET
+        play_count = daily_track_stats.play_count + EXCLUDED.play_count,
+        ms_played = daily_track_stats.ms_played + EXCLUDED.ms_played
+"""
+ADD_ARTIST_STATS_SQL = """
+    INSERT INTO daily_artist_stats (user_id, day, artist_id, play_count, ms_played)
+    SELECT p.user_id, (p.timestamp AT TIME ZONE 'UTC')::date, ta.artistmodel_id,
+           count(*), sum(COALESCE(p.ms_played, t.track_duration, 0))
+    FROM {plays} p
+    JOIN tracks t ON t.track_id = p.track_id
+    JOIN tracks_track_artists ta ON ta.trackmodel_id = p.track_id
+    GROUP BY 1, 2, 3
+    ON CONFLICT (user_id, day, artist_id) DO UPDATE SET
+        play_count = daily_artist_stats.play_count + EXCLUDED.play_count,
+        ms_played = daily_artist_stats.ms_played + EXCLUDED.ms_played
+"""
+
+# Updates adding a set of plays to the play counters on tracks and artists
+ADD_TRACK_COUNTERS_SQL = """
+    UPDATE tracks SET
+        track_play_count = tracks.track_play_count + c.plays,
+        track_total_ms_played = tracks.track_total_ms_played + c.ms_played,
+        track_last_played_at = GREATEST(tracks.track_last_played_at, c.last_played_at)
+    FROM (
+        SELECT p.track_id, count(*) AS plays, sum(COALESCE(p.ms_played, t.track_duration, 0)) AS ms_played,
+               max(p.timestamp) AS last_played_at
+        FROM {plays} p JOIN tracks t ON t.track_id = p.track_id
+        GROUP BY 1
+    ) c
+    WHERE tracks.track_id = c.track_id
+"""
+ADD_ARTIST_COUNTERS_SQL = """
+    UPDATE artists SET
+        artist_play_count = artists.artist_play_count + c.plays,
+        artist_total_ms_played = artists.artist_total_ms_played + c.ms_played,
+        artist_last_played_at = GREATEST(artists.artist_last_played_at, c.last_played_at)
+    FROM (
+        SELECT ta.artistmodel_id AS artist_id, count(*) AS plays,
+               sum(COALESCE(p.ms_played, t.track_duration, 0)) AS ms_played, max(p.timestamp) AS last_played_at
+        FROM {plays} p
+        JOIN tracks t ON t.track_id = p.track_id
+        JOIN tracks_track_artists ta ON ta.trackmodel_id = p.track_id
+        GROUP BY 1
+    ) c
+    WHERE artists.artist_id = c.artist_id
+"""
+
+
+class DailyTrackStatsModel(models.Model):
+    user_id = models.TextField()
+    day = models.DateField()
+    track = models.ForeignKey(TrackModel, on_delete=models.DO_NOTHING)
+    play_count = models.IntegerField(default=0)
+    ms_played = models.BigIntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = "daily_track_stats"
+        constraints = [models.UniqueConstraint(fields=["user_id", "day", "track"], name="daily_track_stats_uniq")]
+
+
+class DailyArtistStatsModel(models.Model):
+    user_id = models.TextField()
+    day = models.DateField()
+    artist = models.ForeignKey(ArtistModel, on_delete=models.DO_NOTHING)
+    play_count = models.IntegerField(default=0)
+    ms_played = models.BigIntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = "daily_artist_stats"
+        constraints = [models.UniqueConstraint(fields=["user_id", "day", "artist"], name="daily_artist_stats_uniq")]
+
+
+def rebuild_rollups(user_id: Optional[str] = None):
+    """
+    Recompute the rollups from the raw history, for one user or everyone
+    """
+    if user_id is None:
+        plays = "history"
+        params = []
+    else:
+        plays = "(SELECT * FROM history WHERE user_id = %s)"
+        params = [user_id]
+    with transaction.atomic():
+        for model in (DailyTrackStatsModel, DailyArtistStatsModel):
+            rollups = model.objects.all()
+            if user_id is not None:
+                rollups = rollups.filter(user_id=user_id)
+            rollups.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(ADD_TRACK_STATS_SQL.format(plays=plays), params)
+            cursor.execute(ADD_ARTIST_STATS_SQL.format(plays=plays), params)
+
+
+def rebuild_play_counters():
+    """
+    Recompute the play counters on all tracks and artists from the raw history
+    """
+    with transaction.atomic():
+        TrackModel.objects.update(track_play_count=0, track_total_ms_played=0, track_last_played_at=None)
+        ArtistModel.objects.update(artist_play_count=0, artist_total_ms_played=0, artist_last_played_at=None)
+        with connection.cursor() as cursor:
+            cursor.execute(ADD_TRACK_COUNTERS_SQL.format(plays="history"))
+            cursor.execute(ADD_ARTIST_COUNTERS_SQL.format(plays="history"))
@@ -1,11 +1,28 @@
+import threading
 import time
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
+import requests
 import spotipy
-from django.db import models
-from spotipy.oauth2 import SpotifyOAuth
+from django.db import models, transaction
+from spotipy.cache_handler import CacheFileHandler
 
-from lynify.settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_USER_ID, SPOTIPY_REDIRECT_URI
+from lynify.metrics import TOKEN_REFRESHES
+from lynify.settings import SPOTIFY_USER_ID
+from lynify.utils.async_spotify import get_async_spotify
+from lynify.utils.spotify import get_oauth, get_spotify, get_user_id
+
+# maximum number of plays returned by spotify's recently played endpoint
+RECENTLY_PLAYED_LIMIT = 50
+# refresh tokens this long before they expire
+TOKEN_REFRESH_MARGIN_MS = 60 * 1000
+
+# process local token cache, shared by the web workers' threads and the poller
+_token_cache: Dict[str, "AccessToken"] = {}
+_token_locks: Dict[str, threading.Lock] = {}
+_token_locks_guard = threading.Lock()
+# whether spotipy's cache file was already looked at for a token from before tokens were stored per user
+_cache_file_checked = False
 
 
 class TokenException(Exception):
@@ -19,6 +36,8 @@ class AccessToken(models.Model):
     access_token = models.TextField(blank=True, null=True)
     refresh_token = models.TextField(blank=True, null=True)
     expires_at = models.BigIntegerField(blank=True, null=True)
+    # unix ms cursor of the newest play read from the recently played endpoint
+    recently_played_after = models.BigIntegerField(blank=True, null=True)
 
     class Meta:
         managed = True
@@ -29,72 +48,143 @@ class AccessToken(models.Model):
 
     def get_currently_playing(self) -> Union[dict, TokenException]:
         try:
-            spotify = spotipy.Spotify(auth=self.access_token)
-            response = spotify.current_user_playing_track()
+            response = get_spotify(self.user_id).current_user_playing_track()
         except spotipy.client.SpotifyException as e:
             print("SpotifyException", e)
             return e
         return response
 
+    async def aget_currently_playing(self) -> Union[dict, TokenException]:
+        try:
+            response = await get_async_spotify(self.user_id).current_user_playing_track()
+        except spotipy.client.SpotifyException as e:
+            print("SpotifyException", e)
+            return e
+        return response
+
+    def get_recently_played(self, after: Optional[int] = None) -> Union[dict, TokenException]:
+        try:
+            response = get_spotify(self.user_id).current_user_recently_played(limit=RECENTLY_PLAYED_LIMIT, after=after)
+        except spotipy.client.SpotifyException as e:
+            print("SpotifyException", e)
+            return e
+        return response
+
+    def set_recently_played_after(self, after: int):
+        self.recently_played_after = after
+        AccessToken.objects.filter(user_id=self.user_id).update(recently_played_after=after)
+
     @staticmethod
     def from_spotify(user_id, access_token, refresh_token, expires_at) -> "AccessToken":
-        token = AccessToken()
-        token.user_id = user_id
-        token.access_token = access_token
-        token.refresh_token = refresh_token
-        token.expires_at = expires_at
-        token.save()
+        # update in place so the user's recently played cursor is kept
+        token, _ = AccessToken.objects.update_or_create(
+            user_id=user_id,
+            defaults={"access_token": access_token, "refresh_token": refresh_token, "expires_at": expires_at},
+        )
+        _token_cache[user_id] = token
         return token
 
+    def needs_refresh(self) -> bool:
+        return self.expires_at is None or self.expires_at - TOKEN_REFRESH_MARGIN_MS < int(time.time() * 1000)
+
     @staticmethod
-    def get_token(user_id: Optional[str] = None) -> Union[str, None]:
+    def get_token(user_id: Optional[str] = None) -> Optional["AccessToken"]:
         """
         Get the access token for a user.
-        If the token has expired, refresh it.
+        Tokens are cached in process and refreshed shortly before they expire,
+        with only one caller refreshing at a time while others wait for it.
         If the token has not been set, return None.
         """
         if user_id is None:
             user_id = SPOTIFY_USER_ID
+        token = _token_cache.get(user_id)
+        if token is not None and not token.needs_refresh():
+            return token
+
+        with _token_lock(user_id):
+            # another thread may have loaded or refreshed it while we waited
+            token = _token_cache.get(user_id)
+            if token is not None and not token.needs_refresh():
+                return token
+            token = AccessToken._load_token(user_id)
+            if token is not None and token.needs_refresh():
+                token = AccessToken._refresh_token(user_id)
+            if token is None:
+                _token_cache.pop(user_id, None)
+                return None
+            _token_cache[user_id] = token
+            return token
+
+    @staticmethod
+    def _load_token(user_id: str) -> Optional["AccessToken"]:
         try:
-            token = AccessToken.objects.get(user_id=user_id)
+            return AccessToken.objects.get(user_id=user_id)
         except AccessToken.DoesNotExist:
-            # try to get a cached token
-            oauth = SpotifyOAuth(
-                client_id=SPOTIFY_CLIENT_ID,
-                client_secret=SPOTIFY_CLIENT_SECRET,
-                redirect_uri=SPOTIPY_REDIRECT_URI,
-                scope="user-read-currently-playing",
-            )
-            token = oauth.get_cached_token()
-            if token:
-                token = AccessToken.from_spotify(
-                    user_id,
-                    token["access_token"],
-                    token["refresh_token"],
-                    int(time.time() * 1000) + token["expires_in"] * 1000,
-                )
-            else:
-                return None
+            pass
+        AccessToken._import_cache_file()
+        return AccessToken.objects.filter(user_id=user_id).first()
 
-        if token.expires_at < int(time.time() * 1000):
-            # refresh the token
-            oauth = SpotifyOAuth(
-                client_id=SPOTIFY_CLIENT_ID,
-                client_secret=SPOTIFY_CLIENT_SECRET,
-                redirect_uri=SPOTIPY_REDIRECT_URI,
-                scope="user-read-currently-playing",
-            )
-            refreshed_token = oauth.refresh_access_token(token.refresh_token)
+    @staticmethod
+    def _import_cache_file():
+        """
+        Store the token spotipy's cache file holds from a login before tokens
+        were stored per user, under the user it belongs to, which isn't
+        necessarily the user looked up. Only done once per process.
+        """
+        global _cache_file_checked
+        if _cache_file_checked:
+            return
+        _cache_file_checked = True
+        try:
+            token = get_oauth().validate_token(CacheFileHandler().get_cached_token())
+            if not token:
+                return
+            owner = get_user_id(token["access_token"])
+        except (requests.RequestException, spotipy.SpotifyOauthError) as e:
+            print("Could not import the cached token: " + str(e))
+            return
+        # a token stored since is newer than the cached one
+        AccessToken.objects.get_or_create(
+            user_id=owner,
+            defaults={
+                "access_token": token["access_token"],
+                "refresh_token": token["refresh_token"],
+                "expires_at": token["expires_at"] * 1000,
+            },
+        )
+
+    @staticmethod
+    def _refresh_token(user_id: str) -> Optional["AccessToken"]:
+        """
+        Refresh the token while holding its row lock, so other processes
+        (web workers, the poller) wait and reuse the refreshed token
+        instead of refreshing it again.
+        """
+        with transaction.atomic():
+            try:
+                token = AccessToken.objects.select_for_update().get(user_id=user_id)
+            except AccessToken.DoesNotExist:
+                return None
+            if not token.needs_refresh():
+                return token
+            oauth = get_oauth()
+            try:
+                refreshed_token = oauth.refresh_access_token(token.refresh_token)
+            except Exception:
+                TOKEN_REFRESHES.labels("error").inc()
+                raise
             if refreshed_token is None:
+                TOKEN_REFRESHES.labels("failed").inc()
                 return None
+            TOKEN_REFRESHES.labels("refreshed").inc()
             # update the token
-            expires_at = int(time.time() * 1000) + refreshed_token["expires_in"] * 1000
-            AccessToken.objects.update(
-                access_token=refreshed_token["access_token"],
-                refresh_token=refreshed_token["refresh_token"],
-                expires_at=expires_at,
-            )
-            token = AccessToken.objects.get(user_id=user_id)
+            token.access_token = refreshed_token["access_token"]
+            token.refresh_token = refreshed_token["refresh_token"]
+            token.expires_at = int(time.time() * 1000) + refreshed_token["expires_in"] * 1000
+            token.save(update_fields=["access_token", "refresh_token", "expires_at"])
             return token
 
-        return token
+
+def _token_lock(user_id: str) -> threading.Lock:
+    with _token_locks_guard:
+        return _token_locks.setdefault(user_id, threading.Lock())
@@ -1,10 +1,52 @@
-from django.db import models
-from spotipy import Spotify
+import asyncio
+import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
 
 from lynify.models.tokens import AccessToken
+from lynify.settings import METADATA_REFRESH_MIN_AGE
+from lynify.utils.async_spotify import get_async_spotify
+from lynify.utils.spotify import get_spotify
 
 from .artists import ArtistModel
 
+# maximum number of ids accepted by spotify's several-tracks endpoint
+TRACKS_PER_REQUEST = 50
+
+# Sets the search document of tracks, weighting the track name over its
+# artists' names over the album. The 'simple' config doesn't stem, which
+# suits names. `{where}` limits the tracks updated.
+UPDATE_TRACK_SEARCH_SQL = """
+    UPDATE tracks SET track_search =
+        setweight(to_tsvector('simple', COALESCE(track_name, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE((
+            SELECT string_agg(a.artist_name, ' ')
+            FROM tracks_track_artists ta JOIN artists a ON a.artist_id = ta.artistmodel_id
+            WHERE ta.trackmodel_id = tracks.track_id
+        ), '')), 'B')
+        || setweight(to_tsvector('simple', COALESCE(track_album, '')), 'C')
+    {where}
+"""
+
+
+def parse_release_date(release_date: Optional[str]) -> Optional[str]:
+    """
+    Spotify release dates can have year or month precision ("1999", "1999-05"),
+    pad them to a full date
+    """
+    if not release_date:
+        return None
+    parts = release_date.split("-")
+    while len(parts) < 3:
+        parts.append("01")
+    return "-".join(parts)
+
 
 class TrackModel(models.Model):
     track_id = models.TextField(primary_key=True)
@@ -15,40 +57,238 @@ class TrackModel(models.Model):
     track_release_date = models.DateField(blank=True, null=True)
     track_explicit = models.BooleanField(blank=True, null=True)
     track_artists = models.ManyToManyField(ArtistModel)
+    # listening counters, kept up to date as history is recorded
+    track_play_count = models.IntegerField(default=0)
+    track_total_ms_played = models.BigIntegerField(default=0)
+    track_last_played_at = models.DateTimeField(blank=True, null=True)
+    # when the metadata was last fetched from spotify, null if before this was recorded
+    track_refreshed_at = models.DateTimeField(blank=True, null=True)
+    # full text search document over the name, artists and album
+    track_search = SearchVectorField(blank=True, null=True)
 
     class Meta:
         managed = True
         db_table = "tracks"
-        ordering = ["-track_popularity"]
+        ordering = ["-track_popularity", "-track_id"]
+        indexes = [
+            models.Index(fields=["-track_popularity", "-track_id"], name="tracks_popularity_idx"),
+            models.Index(fields=["-track_play_count", "-track_id"], name="tracks_play_count_idx"),
+            models.Index(fields=["-track_last_played_at", "-track_id"], name="tracks_last_played_idx"),
+            GinIndex(fields=["track_search"], name="tracks_search_idx"),
+            # trigrams of the name and album, for fuzzy search
+            GinIndex(fields=["track_name"], opclasses=["gin_trgm_ops"], name="tracks_name_trgm_idx"),
+            GinIndex(fields=["track_album"], opclasses=["gin_trgm_ops"], name="tracks_album_trgm_idx"),
+            models.Index(
+                F("track_refreshed_at").asc(nulls_first=True), F("track_play_count").desc(), name="tracks_refreshed_idx"
+            ),
+        ]
+
+    @staticmethod
+    def genre_exists(genre: str, track_ref: str = "pk") -> Exists:
+        """
+        Returns a filter for rows whose track, `track_ref` of the outer query,
+        has an artist of the genre. It runs as a semi-join on the indexed
+        through tables rather than a scan of the tracks.
+        """
+        TrackArtist = TrackModel.track_artists.through
+        ArtistGenre = ArtistModel.artist_genres.through
+        genre_artists = ArtistGenre.objects.filter(genremodel_id=genre).values("artistmodel_id")
+        return Exists(TrackArtist.objects.filter(trackmodel_id=OuterRef(track_ref), artistmodel_id__in=genre_artists))
 
     @staticmethod
-    def from_spotify(track_id):
-        # if the track is already in the database, return it
-        try:
-            track = TrackModel.objects.get(track_id=track_id)
-            return track
-        except TrackModel.DoesNotExist:
-            pass
-        access_token = AccessToken.get_token()
+    def update_search(track_ids: Optional[List[str]] = None):
+        """
+        Update the search document of tracks, or of every track
+        """
+        with connection.cursor() as cursor:
+            if track_ids is None:
+                cursor.execute(UPDATE_TRACK_SEARCH_SQL.format(where=""))
+            else:
+                cursor.execute(UPDATE_TRACK_SEARCH_SQL.format(where="WHERE track_id = ANY(%s)"), [track_ids])
+
+    def set_metadata(self, track_response: dict, refreshed_at: datetime.datetime):
+        self.track_name = track_response["name"]
+        self.track_album = track_response["album"]["name"]
+        self.track_duration = track_response["duration_ms"]
+        self.track_popularity = track_response["popularity"]
+        self.track_release_date = parse_release_date(track_response["album"]["release_date"])
+        self.track_explicit = track_response["explicit"]
+        self.track_refreshed_at = refreshed_at
+
+    @staticmethod
+    def stale(limit: int) -> List["TrackModel"]:
+        """
+        Returns up to limit tracks whose metadata is older than
+        METADATA_REFRESH_MIN_AGE, the stalest first and the most played
+        first among equally stale ones
+        """
+        stale_before = timezone.now() - datetime.timedelta(seconds=METADATA_REFRESH_MIN_AGE)
+        return list(
+            TrackModel.objects.filter(Q(track_refreshed_at__isnull=True) | Q(track_refreshed_at__lt=stale_before))
+            .order_by(F("track_refreshed_at").asc(nulls_first=True), "-track_play_count")
+            .defer("track_search")[:limit]
+        )
+
+    @staticmethod
+    def refresh_stale(max_requests: int, user_id: Optional[str] = None) -> int:
+        """
+        Fetch the metadata of the stalest tracks again, with at most
+        max_requests batched requests, and write it back with bulk updates.
+        Requests are made with user_id's token, the default user's if not given.
+        Returns the number of requests made.
+        """
+        tracks = TrackModel.stale(max_requests * TRACKS_PER_REQUEST)
+        if not tracks:
+            return 0
+        access_token = AccessToken.get_token(user_id)
         if access_token is None:
-            return None
-        track_response = Spotify(auth=access_token.access_token).track(track_id)
-        if track_response is None:
-            return None
-        track = TrackModel()
-        track.track_id = track_response["id"]
-        track.track_name = track_response["name"]
-        track.track_album = track_response["album"]["name"]
-        track.track_duration = track_response["duration_ms"]
-        track.track_popularity = track_response["popularity"]
-        track.track_release_date = track_response["album"]["release_date"]
-        track.track_explicit = track_response["explicit"]
-        track.save()
-        # get artists from track
-        artists = []
-        for artist in track_response["artists"]:
-            artist_model = ArtistModel.from_spotify(artist["id"])
-            artists.append(artist_model)
-        track.track_artists.set(artists)
-        track.save()
-        return track
+            return 0
+        spotify = get_spotify(access_token.user_id)
+
+        requests = 0
+        renamed = []
+        now = timezone.now()
+        for i in range(0, len(tracks), TRACKS_PER_REQUEST):
+            batch = tracks[i : i + TRACKS_PER_REQUEST]
+            response = spotify.tracks([track.track_id for track in batch])
+            requests += 1
+            if response is None:
+                continue
+            for track, track_response in zip(batch, response["tracks"]):
+                # tracks gone from spotify keep their metadata, but aren't retried until they're stale again
+                track.track_refreshed_at = now
+                if track_response is None:
+                    continue
+                if (track_response["name"], track_response["album"]["name"]) != (track.track_name, track.track_album):
+                    renamed.append(track.track_id)
+                track.set_metadata(track_response, now)
+        with transaction.atomic():
+            TrackModel.objects.bulk_update(
+                tracks,
+                [
+                    "track_name",
+                    "track_album",
+                    "track_duration",
+                    "track_popularity",
+                    "track_release_date",
+                    "track_explicit",
+                    "track_refreshed_at",
+                ],
+                batch_size=TRACKS_PER_REQUEST * 10,
+            )
+            if renamed:
+                TrackModel.update_search(renamed)
+        return requests
+
+    @staticmethod
+    def from_spotify(track_id, user_id: Optional[str] = None):
+        return TrackModel.from_spotify_many([track_id], user_id=user_id).get(track_id)
+
+    @staticmethod
+    def from_spotify_many(track_ids: Iterable[str], user_id: Optional[str] = None) -> Dict[str, "TrackModel"]:
+        """
+        Get tracks by id, returning a dict of track id to track.
+        Tracks already in the database are not fetched again, the rest are
+        fetched from spotify in batches of TRACKS_PER_REQUEST, followed by
+        their artists that aren't stored yet. Everything fetched is then
+        stored together, see store.
+        Ids that could not be resolved are left out of the result.
+        Requests are made with user_id's token, the default user's if not given.
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        tracks = TrackModel.objects.in_bulk(track_ids)
+        missing = [track_id for track_id in track_ids if track_id not in tracks]
+        if not missing:
+            return tracks
+        access_token = AccessToken.get_token(user_id)
+        if access_token is None:
+            return tracks
+        spotify = get_spotify(access_token.user_id)
+
+        track_responses = {}
+        for i in range(0, len(missing), TRACKS_PER_REQUEST):
+            batch = missing[i : i + TRACKS_PER_REQUEST]
+            response = spotify.tracks(batch)
+            if response is None:
+                continue
+            for track_id, track_response in zip(batch, response["tracks"]):
+                if track_response is not None:
+                    track_responses[track_id] = track_response
+        if not track_responses:
+            return tracks
+        artists, artist_responses = ArtistModel.fetch_missing(track_artist_ids(track_responses), user_id=user_id)
+        tracks.update(TrackModel.store(track_responses, artist_responses, list(artists)))
+        return tracks
+
+    @staticmethod
+    async def afrom_spotify(track_id, user_id: Optional[str] = None):
+        return (await TrackModel.afrom_spotify_many([track_id], user_id=user_id)).get(track_id)
+
+    @staticmethod
+    async def afrom_spotify_many(track_ids: Iterable[str], user_id: Optional[str] = None) -> Dict[str, "TrackModel"]:
+        """
+        Async version of from_spotify_many, making the batched requests for
+        tracks and then their artists concurrently and without blocking
+        """
+        track_ids = list(dict.fromkeys(track_ids))
+        tracks = await TrackModel.objects.ain_bulk(track_ids)
+        missing = [track_id for track_id in track_ids if track_id not in tracks]
+        if not missing:
+            return tracks
+        access_token = await sync_to_async(AccessToken.get_token)(user_id)
+        if access_token is None:
+            return tracks
+        spotify = get_async_spotify(access_token.user_id)
+
+        batches = [missing[i : i + TRACKS_PER_REQUEST] for i in range(0, len(missing), TRACKS_PER_REQUEST)]
+        responses = await asyncio.gather(*(spotify.tracks(batch) for batch in batches))
+        track_responses = {}
+        for batch, response in zip(batches, responses):
+            if response is None:
+                continue
+            for track_id, track_response in zip(batch, response["tracks"]):
+                if track_response is not None:
+                    track_responses[track_id] = track_response
+        if not track_responses:
+            return tracks
+        artists, artist_responses = await ArtistModel.afetch_missing(track_artist_ids(track_responses), user_id=user_id)
+        tracks.update(await sync_to_async(TrackModel.store)(track_responses, artist_responses, list(artists)))
+        return tracks
+
+    @staticmethod
+    def store(
+        track_responses: Dict[str, dict], artist_responses: Dict[str, dict], stored_artist_ids: Iterable[str]
+    ) -> Dict[str, "TrackModel"]:
+        """
+        Insert tracks from spotify responses, keyed by the requested id,
+        together with the responses of their artists not stored yet, those
+        artists' genres, the links between tracks and artists and the search
+        documents. Every table gets one bulk statement ignoring rows stored
+        meanwhile, so a batch takes as many round trips as a single track,
+        and it all runs in one transaction so a failure can't leave a track
+        without its artists. Returns the new tracks by requested id.
+        """
+        new_tracks = {}
+        now = timezone.now()
+        for track_id, track_response in track_responses.items():
+            track = TrackModel()
+            track.track_id = track_response["id"]
+            track.set_metadata(track_response, now)
+            new_tracks[track_id] = track
+        with transaction.atomic(savepoint=False):
+            artist_ids = set(stored_artist_ids) | ArtistModel.store(artist_responses).keys()
+            TrackModel.objects.bulk_create(new_tracks.values(), ignore_conflicts=True)
+            TrackArtist = TrackModel.track_artists.through
+            links = [
+                TrackArtist(trackmodel_id=new_tracks[track_id].track_id, artistmodel_id=artist["id"])
+                for track_id, track_response in track_responses.items()
+                for artist in track_response["artists"]
+                if artist["id"] in artist_ids
+            ]
+            TrackArtist.objects.bulk_create(links, ignore_conflicts=True)
+            TrackModel.update_search([track.track_id for track in new_tracks.values()])
+        return new_tracks
+
+
+def track_artist_ids(track_responses: Dict[str, dict]) -> Iterator[str]:
+    return (artist["id"] for track_response in track_responses.values() for artist in track_response["artists"])
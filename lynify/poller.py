@@ -0,0 +1,299 @@
+"""
+Polling for listening history, shared by poll.py and the app's polling thread
+
+Every user with a stored token is polled by its own asyncio task on its own
+schedule. The blocking spotify and database calls run in a pool of
+POLL_CONCURRENCY threads, which bounds how many users are polled at once.
+Another task refreshes stale track and artist metadata within an hourly
+budget of api requests, and another creates history partitions ahead of time.
+"""
+import asyncio
+import datetime
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+
+from django.db import close_old_connections
+
+from lynify.metrics import POLL_BACKLOG, POLL_DURATION, POLLS
+from lynify.models.artists import ArtistModel
+from lynify.models.history import HistoryModel
+from lynify.models.now_playing import NowPlayingModel
+from lynify.models.partitions import create_partitions_ahead
+from lynify.models.tokens import RECENTLY_PLAYED_LIMIT, AccessToken
+from lynify.models.tracks import TrackModel
+from lynify.settings import (
+    HISTORY_PARTITIONS_AHEAD,
+    HISTORY_PARTITIONS_INTERVAL,
+    METADATA_REFRESH_INTERVAL,
+    METADATA_REFRESH_REQUESTS_PER_HOUR,
+    POLL_CONCURRENCY,
+    POLL_END_MARGIN,
+    POLL_IDLE_MAX_INTERVAL,
+    POLL_INTERVAL,
+    POLL_MAX_INTERVAL,
+    POLL_MIN_INTERVAL,
+    POLL_MODE,
+    POLL_USERS_INTERVAL,
+    RECENTLY_PLAYED_POLL_INTERVAL,
+    SPOTIFY_USER_ID,
+)
+
+
+def poll_for_playing_history(user_id: str) -> Optional[dict]:
+    """
+    Record the user's currently playing track and publish it as their now playing snapshot.
+    Returns spotify's currently playing response, or None if there isn't one
+    """
+    print("Polling for playing history for " + user_id)
+
+    token = AccessToken.get_token(user_id)
+    if token is None:
+        print("Failed to get token")
+        return None
+    currently_playing = token.get_currently_playing()
+    history = None
+    if currently_playing is None:
+        print("No currently playing track")
+    elif isinstance(currently_playing, Exception):
+        print("Issue with token: " + str(currently_playing))
+    elif currently_playing["is_playing"] and currently_playing["item"] is not None:
+        history = HistoryModel.from_spotify(currently_playing, user_id=user_id)
+    # pages and event streams show the snapshot instead of calling spotify
+    NowPlayingModel.publish(user_id, currently_playing, history)
+    if isinstance(currently_playing, Exception):
+        return None
+    return currently_playing
+
+
+def next_poll_delay(currently_playing: Optional[dict], idle_polls: int) -> Tuple[float, str]:
+    """
+    Returns how many seconds to wait before the next poll and why.
+    While a track is playing, wake shortly after it should end, bounded by
+    POLL_MIN_INTERVAL and POLL_MAX_INTERVAL so skips are still noticed.
+    While paused or idle, back off from POLL_INTERVAL, doubling per idle poll
+    up to POLL_IDLE_MAX_INTERVAL.
+    """
+    if currently_playing is None or not currently_playing["is_playing"] or currently_playing["item"] is None:
+        delay = min(POLL_IDLE_MAX_INTERVAL, POLL_INTERVAL * 2**idle_polls)
+        if currently_playing is None:
+            reason = "nothing playing"
+        elif not currently_playing["is_playing"]:
+            reason = "playback paused"
+        else:
+            reason = "no track playing"
+        return delay, reason + ", idle poll " + str(idle_polls + 1)
+    item = currently_playing["item"]
+    remaining = (item["duration_ms"] - (currently_playing["progress_ms"] or 0)) / 1000.0
+    delay = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, remaining + POLL_END_MARGIN))
+    return delay, "track " + item["id"] + " ends in " + str(round(remaining)) + "s"
+
+
+def poll_recently_played(user_id: str) -> bool:
+    """
+    Record every play of the user since the stored cursor from the recently
+    played feed, up to RECENTLY_PLAYED_LIMIT plays per request
+    """
+    print("Polling recently played for " + user_id)
+
+    token = AccessToken.get_token(user_id)
+    if token is None:
+        print("Failed to get token")
+        return False
+    after = token.recently_played_after
+    if after is None:
+        # don't record plays already polled in currently playing mode again
+        after = HistoryModel.last_played_at(user_id)
+    read = 0
+    while True:
+        recently_played = token.get_recently_played(after)
+        if recently_played is None:
+            print("No recently played tracks")
+            return False
+        elif isinstance(recently_played, Exception):
+            print("Issue with token: " + str(recently_played))
+            return False
+        items = recently_played["items"]
+        HistoryModel.from_recently_played(items, user_id)
+        read += len(items)
+        cursors = recently_played.get("cursors")
+        if not cursors or int(cursors["after"]) == after:
+            break
+        after = int(cursors["after"])
+        token.set_recently_played_after(after)
+        # a full page may mean there are more plays after the new cursor
+        if len(items) < RECENTLY_PLAYED_LIMIT:
+            break
+    print("Read " + str(read) + " recently played tracks")
+    return True
+
+
+def _run_poll(poll, user_id: str, mode: str):
+    POLL_BACKLOG.dec()
+    # executor threads keep their database connection between polls
+    close_old_connections()
+    with POLL_DURATION.labels(mode).time():
+        try:
+            result = poll(user_id)
+        except Exception:
+            POLLS.labels(mode, "error").inc()
+            raise
+    POLLS.labels(mode, "ok" if result else "empty").inc()
+    return result
+
+
+async def submit_poll(executor: ThreadPoolExecutor, poll, user_id: str, mode: str):
+    """
+    Run a poll on the executor, counting it in the backlog until a thread picks it up
+    """
+    POLL_BACKLOG.inc()
+    return await asyncio.get_running_loop().run_in_executor(executor, _run_poll, poll, user_id, mode)
+
+
+async def poll_user_recently_played(user_id: str, executor: ThreadPoolExecutor):
+    await asyncio.sleep(random.uniform(0, POLL_INTERVAL))
+    while True:
+        try:
+            if await submit_poll(executor, poll_recently_played, user_id, "recently_played"):
+                print("Polled for playing history for " + user_id)
+        except Exception as e:
+            print(e)
+        await asyncio.sleep(RECENTLY_PLAYED_POLL_INTERVAL)
+
+
+async def poll_user(user_id: str, executor: ThreadPoolExecutor):
+    # spread the first polls out so users aren't all polled at once
+    await asyncio.sleep(random.uniform(0, POLL_MIN_INTERVAL))
+    idle_polls = 0
+    while True:
+        currently_playing = None
+        try:
+            currently_playing = await submit_poll(executor, poll_for_playing_history, user_id, "currently_playing")
+        except Exception as e:
+            print(e)
+        delay, reason = next_poll_delay(currently_playing, idle_polls)
+        if currently_playing is not None and currently_playing["is_playing"]:
+            idle_polls = 0
+        else:
+            idle_polls += 1
+        wake_at = datetime.datetime.now(tz=datetime.UTC) + datetime.timedelta(seconds=delay)
+        print(user_id + ": next poll in " + str(round(delay)) + "s at " + wake_at.strftime("%H:%M:%S") + ": " + reason)
+        await asyncio.sleep(delay)
+
+
+def refresh_metadata(max_requests: int, user_id: Optional[str] = None) -> int:
+    """
+    Refresh the stalest tracks and artists with at most max_requests api
+    requests, half for tracks and the rest for artists.
+    Returns the number of requests made.
+    """
+    requests = TrackModel.refresh_stale((max_requests + 1) // 2, user_id)
+    requests += ArtistModel.refresh_stale(max_requests - requests, user_id)
+    return requests
+
+
+def metadata_user_id() -> Optional[str]:
+    """
+    Returns a user whose token can read metadata: the default user if they
+    have a token, otherwise the first user with a stored one
+    """
+    if SPOTIFY_USER_ID and AccessToken.get_token(SPOTIFY_USER_ID) is not None:
+        return SPOTIFY_USER_ID
+    for user_id in AccessToken.objects.order_by("user_id").values_list("user_id", flat=True):
+        if AccessToken.get_token(user_id) is not None:
+            return user_id
+    return None
+
+
+def _run_refresh(max_requests: int) -> int:
+    close_old_connections()
+    # any user's token can read metadata
+    user_id = metadata_user_id()
+    if user_id is None:
+        return 0
+    return refresh_metadata(max_requests, user_id)
+
+
+async def refresh_metadata_periodically(executor: ThreadPoolExecutor):
+    """
+    Every METADATA_REFRESH_INTERVAL seconds, spend the requests the hourly
+    budget has accrued since the last run on refreshing metadata
+    """
+    loop = asyncio.get_running_loop()
+    allowance = 0.0
+    while True:
+        await asyncio.sleep(METADATA_REFRESH_INTERVAL)
+        # unused requests carry over, up to an hour's worth
+        allowance = min(
+            METADATA_REFRESH_REQUESTS_PER_HOUR,
+            allowance + METADATA_REFRESH_REQUESTS_PER_HOUR * METADATA_REFRESH_INTERVAL / 3600,
+        )
+        if allowance < 1:
+            continue
+        try:
+            requests = await loop.run_in_executor(executor, _run_refresh, int(allowance))
+            allowance -= requests
+            print("Refreshed metadata with " + str(requests) + " requests")
+        except Exception as e:
+            print(e)
+
+
+def _run_create_partitions() -> int:
+    close_old_connections()
+    return len(create_partitions_ahead(HISTORY_PARTITIONS_AHEAD))
+
+
+async def create_partitions_periodically(executor: ThreadPoolExecutor):
+    """
+    Every HISTORY_PARTITIONS_INTERVAL seconds, create the history partitions
+    of the coming months, so new plays never land in the default partition
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(executor, _run_create_partitions)
+        except Exception as e:
+            print(e)
+        await asyncio.sleep(HISTORY_PARTITIONS_INTERVAL)
+
+
+def stored_user_ids() -> Set[str]:
+    close_old_connections()
+    user_ids = set(AccessToken.objects.values_list("user_id", flat=True))
+    if SPOTIFY_USER_ID:
+        # the default user may only have a token in spotipy's cache so far
+        user_ids.add(SPOTIFY_USER_ID)
+    return user_ids
+
+
+async def poll_all_users():
+    """
+    Keep one polling task per user with a stored token, checking for new
+    and removed users every POLL_USERS_INTERVAL seconds
+    """
+    loop = asyncio.get_running_loop()
+    poll = poll_user_recently_played if POLL_MODE == "recently_played" else poll_user
+    tasks: Dict[str, asyncio.Task] = {}
+    with ThreadPoolExecutor(max_workers=POLL_CONCURRENCY, thread_name_prefix="poller") as executor:
+        # tasks not tied to a user, referenced so they aren't garbage collected
+        background = set()
+        if METADATA_REFRESH_REQUESTS_PER_HOUR > 0:
+            background.add(asyncio.create_task(refresh_metadata_periodically(executor)))
+        background.add(asyncio.create_task(create_partitions_periodically(executor)))
+        while True:
+            try:
+                user_ids = await loop.run_in_executor(executor, stored_user_ids)
+            except Exception as e:
+                print(e)
+                user_ids = set(tasks)
+            for user_id in user_ids - tasks.keys():
+                print("Polling " + user_id)
+                tasks[user_id] = asyncio.create_task(poll(user_id, executor))
+            for user_id in tasks.keys() - user_ids:
+                print("Stopped polling " + user_id)
+                tasks.pop(user_id).cancel()
+            await asyncio.sleep(POLL_USERS_INTERVAL)
+
+
+def polling_loop():
+    asyncio.run(poll_all_users())
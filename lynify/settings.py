@@ -37,10 +37,12 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "lynify.apps.lynify.LynifyApp",
 ]
 
 MIDDLEWARE = [
+    "lynify.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -84,7 +86,9 @@ POSTGRES_PORT = os.environ.get("POSTGRES_PORT", "5432")
 if os.environ.get("APP_LOCATION") == "heroku":
     import dj_database_url
 
-    DATABASES = {"default": dj_database_url.config(conn_max_age=600, ssl_require=True)}
+    # served over ASGI, where each request's sync code runs in a thread of its own, so
+    # persistent connections are never reused and pile up until postgres refuses more (Django #33497)
+    DATABASES = {"default": dj_database_url.config(conn_max_age=0, ssl_require=True)}
 else:
     DATABASES = {
         "default": {
@@ -98,6 +102,22 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# rendered table rows, keyed by their content
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "20000"))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "lynify",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": FRAGMENT_CACHE_SIZE},
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -157,3 +177,49 @@ SPOTIFY_CLIENT_ID = os.environ.get("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.environ.get("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_USER_ID = os.environ.get("SPOTIFY_USER_ID")
 SPOTIPY_REDIRECT_URI = os.environ.get("SPOTIPY_REDIRECT_URI")
+
+# Poller
+# "currently_playing" polls the playing track, waking shortly after it should end,
+# "recently_played" reads up to 50 plays at a time from the recently played feed
+POLL_MODE = os.environ.get("POLL_MODE", "currently_playing")
+RECENTLY_PLAYED_POLL_INTERVAL = int(os.environ.get("RECENTLY_PLAYED_POLL_INTERVAL", "900"))
+# seconds, bounds for the wait while a track is playing
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", "180"))
+# seconds to wait past the expected end of the track
+POLL_END_MARGIN = float(os.environ.get("POLL_END_MARGIN", "2"))
+# seconds, the wait while paused or idle starts at POLL_INTERVAL and doubles up to POLL_IDLE_MAX_INTERVAL
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", "60"))
+POLL_IDLE_MAX_INTERVAL = float(os.environ.get("POLL_IDLE_MAX_INTERVAL", "600"))
+# users polled at the same time, and how often to look for new users
+POLL_CONCURRENCY = int(os.environ.get("POLL_CONCURRENCY", "8"))
+POLL_USERS_INTERVAL = float(os.environ.get("POLL_USERS_INTERVAL", "60"))
+# port poll.py serves its prometheus metrics on, 0 to not serve them. Unneeded when
+# PROMETHEUS_MULTIPROC_DIR is set, /metrics then serves the poller's as well
+POLLER_METRICS_PORT = int(os.environ.get("POLLER_METRICS_PORT", "0"))
+# directory the web workers and poll.py write their prometheus metrics to, so /metrics
+# serves the sum of all processes' instead of the one worker's that answers.
+# Read by prometheus_client itself, it has to be set before any process starts and emptied on deploy
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Now playing
+# the poller's snapshot is shown while younger than this, older ones are refreshed
+# from spotify by the page; covers the idle poll interval so the poller keeps it fresh
+NOW_PLAYING_MAX_AGE = float(os.environ.get("NOW_PLAYING_MAX_AGE", str(POLL_IDLE_MAX_INTERVAL + 60)))
+# how often each web process checks for changed snapshots while browsers are listening
+NOW_PLAYING_CHECK_INTERVAL = float(os.environ.get("NOW_PLAYING_CHECK_INTERVAL", "1"))
+# seconds an event stream stays open before the browser reconnects
+NOW_PLAYING_STREAM_DURATION = float(os.environ.get("NOW_PLAYING_STREAM_DURATION", "300"))
+
+# Metadata refresh
+# spotify api requests per hour spent refreshing track and artist metadata, 0 to disable
+METADATA_REFRESH_REQUESTS_PER_HOUR = int(os.environ.get("METADATA_REFRESH_REQUESTS_PER_HOUR", "60"))
+# seconds between refresh runs, and how old metadata has to be to be refreshed
+METADATA_REFRESH_INTERVAL = float(os.environ.get("METADATA_REFRESH_INTERVAL", "600"))
+METADATA_REFRESH_MIN_AGE = float(os.environ.get("METADATA_REFRESH_MIN_AGE", str(7 * 24 * 3600)))
+
+# History partitions
+# months of history partitions the poller and the history_partitions command keep created ahead
+HISTORY_PARTITIONS_AHEAD = int(os.environ.get("HISTORY_PARTITIONS_AHEAD", "3"))
+# seconds between the poller's checks for missing partitions
+HISTORY_PARTITIONS_INTERVAL = float(os.environ.get("HISTORY_PARTITIONS_INTERVAL", str(24 * 3600)))
@@ -0,0 +1,32 @@
+import math
+
+from lynify.models.artists import ARTISTS_PER_REQUEST, ArtistModel
+from lynify.tests.utils import USER_ID, FakeSpotifyTestCase, create_token
+
+
+class FetchMissingTest(FakeSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        create_token(USER_ID)
+        ArtistModel.objects.bulk_create([ArtistModel(artist_id="a" + str(i), artist_name="Stored") for i in range(10)])
+        self.artist_ids = ["a" + str(i) for i in range(120)]
+
+    def test_fetch_missing(self):
+        artists, responses = ArtistModel.fetch_missing(self.artist_ids + self.artist_ids[:5], user_id=USER_ID)
+        self.assertEqual(set(artists), set(self.artist_ids[:10]))
+        self.assertEqual(set(responses), set(self.artist_ids[10:]))
+        self.assertEqual(self.fake.calls["artists"], math.ceil(110 / ARTISTS_PER_REQUEST))
+        # nothing is stored yet
+        self.assertEqual(ArtistModel.objects.count(), 10)
+
+    def test_from_spotify_many(self):
+        artists = ArtistModel.from_spotify_many(self.artist_ids, user_id=USER_ID)
+        self.assertEqual(set(artists), set(self.artist_ids))
+        self.assertEqual(ArtistModel.objects.get(artist_id="a5").artist_name, "Stored")
+        self.assertEqual(
+            sorted(ArtistModel.objects.get(artist_id="a50").artist_genres.values_list("genre_name", flat=True)),
+            sorted(self.fake.artist("a50")["genres"]),
+        )
+        self.fake.reset_calls()
+        ArtistModel.from_spotify_many(self.artist_ids, user_id=USER_ID)
+        self.assertEqual(sum(self.fake.calls.values()), 0)
@@ -0,0 +1,101 @@
+import io
+import json
+import urllib.request
+
+from django.test import SimpleTestCase
+
+from lynify.management.commands.benchmark import BENCHMARK_USER, Command, counting_queries, percentile, summary
+from lynify.models.history import HistoryModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import FakeSpotifyTestCase
+from lynify.utils.fake_spotify import FakeSpotify
+
+
+class FakeSpotifyTest(SimpleTestCase):
+    def test_metadata_is_made_up_from_the_id(self):
+        fake = FakeSpotify(artists=10)
+        self.assertEqual(fake.track("t1"), FakeSpotify(artists=10).track("t1"))
+        self.assertNotEqual(fake.track("t1"), fake.track("t2"))
+        for track_id in ("t" + str(i) for i in range(20)):
+            self.assertIn(fake.track(track_id)["artists"][0]["id"], ["a" + str(i) for i in range(10)])
+        self.assertEqual(fake.artist("a1")["id"], "a1")
+
+    def test_recently_played_pages(self):
+        fake = FakeSpotify()
+        fake.recently_played = [(i * 1000, "t" + str(i)) for i in range(1, 6)]
+        page = fake.recently_played_page(0, 2)
+        self.assertEqual([item["track"]["id"] for item in page["items"]], ["t2", "t1"])
+        self.assertEqual(page["cursors"], {"after": "2000", "before": "1000"})
+        page = fake.recently_played_page(int(page["cursors"]["after"]), 10)
+        self.assertEqual([item["track"]["id"] for item in page["items"]], ["t5", "t4", "t3"])
+        page = fake.recently_played_page(5000, 10)
+        self.assertEqual(page["items"], [])
+        self.assertIsNone(page["cursors"])
+
+    def test_counts_calls_per_endpoint(self):
+        fake = FakeSpotify()
+        fake.start()
+        try:
+            for path in ("tracks?ids=t1,t2", "tracks/t3", "artists/a1", "me/player/currently-playing"):
+                urllib.request.urlopen(fake.api_url + path).read()
+            with urllib.request.urlopen(fake.api_url + "tracks?ids=t1,t2") as response:
+                self.assertEqual([track["id"] for track in json.load(response)["tracks"]], ["t1", "t2"])
+        finally:
+            fake.stop()
+        self.assertEqual(fake.calls, {"tracks": 3, "artists": 1, "me/player/currently-playing": 1})
+        fake.reset_calls()
+        self.assertEqual(fake.calls, {})
+
+
+class SummaryTest(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile([7], 0.95), 7)
+
+    def test_summary(self):
+        timings = [{"seconds": i / 1000, "queries": i % 3} for i in range(1, 21)]
+        result = summary(timings)
+        self.assertEqual(result["requests"], 20)
+        self.assertEqual(result["p50_ms"], 10)
+        self.assertEqual(result["p95_ms"], 19)
+        self.assertEqual(result["max_queries"], 2)
+
+
+class BenchmarkTest(FakeSpotifyTestCase):
+    options = {"history": 500, "tracks": 100, "artists": 30, "genres": 5}
+
+    def setUp(self):
+        super().setUp()
+        self.command = Command(stdout=io.StringIO(), stderr=io.StringIO())
+        self.command.seed(self.options)
+
+    def test_seed(self):
+        self.assertEqual(HistoryModel.objects.filter(user_id=BENCHMARK_USER).count(), 500)
+        self.assertEqual(TrackModel.objects.count(), 100)
+        self.assertFalse(TrackModel.objects.filter(track_artists=None).exists())
+
+    def test_counting_queries(self):
+        result, queries = counting_queries(lambda: list(TrackModel.objects.all()))
+        self.assertEqual(len(result), 100)
+        self.assertEqual(queries, 1)
+
+    def test_views(self):
+        results = self.command.benchmark_views(2, self.options["tracks"])
+        self.assertEqual(set(results), {"history", "tracks", "artists", "track"})
+        self.assertEqual(results["track"]["requests"], 2)
+        # every way of viewing history has a second page
+        self.assertEqual(results["history"]["requests"], 6)
+        self.assertNotIn("answered", self.command.stderr.getvalue())
+
+    def test_recently_played(self):
+        result = self.command.benchmark_recently_played(self.fake, 20, 1.0)
+        self.assertEqual(result["plays_recorded"], 20)
+        # one page, and the new tracks and their artists in a batch each
+        self.assertEqual(result["api_calls_by_endpoint"], {"me/player/recently-played": 1, "tracks": 1, "artists": 1})
+
+    def test_currently_playing(self):
+        result = self.command.benchmark_currently_playing(self.fake, 5, 0.0)
+        self.assertEqual(result["plays_recorded"], 5)
+        self.assertNotIn("tracks", result["api_calls_by_endpoint"])
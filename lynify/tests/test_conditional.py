@@ -0,0 +1,42 @@
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from lynify.models.history import HistoryModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import USER_ID, seed_library
+
+
+class ConditionalPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def test_etag(self):
+        response = self.client.get("/history/", HTTP_HOST="localhost")
+        etag = response["ETag"]
+        self.assertNotIn("Last-Modified", response)
+        response = self.client.get("/history/", HTTP_HOST="localhost", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # a play older than the recorded ones, like a recently played poll or an import records
+        play = HistoryModel(
+            user_id=USER_ID,
+            timestamp=timezone.now() - datetime.timedelta(days=30),
+            track=TrackModel.objects.get(track_id="t1"),
+        )
+        HistoryModel.record([play])
+        response = self.client.get("/history/", HTTP_HOST="localhost", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_modified_since_is_ignored(self):
+        response = self.client.get(
+            "/history/", HTTP_HOST="localhost", HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT"
+        )
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from lynify.tests.utils import TRACKS, USER_ID, seed_library
+from lynify.views.export import ARTIST_COLUMNS, HISTORY_COLUMNS, TRACK_COLUMNS
+
+
+class ExportContentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def export(self, path: str, format: str = "csv") -> list:
+        response = self.client.get(path, {"format": format}, HTTP_HOST="localhost")
+        self.assertTrue(response.streaming)
+        self.assertIn('filename="' + path.split("/")[1] + "." + format + '"', response["Content-Disposition"])
+        return list(response.streaming_content)
+
+    def test_history_csv(self):
+        # rows read a few at a time, written in several chunks
+        with mock.patch("lynify.views.export.EXPORT_CHUNK_SIZE", 7), mock.patch(
+            "lynify.views.export.WRITE_BATCH_SIZE", 50
+        ):
+            chunks = self.export("/history/export/")
+        self.assertEqual(len(chunks), 1 + 3)
+        rows = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+        self.assertEqual(rows[0], HISTORY_COLUMNS)
+        self.assertEqual(len(rows), TRACKS + 1)
+        # oldest first, with the artists of every track
+        self.assertEqual(rows[1][1:3] + rows[1][4:], ["t0", "Track 0", "", ""])
+        self.assertEqual(sorted(rows[1][3].split("; ")), ["Artist 0", "Artist 1"])
+        self.assertEqual(rows[-1][1], "t119")
+
+    def test_tracks_ndjson(self):
+        lines = b"".join(self.export("/tracks/export/", "ndjson")).decode().splitlines()
+        tracks = {track["track_id"]: track for track in map(json.loads, lines)}
+        self.assertEqual(len(tracks), TRACKS)
+        self.assertEqual(list(tracks["t3"]), TRACK_COLUMNS)
+        self.assertEqual(sorted(tracks["t3"]["artists"]), ["Artist 3", "Artist 4"])
+        self.assertEqual(tracks["t3"]["popularity"], 3)
+
+    def test_artists_csv(self):
+        rows = list(csv.reader(io.StringIO(b"".join(self.export("/artists/export/")).decode())))
+        self.assertEqual(rows[0], ARTIST_COLUMNS)
+        self.assertEqual([row[0] for row in rows[1:]], ["a" + str(i) for i in range(10)])
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+        self.async_client.cookies = self.client.cookies
+
+    def test_sync(self):
+        response = self.client.get("/history/export/", HTTP_HOST="localhost")
+        self.assertFalse(response.is_async)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(HISTORY_COLUMNS))
+        self.assertEqual(len(lines), TRACKS + 1)
+
+    async def test_async(self):
+        # under ASGI a sync iterator would be read whole before the response starts
+        response = await self.async_client.get("/history/export/", {"format": "ndjson"}, HTTP_HOST="localhost")
+        self.assertTrue(response.is_async)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), TRACKS)
+        self.assertEqual(json.loads(lines[0])["track_id"], "t0")
@@ -0,0 +1,51 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.template.backends.django import Template
+from django.test import TestCase
+
+from lynify.models.artists import ArtistModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import seed_library
+from lynify.views.html import artist_rows, track_rows
+
+
+class FragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        cache.clear()
+
+    def tracks(self) -> list:
+        return list(TrackModel.objects.prefetch_related("track_artists").order_by("track_id")[:20])
+
+    def track_rows(self, tracks: list):
+        """
+        Returns the rows of the tracks, and how many were rendered rather than read from the cache
+        """
+        with mock.patch.object(Template, "render", autospec=True, side_effect=Template.render) as render:
+            rows = track_rows(tracks)
+        return rows, render.call_count
+
+    def test_rows_are_rendered_once(self):
+        rows, rendered = self.track_rows(self.tracks())
+        self.assertEqual(rendered, 20)
+        self.assertIn("Track 1", rows[1])
+        self.assertEqual(self.track_rows(self.tracks()), (rows, 0))
+
+    def test_changed_row_is_rendered_again(self):
+        rows, _ = self.track_rows(self.tracks())
+        tracks = self.tracks()
+        tracks[0].track_play_count = 7
+        changed, rendered = self.track_rows(tracks)
+        self.assertEqual(rendered, 1)
+        self.assertNotEqual(changed[0], rows[0])
+        self.assertEqual(changed[1:], rows[1:])
+
+    def test_values_are_escaped(self):
+        ArtistModel.objects.create(artist_id="x", artist_name="<b>Bold</b>")
+        row = artist_rows(list(ArtistModel.objects.filter(artist_id="x").prefetch_related("artist_genres")))[0]
+        self.assertIn("&lt;b&gt;Bold&lt;/b&gt;", row)
+        self.assertNotIn("<b>", row)
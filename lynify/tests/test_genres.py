@@ -0,0 +1,60 @@
+import importlib
+
+from django.test import SimpleTestCase, TestCase
+
+from lynify.models.artists import ArtistModel
+from lynify.tests.utils import TRACKS, USER_ID, seed_library
+
+parse_genres = importlib.import_module("lynify.migrations.0007_genres").parse_genres
+
+
+class GenreFilterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+        ArtistModel.add_genres({"a0": ["rock"], "a1": ["rock", "jazz"]})
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def rows(self, path: str, params: dict) -> str:
+        html = self.client.get(path, {"limit": 100, **params}, HTTP_HOST="localhost").content.decode()
+        return html.split("<tr>")[2:]
+
+    def test_artists(self):
+        rows = self.rows("/artists/", {"genre": "rock"})
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(self.rows("/artists/", {"genre": "jazz"})), 1)
+
+    def test_tracks_and_history(self):
+        # tracks are by artists i % 10 and (i + 1) % 10, each track by a0 and a1 counted once
+        rock_tracks = len([i for i in range(TRACKS) if i % 10 in (9, 0, 1)])
+        for path in ("/tracks/", "/history/"):
+            rows = self.rows(path, {"genre": "rock"})
+            self.assertEqual(len(rows), rock_tracks)
+            self.assertEqual(len(set(rows)), rock_tracks)
+            self.assertEqual(self.rows(path, {"genre": "unknown"}), [])
+
+    def test_filter_kept_across_pages(self):
+        response = self.client.get("/tracks/", {"genre": "rock", "limit": 10}, HTTP_HOST="localhost")
+        next_query = response.context["next_query"]
+        self.assertIn("genre=rock", next_query)
+        html = self.client.get("/tracks/?" + next_query, HTTP_HOST="localhost").content.decode()
+        rows = html.split("<tr>")[2:]
+        self.assertEqual(len(rows), 10)
+        for row in rows:
+            self.assertTrue("Artist 0" in row or "Artist 1" in row)
+
+
+class ParseGenresTest(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(parse_genres("['rock', 'indie pop']"), ["rock", "indie pop"])
+        self.assertEqual(parse_genres("[]"), [])
+        self.assertEqual(parse_genres(None), [])
+        self.assertEqual(parse_genres("['rock', 1]"), ["rock"])
+
+    def test_malformed(self):
+        for value in ("rock", "['rock'", "{'a': 1}", "__import__('os')"):
+            self.assertEqual(parse_genres(value), [])
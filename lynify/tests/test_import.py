@@ -0,0 +1,118 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from lynify.management.commands.import_streaming_history import Command, parse_play
+from lynify.models.history import HistoryModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import USER_ID, FakeSpotifyTestCase, create_token
+from lynify.utils.json_stream import iter_json_array
+
+PLAYS = 30
+
+
+class JsonStreamTest(SimpleTestCase):
+    def items(self, text: str, chunk_size: int = 3) -> list:
+        return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_items(self):
+        rows = [{"ts": "2024-01-01T00:00:00Z", "ms_played": 1234}, [1, 2.5, None], "a, ]", 12345678, True]
+        text = json.dumps(rows, indent=2)
+        for chunk_size in (1, 3, 7, 1 << 16):
+            self.assertEqual(self.items(text, chunk_size), rows)
+
+    def test_empty(self):
+        self.assertEqual(self.items(" [ ] "), [])
+
+    def test_number_split_across_chunks(self):
+        self.assertEqual(self.items("[123456789,1]", chunk_size=4), [123456789, 1])
+
+    def test_invalid(self):
+        for text in ('{"a": 1}', "[1 2]", "[1,"):
+            with self.assertRaises(ValueError):
+                self.items(text)
+
+
+class ParsePlayTest(SimpleTestCase):
+    def test_track(self):
+        track_id, started, ms_played = parse_play(
+            {"ts": "2024-05-17T12:00:00Z", "ms_played": 30000, "spotify_track_uri": "spotify:track:abc"}
+        )
+        self.assertEqual(track_id, "abc")
+        # ts is the end of the play
+        self.assertEqual(started, datetime.datetime(2024, 5, 17, 11, 59, 30, tzinfo=datetime.UTC))
+        self.assertEqual(ms_played, 30000)
+
+    def test_not_a_track(self):
+        self.assertIsNone(parse_play({"ts": "2024-05-17T12:00:00Z", "ms_played": 1, "spotify_track_uri": None}))
+        self.assertIsNone(
+            parse_play({"ts": "2024-05-17T12:00:00Z", "ms_played": 1, "spotify_episode_uri": "spotify:episode:x"})
+        )
+
+
+class ImportTest(FakeSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        create_token(USER_ID)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # a play every hour, ending before the first play the poller recorded
+        self.first_polled = datetime.datetime(2024, 3, 1, tzinfo=datetime.UTC)
+        first_end = self.first_polled - datetime.timedelta(hours=PLAYS)
+        self.rows = [
+            {
+                "ts": (first_end + datetime.timedelta(hours=i)).isoformat().replace("+00:00", "Z"),
+                "ms_played": 60000 + i,
+                "spotify_track_uri": "spotify:track:t" + str(i % 12),
+            }
+            for i in range(PLAYS)
+        ]
+        with open(os.path.join(self.directory, "Streaming_History_Audio_2024.json"), "w") as fp:
+            json.dump(self.rows, fp)
+        TrackModel.objects.create(track_id="polled")
+        HistoryModel.record([HistoryModel(user_id=USER_ID, timestamp=self.first_polled, track_id="polled")])
+
+    def run_import(self):
+        call_command("import_streaming_history", self.directory, user=USER_ID, batch_size=10, stdout=io.StringIO())
+
+    def imported(self) -> list:
+        return list(
+            HistoryModel.objects.filter(user_id=USER_ID, ms_played__isnull=False)
+            .order_by("timestamp")
+            .values_list("timestamp", "track_id", "ms_played")
+        )
+
+    def expected(self) -> list:
+        return [parse_play(row) for row in self.rows]
+
+    def test_import(self):
+        self.run_import()
+        self.assertEqual([(track_id, timestamp, ms) for timestamp, track_id, ms in self.imported()], self.expected())
+        # a request per batch of rows with unknown tracks: t0 to t9, then t10 and t11
+        self.assertEqual(self.fake.calls["tracks"], 2)
+        self.run_import()
+        self.assertEqual(len(self.imported()), PLAYS)
+
+    def test_resume_after_crash(self):
+        import_batch = Command.import_batch
+        batches = []
+
+        def crash_after_first_batch(command, *args):
+            if batches:
+                raise KeyboardInterrupt
+            batches.append(args)
+            return import_batch(command, *args)
+
+        with mock.patch.object(Command, "import_batch", crash_after_first_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import()
+        self.assertEqual(len(self.imported()), 10)
+        self.run_import()
+        self.assertEqual([(track_id, timestamp, ms) for timestamp, track_id, ms in self.imported()], self.expected())
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+from prometheus_client import REGISTRY
+
+from lynify.metrics import spotify_endpoint
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import USER_ID, FakeSpotifyTestCase, create_token, seed_library
+
+# a process counting a poll in the metrics directory, like poll.py next to the web workers
+POLLER_SCRIPT = """
+import django
+django.setup()
+from lynify.metrics import POLLS
+POLLS.labels("currently_playing", "played").inc()
+"""
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class ViewMetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def test_latency_and_queries(self):
+        labels = {"view": "tracks"}
+        requests = sample("lynify_view_db_queries_count", labels)
+        queries = sample("lynify_view_db_queries_sum", labels)
+        latency = sample("lynify_view_latency_seconds_count", {"view": "tracks", "method": "GET", "status": "200"})
+        self.client.get("/tracks/", HTTP_HOST="localhost")
+        self.assertEqual(sample("lynify_view_db_queries_count", labels), requests + 1)
+        self.assertGreater(sample("lynify_view_db_queries_sum", labels), queries)
+        self.assertEqual(
+            sample("lynify_view_latency_seconds_count", {"view": "tracks", "method": "GET", "status": "200"}),
+            latency + 1,
+        )
+
+    def test_metrics_view(self):
+        response = self.client.get("/metrics", HTTP_HOST="localhost")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("lynify_view_latency_seconds", response.content.decode())
+
+
+class SpotifyMetricsTest(FakeSpotifyTestCase):
+    def test_requests_by_endpoint(self):
+        create_token(USER_ID)
+        # spotipy requests several tracks from tracks/?ids=
+        labels = {"endpoint": "/v1/tracks/", "status": "200"}
+        requests = sample("lynify_spotify_requests_total", labels)
+        TrackModel.from_spotify_many(["t1", "t2"], user_id=USER_ID)
+        self.assertEqual(sample("lynify_spotify_requests_total", labels), requests + 1)
+
+    def test_endpoint_ids(self):
+        self.assertEqual(
+            spotify_endpoint("https://api.spotify.com/v1/tracks/4uLU6hMCjMI75M1A2tKUQC?market=SE"), "/v1/tracks/{id}"
+        )
+        self.assertEqual(
+            spotify_endpoint("https://api.spotify.com/v1/me/player/currently-playing"),
+            "/v1/me/player/currently-playing",
+        )
+
+
+class MultiprocessMetricsTest(SimpleTestCase):
+    def test_other_processes_are_served(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory, "DJANGO_SETTINGS_MODULE": "lynify.settings"}
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", POLLER_SCRIPT], env=env, cwd=settings.BASE_DIR, check=True)
+            with mock.patch("lynify.views.metrics.PROMETHEUS_MULTIPROC_DIR", directory):
+                response = self.client.get("/metrics", HTTP_HOST="localhost")
+        self.assertIn('lynify_polls_total{mode="currently_playing",result="played"} 2.0', response.content.decode())
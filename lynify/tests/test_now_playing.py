@@ -0,0 +1,63 @@
+import datetime
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+
+from lynify.models import history
+from lynify.models.history import HistoryModel
+from lynify.models.now_playing import NowPlayingModel
+from lynify.poller import poll_recently_played
+from lynify.tests.utils import USER_ID, FakeSpotifyTestCase, create_token
+from lynify.views.html import anow_playing
+
+
+def unix_ms(timestamp: datetime.datetime) -> int:
+    return int(timestamp.timestamp() * 1000)
+
+
+class NowPlayingFallbackTest(FakeSpotifyTestCase):
+    """
+    Without a fresh snapshot from the poller, pages ask spotify what is playing and publish it
+    """
+
+    def setUp(self):
+        super().setUp()
+        history._last_plays.clear()
+        self.started = datetime.datetime(2024, 5, 17, 12, 0, tzinfo=datetime.UTC)
+        # a recently played poller that already read the plays before this one
+        create_token(USER_ID).set_recently_played_after(unix_ms(self.started) - 60000)
+        self.fake.playing = {
+            "is_playing": True,
+            "timestamp": unix_ms(self.started),
+            "progress_ms": 1000,
+            "item": self.fake.track("t1"),
+        }
+        self.addCleanup(setattr, self.fake, "playing", None)
+        self.addCleanup(setattr, self.fake, "recently_played", [])
+
+    def finish_play(self):
+        # the play shows up in recently played a little after the track ends
+        ended = unix_ms(self.started) + self.fake.track("t1")["duration_ms"] + 1500
+        self.fake.recently_played = [(ended, "t1")]
+        poll_recently_played(USER_ID)
+
+    def test_recently_played_mode(self):
+        with mock.patch("lynify.views.html.POLL_MODE", "recently_played"):
+            html = async_to_sync(anow_playing)(USER_ID)
+        self.assertIn("Track t1", html)
+        snapshot = NowPlayingModel.objects.get(user_id=USER_ID)
+        self.assertEqual((snapshot.track_id, snapshot.started_at), ("t1", self.started))
+        # the poller records the play once it ends, and only once
+        self.assertFalse(HistoryModel.objects.filter(user_id=USER_ID).exists())
+        self.finish_play()
+        self.assertEqual(HistoryModel.objects.filter(user_id=USER_ID, track_id="t1").count(), 1)
+
+    def test_currently_playing_mode(self):
+        with mock.patch("lynify.views.html.POLL_MODE", "currently_playing"):
+            html = async_to_sync(anow_playing)(USER_ID)
+        self.assertIn("Track t1", html)
+        self.assertEqual(
+            list(HistoryModel.objects.filter(user_id=USER_ID).values_list("track_id", "timestamp")),
+            [("t1", self.started)],
+        )
+        self.assertEqual(NowPlayingModel.objects.get(user_id=USER_ID).track_id, "t1")
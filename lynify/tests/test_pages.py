@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from lynify.models import tokens
+from lynify.models.now_playing import NowPlayingModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import TRACKS, USER_ID, seed_library
+from lynify.views.html import now_playing_html
+
+
+class PageQueriesTest(TestCase):
+    """
+    Pages load their rows, tracks and artists in a fixed number of queries, whatever the limit
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def get(self, path: str, params: dict):
+        # tokens and rendered rows are cached in process, load them from the database every time
+        cache.clear()
+        tokens._token_cache.clear()
+        return self.client.get(path, params, HTTP_HOST="localhost")
+
+    def assertPageQueries(self, path: str, limit: int, queries: int):
+        with self.assertNumQueries(queries):
+            response = self.get(path, {"limit": limit})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_history(self):
+        # session, token, change validators, page, artists
+        for limit in (5, 25, 100):
+            html = self.assertPageQueries("/history/", limit, 5)
+            self.assertEqual(html.count("<tr>") - 1, limit)
+
+    def test_history_next_page(self):
+        html = self.assertPageQueries("/history/", 100, 5)
+        after = html.split("after=")[1].split('"')[0]
+        with self.assertNumQueries(5):
+            response = self.get("/history/", {"limit": 100, "after": after})
+        self.assertEqual(response.content.decode().count("<tr>") - 1, TRACKS - 100)
+
+    def test_tracks(self):
+        for limit in (5, 25, 100):
+            self.assertPageQueries("/tracks/", limit, 5)
+
+    def test_now_playing(self):
+        snapshot = NowPlayingModel(
+            user_id=USER_ID,
+            is_playing=True,
+            track=TrackModel.objects.get(track_id="t1"),
+            started_at=timezone.now(),
+            updated_at=timezone.now(),
+            changed_at=timezone.now(),
+        )
+        # the track's artists
+        with self.assertNumQueries(1):
+            html = now_playing_html(snapshot)
+        self.assertIn("Track 1", html)
+        self.assertIn("Artist 1", html)
+        self.assertIn("Artist 2", html)
@@ -0,0 +1,59 @@
+import datetime
+
+from django.test import SimpleTestCase, TestCase
+
+from lynify.models.tracks import TrackModel
+from lynify.utils.pagination import decode_cursor, encode_cursor, keyset_page
+
+
+class CursorTest(SimpleTestCase):
+    def test_round_trip(self):
+        timestamp = datetime.datetime(2024, 5, 17, 12, 30, 15, 123456, tzinfo=datetime.UTC)
+        values = decode_cursor(encode_cursor([timestamp, 42]))
+        # times keep their microseconds, or rows sharing a millisecond would be skipped
+        self.assertEqual(datetime.datetime.fromisoformat(values[0]), timestamp)
+        self.assertEqual(values[1], 42)
+        self.assertEqual(decode_cursor(encode_cursor([None, "t1"])), [None, "t1"])
+
+    def test_invalid(self):
+        for cursor in ("not base64!", encode_cursor([1, 2, 3]), encode_cursor([])):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+        with self.assertRaises(ValueError):
+            decode_cursor("eyJhIjoxfQ")  # {"a":1}
+
+
+class KeysetPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # popularities with repeats and NULLs, so pages split ties on the primary key
+        TrackModel.objects.bulk_create(
+            [
+                TrackModel(track_id="t" + str(i).zfill(2), track_popularity=None if i % 7 == 0 else i % 5)
+                for i in range(40)
+            ]
+        )
+
+    def ordered_ids(self) -> list:
+        # NULLs first, then descending popularity, then descending id
+        tracks = sorted(TrackModel.objects.all(), key=lambda track: track.track_id, reverse=True)
+        tracks.sort(key=lambda track: (track.track_popularity is not None, -(track.track_popularity or 0)))
+        return [track.track_id for track in tracks]
+
+    def test_walk(self):
+        expected = self.ordered_ids()
+        queryset = TrackModel.objects.all()
+        for limit in (1, 3, 7, 40):
+            pages = []
+            page = keyset_page(queryset, "track_popularity", limit)
+            while True:
+                pages.append([track.track_id for track in page.rows])
+                if page.next_cursor is None:
+                    break
+                page = keyset_page(queryset, "track_popularity", limit, after=page.next_cursor)
+            self.assertEqual(sum(pages, []), expected)
+            # and back again from the last page
+            for rows in reversed(pages[:-1]):
+                page = keyset_page(queryset, "track_popularity", limit, before=page.prev_cursor)
+                self.assertEqual([track.track_id for track in page.rows], rows)
+            self.assertIsNone(page.prev_cursor)
@@ -0,0 +1,119 @@
+import contextlib
+import datetime
+import io
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from lynify.models.history import HistoryModel
+from lynify.models.partitions import (
+    create_partitions,
+    create_partitions_ahead,
+    detach_partitions,
+    is_partitioned,
+    partitions,
+)
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import USER_ID, seed_library
+from lynify.views.html import date_range
+
+# months long before the partitions the migration creates
+OLD_MONTHS = [datetime.datetime(2020, month, 1, tzinfo=datetime.UTC) for month in (1, 2, 3)]
+
+
+def rows_in(table: str) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM " + connection.ops.quote_name(table))
+        return cursor.fetchone()[0]
+
+
+class PartitionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+        track = TrackModel.objects.get(track_id="t0")
+        # two plays a month in the middle of each month, in the default partition
+        HistoryModel.objects.bulk_create(
+            [
+                HistoryModel(user_id=USER_ID, timestamp=month + datetime.timedelta(days=day), track=track)
+                for month in OLD_MONTHS
+                for day in (10, 11)
+            ]
+        )
+
+    def setUp(self):
+        # keep the progress lines out of the test output
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def test_create_moves_plays(self):
+        self.assertTrue(is_partitioned())
+        self.assertEqual(rows_in("history_default"), 6)
+        self.assertEqual(
+            create_partitions(OLD_MONTHS[:2] + [OLD_MONTHS[0] + datetime.timedelta(days=3)]),
+            ["history_2020_01", "history_2020_02"],
+        )
+        self.assertEqual(rows_in("history_default"), 2)
+        self.assertEqual(rows_in("history_2020_01"), 2)
+        self.assertIn("history_2020_02", partitions())
+        self.assertEqual(HistoryModel.objects.filter(user_id=USER_ID, timestamp__year=2020).count(), 6)
+        # existing partitions are left alone
+        self.assertEqual(create_partitions(OLD_MONTHS[:2]), [])
+
+    def test_create_ahead(self):
+        now = datetime.datetime(2031, 11, 5, tzinfo=datetime.UTC)
+        created = create_partitions_ahead(2, now=now)
+        # the months ahead, wrapping into the next year, and the months of the plays in the default partition
+        self.assertEqual(
+            created,
+            [
+                "history_2020_01",
+                "history_2020_02",
+                "history_2020_03",
+                "history_2031_11",
+                "history_2031_12",
+                "history_2032_01",
+            ],
+        )
+        self.assertEqual(rows_in("history_default"), 0)
+        self.assertEqual(create_partitions_ahead(2, now=now), [])
+
+    def test_detach(self):
+        create_partitions(OLD_MONTHS)
+        self.assertEqual(
+            detach_partitions(datetime.datetime(2020, 3, 15, tzinfo=datetime.UTC)),
+            ["history_2020_01", "history_2020_02"],
+        )
+        self.assertNotIn("history_2020_01", partitions())
+        self.assertIn("history_2020_03", partitions())
+        # the plays stay in the detached tables
+        self.assertEqual(rows_in("history_2020_01"), 2)
+        self.assertEqual(HistoryModel.objects.filter(user_id=USER_ID, timestamp__year=2020).count(), 2)
+
+    def test_date_filter(self):
+        create_partitions(OLD_MONTHS[:1])
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+        for date, plays in (("2020", 6), ("2020-01", 2), ("2020-02-11", 1), ("2019", 0)):
+            html = self.client.get("/history/", {"date": date, "limit": 100}, HTTP_HOST="localhost").content.decode()
+            self.assertEqual(len(html.split("<tr>")[2:]), plays, date)
+
+
+class DateRangeTest(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(
+            date_range("2024"),
+            (datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC), datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)),
+        )
+        self.assertEqual(
+            date_range("2024-12"),
+            (datetime.datetime(2024, 12, 1, tzinfo=datetime.UTC), datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)),
+        )
+        self.assertEqual(
+            date_range("2024-02-29"),
+            (datetime.datetime(2024, 2, 29, tzinfo=datetime.UTC), datetime.datetime(2024, 3, 1, tzinfo=datetime.UTC)),
+        )
+
+    def test_invalid(self):
+        for date in ("", "24", "2023-02-29", "2024-13", "2024-1-1-1", "x", "9999", "2024-"):
+            self.assertIsNone(date_range(date))
@@ -0,0 +1,94 @@
+import datetime
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from lynify.models import tokens
+from lynify.models.artists import ArtistModel
+from lynify.models.tracks import TrackModel
+from lynify.poller import _run_refresh, metadata_user_id, next_poll_delay, refresh_metadata
+from lynify.settings import POLL_END_MARGIN, POLL_IDLE_MAX_INTERVAL, POLL_INTERVAL, POLL_MAX_INTERVAL, POLL_MIN_INTERVAL
+from lynify.tests.utils import USER_ID, FakeSpotifyTestCase, create_token, seed_library
+
+
+class NextPollDelayTest(SimpleTestCase):
+    def playing(self, duration_ms: int, progress_ms: int, is_playing: bool = True) -> dict:
+        return {"is_playing": is_playing, "progress_ms": progress_ms, "item": {"id": "t1", "duration_ms": duration_ms}}
+
+    def test_wakes_after_track_ends(self):
+        delay, _ = next_poll_delay(self.playing(200000, 100000), 0)
+        self.assertEqual(delay, min(POLL_MAX_INTERVAL, 100 + POLL_END_MARGIN))
+
+    def test_bounded(self):
+        self.assertEqual(next_poll_delay(self.playing(200000, 199999), 0)[0], POLL_MIN_INTERVAL)
+        self.assertEqual(next_poll_delay(self.playing(3600000, 0), 0)[0], POLL_MAX_INTERVAL)
+
+    def test_idle_backs_off(self):
+        self.assertEqual(next_poll_delay(None, 0)[0], POLL_INTERVAL)
+        self.assertEqual(next_poll_delay(None, 1)[0], min(POLL_IDLE_MAX_INTERVAL, POLL_INTERVAL * 2))
+        self.assertEqual(next_poll_delay(self.playing(200000, 0, is_playing=False), 30)[0], POLL_IDLE_MAX_INTERVAL)
+
+
+@mock.patch("lynify.poller.SPOTIFY_USER_ID", "default")
+class MetadataUserTest(TestCase):
+    def setUp(self):
+        tokens._token_cache.clear()
+        # there's no cached spotipy token to import
+        self.enterContext(mock.patch("lynify.models.tokens._cache_file_checked", True))
+        # it would close the test's connection, in the middle of its transaction
+        self.enterContext(mock.patch("lynify.poller.close_old_connections"))
+
+    def test_default_user(self):
+        for user_id in ("default", "a", "b"):
+            create_token(user_id)
+        self.assertEqual(metadata_user_id(), "default")
+
+    def test_default_user_without_token(self):
+        # e.g. a deployment whose default user never logged in
+        for user_id in ("c", "b"):
+            create_token(user_id)
+        self.assertEqual(metadata_user_id(), "b")
+        with mock.patch("lynify.poller.refresh_metadata", return_value=3) as refresh_metadata:
+            self.assertEqual(_run_refresh(10), 3)
+        refresh_metadata.assert_called_once_with(10, "b")
+
+    def test_no_tokens(self):
+        self.assertIsNone(metadata_user_id())
+        self.assertEqual(_run_refresh(10), 0)
+
+
+class RefreshMetadataTest(FakeSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        # 120 tracks by 10 artists, never refreshed, 11 of them played
+        seed_library()
+        TrackModel.objects.update(track_name="Old")
+        for i in range(10, 120, 10):
+            TrackModel.objects.filter(track_id="t" + str(i)).update(track_play_count=i)
+        # refreshed recently
+        ArtistModel.objects.filter(artist_id__in=["a0", "a1"]).update(artist_refreshed_at=timezone.now())
+
+    def test_budget(self):
+        self.assertEqual(refresh_metadata(3, USER_ID), 3)
+        # half of the requests for tracks, the rest for the 8 stale artists
+        self.assertEqual((self.fake.calls["tracks"], self.fake.calls["artists"]), (2, 1))
+        refreshed = set(TrackModel.objects.filter(track_refreshed_at__isnull=False).values_list("track_id", flat=True))
+        self.assertEqual(len(refreshed), 100)
+        # the most played of the equally stale tracks first
+        self.assertTrue({"t" + str(i) for i in range(10, 120, 10)} <= refreshed)
+        self.assertEqual(TrackModel.objects.get(track_id="t10").track_name, "Track t10")
+        # the new names are searchable
+        self.assertTrue(TrackModel.objects.filter(track_id="t10", track_search="t10").exists())
+        self.assertEqual(
+            sorted(ArtistModel.objects.get(artist_id="a5").artist_genres.values_list("genre_name", flat=True)),
+            sorted(self.fake.artist("a5")["genres"]),
+        )
+        self.assertEqual(ArtistModel.objects.get(artist_id="a0").artist_name, "Artist 0")
+
+    def test_nothing_stale(self):
+        old = timezone.now() - datetime.timedelta(days=1)
+        TrackModel.objects.update(track_refreshed_at=old)
+        ArtistModel.objects.update(artist_refreshed_at=old)
+        self.assertEqual(refresh_metadata(10, USER_ID), 0)
+        self.assertEqual(sum(self.fake.calls.values()), 0)
@@ -0,0 +1,32 @@
+from django.test import TestCase
+
+from lynify.models.artists import ArtistModel
+from lynify.models.tracks import TrackModel
+from lynify.tests.utils import USER_ID, seed_library
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_library()
+        beatles = ArtistModel.objects.create(artist_id="beatles", artist_name="The Beatles")
+        TrackModel.objects.create(track_id="yesterday", track_name="Yesterday", track_album="Help!")
+        TrackModel.objects.get(track_id="yesterday").track_artists.set([beatles])
+        TrackModel.update_search(["yesterday"])
+
+    def setUp(self):
+        session = self.client.session
+        session["user_id"] = USER_ID
+        session.save()
+
+    def search(self, q: str) -> str:
+        return self.client.get("/search/", {"q": q}, HTTP_HOST="localhost").content.decode()
+
+    def test_prefix(self):
+        html = self.search("yester beat")
+        self.assertIn("Yesterday", html)
+        self.assertIn("The Beatles", html)
+
+    def test_misspelled(self):
+        self.assertIn("Yesterday", self.search("yesterdy"))
+        self.assertIn("The Beatles", self.search("beatlez"))
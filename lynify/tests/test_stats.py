@@ -0,0 +1,130 @@
+import datetime
+
+from django.test import TestCase
+
+from lynify.models.artists import ArtistModel
+from lynify.models.history import HistoryModel
+from lynify.models.stats import DailyArtistStatsModel, DailyTrackStatsModel, rebuild_play_counters, rebuild_rollups
+from lynify.models.tracks import TrackModel
+
+
+def at(day: int, hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime(2024, 5, day, hour, minute, tzinfo=datetime.UTC)
+
+
+def play(user_id: str, timestamp: datetime.datetime, track_id: str, ms_played=None) -> HistoryModel:
+    return HistoryModel(user_id=user_id, timestamp=timestamp, track_id=track_id, ms_played=ms_played)
+
+
+def record_plays():
+    """
+    Two tracks sharing an artist, played by two users over two days. Plays
+    without ms_played count as the whole track.
+    """
+    a1, a2 = ArtistModel.objects.bulk_create([ArtistModel(artist_id="a1"), ArtistModel(artist_id="a2")])
+    t1, t2 = TrackModel.objects.bulk_create(
+        [TrackModel(track_id="t1", track_duration=200000), TrackModel(track_id="t2", track_duration=100000)]
+    )
+    t1.track_artists.set([a1, a2])
+    t2.track_artists.set([a2])
+    first = HistoryModel.record(
+        [
+            play("u1", at(17, 10), "t1"),
+            play("u1", at(17, 12), "t1", 50000),
+            # a repeat of a play in the same batch
+            play("u1", at(17, 12), "t1", 50000),
+            play("u2", at(17, 12), "t1", 150000),
+        ]
+    )
+    second = HistoryModel.record(
+        [
+            # conflicts with a stored play, another poller recorded it already
+            play("u1", at(17, 10), "t2"),
+            # the last minutes of the 18th in UTC
+            play("u1", at(18, 23, 59), "t2", 30000),
+            play("u1", at(19, 0, 1), "t2"),
+        ]
+    )
+    return first, second
+
+
+class RollupsTest(TestCase):
+    def setUp(self):
+        self.first, self.second = record_plays()
+
+    def track_stats(self) -> set:
+        return set(DailyTrackStatsModel.objects.values_list("user_id", "day", "track_id", "play_count", "ms_played"))
+
+    def artist_stats(self) -> set:
+        return set(DailyArtistStatsModel.objects.values_list("user_id", "day", "artist_id", "play_count", "ms_played"))
+
+    def test_record(self):
+        self.assertEqual(len(self.first), 3)
+        self.assertEqual([entry.timestamp for entry in self.second], [at(18, 23, 59), at(19, 0, 1)])
+        day = datetime.date(2024, 5, 17)
+        self.assertEqual(
+            self.track_stats(),
+            {
+                ("u1", day, "t1", 2, 250000),
+                ("u2", day, "t1", 1, 150000),
+                ("u1", datetime.date(2024, 5, 18), "t2", 1, 30000),
+                ("u1", datetime.date(2024, 5, 19), "t2", 1, 100000),
+            },
+        )
+        self.assertEqual(
+            self.artist_stats(),
+            {
+                ("u1", day, "a1", 2, 250000),
+                ("u1", day, "a2", 2, 250000),
+                ("u2", day, "a1", 1, 150000),
+                ("u2", day, "a2", 1, 150000),
+                ("u1", datetime.date(2024, 5, 18), "a2", 1, 30000),
+                ("u1", datetime.date(2024, 5, 19), "a2", 1, 100000),
+            },
+        )
+
+    def test_rebuild(self):
+        track_stats, artist_stats = self.track_stats(), self.artist_stats()
+        rebuild_rollups("u1")
+        self.assertEqual((self.track_stats(), self.artist_stats()), (track_stats, artist_stats))
+        DailyTrackStatsModel.objects.all().delete()
+        DailyArtistStatsModel.objects.all().delete()
+        rebuild_rollups()
+        self.assertEqual((self.track_stats(), self.artist_stats()), (track_stats, artist_stats))
+
+
+class PlayCountersTest(TestCase):
+    def setUp(self):
+        record_plays()
+
+    def counters(self) -> set:
+        return set(
+            TrackModel.objects.values_list(
+                "track_id", "track_play_count", "track_total_ms_played", "track_last_played_at"
+            )
+        ) | set(
+            ArtistModel.objects.values_list(
+                "artist_id", "artist_play_count", "artist_total_ms_played", "artist_last_played_at"
+            )
+        )
+
+    def test_record(self):
+        self.assertEqual(
+            self.counters(),
+            {
+                ("t1", 3, 400000, at(17, 12)),
+                ("t2", 2, 130000, at(19, 0, 1)),
+                ("a1", 3, 400000, at(17, 12)),
+                ("a2", 5, 530000, at(19, 0, 1)),
+            },
+        )
+
+    def test_last_played_at_never_goes_back(self):
+        HistoryModel.record([play("u2", at(1, 9), "t2")])
+        self.assertIn(("t2", 3, 230000, at(19, 0, 1)), self.counters())
+
+    def test_rebuild(self):
+        counters = self.counters()
+        TrackModel.objects.update(track_play_count=99, track_last_played_at=None)
+        rebuild_play_counters()
+        self.assertEqual(self.counters(), counters)
@@ -0,0 +1,38 @@
+import contextlib
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from lynify.models import tokens
+from lynify.models.tokens import AccessToken
+from lynify.tests.utils import USER_ID
+
+
+class CachedTokenTest(TestCase):
+    def setUp(self):
+        tokens._token_cache.clear()
+        tokens._cache_file_checked = False
+
+    def cached_token(self, owner: str):
+        token = {"access_token": "cached", "refresh_token": "refresh", "expires_at": int(time.time()) + 3600}
+        return (
+            mock.patch("lynify.models.tokens.CacheFileHandler.get_cached_token", return_value=token),
+            mock.patch("lynify.models.tokens.get_oauth", return_value=mock.Mock(validate_token=lambda token: token)),
+            mock.patch("lynify.models.tokens.get_user_id", return_value=owner),
+        )
+
+    def test_other_users_token_is_not_taken(self):
+        with contextlib.ExitStack() as stack:
+            for patch in self.cached_token("someone else"):
+                stack.enter_context(patch)
+            self.assertIsNone(AccessToken.get_token(USER_ID))
+        # stored under the user it belongs to instead
+        self.assertEqual(AccessToken.objects.get(user_id="someone else").access_token, "cached")
+        self.assertFalse(AccessToken.objects.filter(user_id=USER_ID).exists())
+
+    def test_own_token_is_imported(self):
+        with contextlib.ExitStack() as stack:
+            for patch in self.cached_token(USER_ID):
+                stack.enter_context(patch)
+            self.assertEqual(AccessToken.get_token(USER_ID).access_token, "cached")
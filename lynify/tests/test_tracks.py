@@ -0,0 +1,82 @@
+import math
+from unittest import mock
+
+from django.db import DatabaseError, connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from lynify.models.artists import ArtistModel
+from lynify.models.tracks import TRACKS_PER_REQUEST, TrackModel
+from lynify.tests.utils import USER_ID, FakeSpotifyMixin, FakeSpotifyTestCase, create_token
+
+
+class FromSpotifyManyTest(FakeSpotifyTestCase):
+    def setUp(self):
+        super().setUp()
+        create_token(USER_ID)
+
+    def test_fetches_missing_in_batches(self):
+        TrackModel.objects.bulk_create([TrackModel(track_id="t" + str(i), track_name="Stored") for i in range(10)])
+        track_ids = ["t" + str(i) for i in range(130)]
+        # repeated ids are fetched once
+        tracks = TrackModel.from_spotify_many(track_ids + track_ids[:20], user_id=USER_ID)
+        self.assertEqual(set(tracks), set(track_ids))
+        self.assertEqual(self.fake.calls["tracks"], math.ceil(120 / TRACKS_PER_REQUEST))
+        # stored tracks aren't fetched again
+        self.assertEqual(TrackModel.objects.filter(track_name="Stored").count(), 10)
+        self.assertEqual(tracks["t10"].track_name, "Track t10")
+        self.assertEqual(
+            set(tracks["t10"].track_artists.values_list("artist_id", flat=True)),
+            {artist["id"] for artist in self.fake.track("t10")["artists"]},
+        )
+
+        self.fake.reset_calls()
+        TrackModel.from_spotify_many(track_ids, user_id=USER_ID)
+        self.assertEqual(sum(self.fake.calls.values()), 0)
+
+    def test_queries_dont_grow_with_the_batch(self):
+        # the token is loaded once
+        TrackModel.from_spotify_many(["warmup"], user_id=USER_ID)
+        queries = []
+        for count in (1, 10, 200):
+            with CaptureQueriesContext(connection) as context:
+                TrackModel.from_spotify_many(["n" + str(count) + "x" + str(i) for i in range(count)], user_id=USER_ID)
+            queries.append(len(context))
+        self.assertEqual(queries, [queries[0]] * 3)
+
+
+class StoreTest(FakeSpotifyMixin, TransactionTestCase):
+    """
+    Tracks, their artists and the links between them are stored in one transaction,
+    outside of a test transaction to see what a failure leaves behind
+    """
+
+    def setUp(self):
+        super().setUp()
+        create_token(USER_ID)
+        self.track_ids = ["t" + str(i) for i in range(60)]
+
+    def assertNothingStored(self):
+        self.assertFalse(TrackModel.objects.exists())
+        self.assertFalse(ArtistModel.objects.exists())
+        self.assertFalse(TrackModel.track_artists.through.objects.exists())
+
+    def test_artist_store_fails(self):
+        # ArtistModel.store raises after inserting the artists
+        with mock.patch.object(ArtistModel, "add_genres", side_effect=DatabaseError("failed")):
+            with self.assertRaises(DatabaseError):
+                TrackModel.from_spotify_many(self.track_ids, user_id=USER_ID)
+        self.assertNothingStored()
+
+    def test_last_statement_fails(self):
+        with mock.patch.object(TrackModel, "update_search", side_effect=DatabaseError("failed")):
+            with self.assertRaises(DatabaseError):
+                TrackModel.from_spotify_many(self.track_ids, user_id=USER_ID)
+        self.assertNothingStored()
+
+    def test_store(self):
+        tracks = TrackModel.from_spotify_many(self.track_ids, user_id=USER_ID)
+        self.assertEqual(len(tracks), 60)
+        # every track has its artists
+        self.assertFalse(TrackModel.objects.filter(track_artists=None).exists())
+        self.assertEqual(TrackModel.objects.filter(track_search__isnull=True).count(), 0)
@@ -0,0 +1,79 @@
+import datetime
+import time
+
+from django.test import TestCase
+from django.utils import timezone
+
+from lynify.models import tokens
+from lynify.models.artists import ArtistModel
+from lynify.models.history import HistoryModel
+from lynify.models.tokens import AccessToken
+from lynify.models.tracks import TrackModel
+from lynify.settings import SPOTIFY_API_URL
+from lynify.utils.fake_spotify import FakeSpotify
+from lynify.utils.spotify import use_api_url
+
+USER_ID = "tester"
+TRACKS = 120
+
+
+def seed_library():
+    """
+    TRACKS tracks of two artists each, played once each by USER_ID, and USER_ID's token
+    """
+    artists = ArtistModel.objects.bulk_create(
+        [ArtistModel(artist_id="a" + str(i), artist_name="Artist " + str(i)) for i in range(10)]
+    )
+    tracks = TrackModel.objects.bulk_create(
+        [
+            TrackModel(track_id="t" + str(i), track_name="Track " + str(i), track_popularity=i % 50)
+            for i in range(TRACKS)
+        ]
+    )
+    for i, track in enumerate(tracks):
+        track.track_artists.set([artists[i % 10], artists[(i + 1) % 10]])
+    start = timezone.now() - datetime.timedelta(days=1)
+    HistoryModel.objects.bulk_create(
+        [
+            HistoryModel(user_id=USER_ID, timestamp=start + datetime.timedelta(minutes=i), track=track)
+            for i, track in enumerate(tracks)
+        ]
+    )
+    create_token(USER_ID)
+
+
+def create_token(user_id: str) -> AccessToken:
+    return AccessToken.objects.create(
+        user_id=user_id,
+        access_token="token",
+        refresh_token="refresh",
+        expires_at=int((time.time() + 3600) * 1000),
+    )
+
+
+class FakeSpotifyMixin:
+    """
+    Test case mixin pointing the spotify clients at a FakeSpotify, `fake`
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeSpotify()
+        cls.fake.start()
+        use_api_url(cls.fake.api_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        use_api_url(SPOTIFY_API_URL)
+        cls.fake.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.fake.reset_calls()
+        # tokens of earlier tests are rolled back, don't serve them from memory
+        tokens._token_cache.clear()
+
+
+class FakeSpotifyTestCase(FakeSpotifyMixin, TestCase):
+    pass
@@ -19,17 +19,29 @@ from django.urls import path
 
 from lynify.views.artist import artist
 from lynify.views.artists import artists
+from lynify.views.export import artists_export, history_export, tracks_export
 from lynify.views.history import history
 from lynify.views.index import index
+from lynify.views.metrics import metrics
+from lynify.views.now_playing import now_playing_events
+from lynify.views.search import search
+from lynify.views.stats import stats
 from lynify.views.track import track
 from lynify.views.tracks import tracks
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("", index, name="index"),
+    path("now-playing/events", now_playing_events, name="now_playing_events"),
     path("history/", history, name="history"),
+    path("history/export/", history_export, name="history_export"),
     path("artists/", artists, name="artists"),
+    path("artists/export/", artists_export, name="artists_export"),
     path("artist", artist, name="artist"),
     path("tracks/", tracks, name="tracks"),
+    path("tracks/export/", tracks_export, name="tracks_export"),
     path("track/", track, name="track"),
+    path("stats/", stats, name="stats"),
+    path("search/", search, name="search"),
+    path("metrics", metrics, name="metrics"),
 ]
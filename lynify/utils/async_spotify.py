@@ -0,0 +1,109 @@
+"""
+Non-blocking spotify client for the async views
+
+Makes the api calls the async views need with httpx, so a worker keeps
+serving other requests while they are in flight. Requests are retried and
+recorded in the metrics like the shared requests session's, and errors
+raise spotipy's SpotifyException so callers handle both clients alike.
+"""
+import asyncio
+import time
+import weakref
+from typing import List, Optional
+
+import httpx
+from asgiref.sync import sync_to_async
+from spotipy import Spotify
+from spotipy.exceptions import SpotifyException
+
+from lynify.metrics import SPOTIFY_LATENCY, SPOTIFY_REQUESTS, SPOTIFY_RETRIES, spotify_endpoint
+from lynify.settings import SPOTIFY_USER_ID
+from lynify.utils.spotify import POOL_SIZE, get_api_url
+
+# seconds before a request gives up, spotipy's default
+REQUEST_TIMEOUT = 5
+# first retry's delay, doubled for each retry after it unless spotify says how long to wait
+RETRY_BACKOFF = 0.3
+
+# httpx clients only work on the event loop they were created on, so keep one per loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the running event loop's httpx client, keeping connections alive between calls
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=httpx.Limits(max_connections=POOL_SIZE))
+        _clients[loop] = client
+    return client
+
+
+def retry_delay(response: httpx.Response, retry: int) -> float:
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BACKOFF * 2**retry
+
+
+class AsyncSpotify:
+    """
+    Async spotify client for a user, authenticating with their current access token
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+    async def _get(self, path: str, params: Optional[dict] = None) -> Optional[dict]:
+        from lynify.models.tokens import AccessToken, TokenException
+
+        token = await sync_to_async(AccessToken.get_token)(self.user_id)
+        if token is None:
+            raise TokenException("No access token for " + self.user_id)
+        url = get_api_url() + path
+        endpoint = spotify_endpoint(url)
+        headers = {"Authorization": "Bearer " + token.access_token}
+        start = time.perf_counter()
+        status = "error"
+        try:
+            for retry in range(Spotify.max_retries + 1):
+                response = await get_client().get(url, params=params, headers=headers)
+                status = str(response.status_code)
+                if response.status_code not in Spotify.default_retry_codes or retry == Spotify.max_retries:
+                    break
+                SPOTIFY_RETRIES.labels(endpoint, status).inc()
+                await asyncio.sleep(retry_delay(response, retry))
+        finally:
+            SPOTIFY_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+            SPOTIFY_REQUESTS.labels(endpoint, status).inc()
+
+        if response.status_code >= 400:
+            try:
+                error = response.json()["error"]
+                message = error.get("message", "error") if isinstance(error, dict) else error
+            except (ValueError, KeyError):
+                message = response.text or None
+            raise SpotifyException(
+                response.status_code, -1, str(response.url) + ":\n " + str(message), headers=response.headers
+            )
+        if not response.content:
+            return None
+        return response.json()
+
+    async def current_user_playing_track(self) -> Optional[dict]:
+        return await self._get("me/player/currently-playing")
+
+    async def tracks(self, track_ids: List[str]) -> Optional[dict]:
+        return await self._get("tracks/", {"ids": ",".join(track_ids)})
+
+    async def artists(self, artist_ids: List[str]) -> Optional[dict]:
+        return await self._get("artists/", {"ids": ",".join(artist_ids)})
+
+
+def get_async_spotify(user_id: Optional[str] = None) -> AsyncSpotify:
+    """
+    Returns an async spotify client for a user
+    """
+    return AsyncSpotify(user_id if user_id is not None else SPOTIFY_USER_ID)
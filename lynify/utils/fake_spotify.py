@@ -0,0 +1,145 @@
+"""
+Local stand-in for the spotify web api, for benchmarks
+
+Serves the endpoints lynify calls over http on a local port, after a
+configurable delay per request, and counts the requests per endpoint.
+Track and artist metadata is made up from the ids, so any id resolves and
+the same id always gets the same metadata. Playback is whatever the caller
+sets as `playing` and `recently_played`.
+"""
+import collections
+import datetime
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+API_PATH = "/v1/"
+
+
+def id_number(spotify_id: str) -> int:
+    return zlib.crc32(spotify_id.encode())
+
+
+class FakeSpotify:
+    """
+    Fake api server. Tracks are by one of `artists` artists "a0" to
+    "a<artists - 1>", and every other track also by an artist of its own.
+    """
+
+    def __init__(self, latency: float = 0.0, artists: int = 1000):
+        self.latency = latency
+        self.artists = artists
+        self.calls: Dict[str, int] = collections.Counter()
+        # currently playing response, None when nothing is playing
+        self.playing: Optional[dict] = None
+        # plays served by the recently played endpoint, as (played at in ms, track id), oldest first
+        self.recently_played: List[Tuple[int, str]] = []
+        self._calls_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpotifyHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-spotify", daemon=True)
+
+    @property
+    def api_url(self) -> str:
+        return "http://127.0.0.1:" + str(self._server.server_address[1]) + API_PATH
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls.clear()
+
+    def track(self, track_id: str) -> dict:
+        n = id_number(track_id)
+        artists = [{"id": "a" + str(n % self.artists), "name": "Artist " + str(n % self.artists)}]
+        if n % 2:
+            artists.append({"id": "a" + track_id, "name": "Artist " + track_id})
+        return {
+            "id": track_id,
+            "name": "Track " + track_id,
+            "album": {"name": "Album " + str(n % 5000), "release_date": str(1960 + n % 65)},
+            "artists": artists,
+            "duration_ms": 120000 + n % 240000,
+            "popularity": n % 101,
+            "explicit": n % 5 == 0,
+        }
+
+    def artist(self, artist_id: str) -> dict:
+        n = id_number(artist_id)
+        return {
+            "id": artist_id,
+            "name": "Artist " + artist_id,
+            "genres": ["genre " + str(n % 500), "genre " + str(n % 37)],
+            "popularity": n % 101,
+            "followers": {"total": n % 1000000},
+        }
+
+    def recently_played_page(self, after: int, limit: int) -> dict:
+        """
+        The oldest `limit` plays after the cursor, newest first like spotify
+        """
+        plays = [play for play in self.recently_played if play[0] > after][:limit]
+        items = [
+            {
+                "track": self.track(track_id),
+                "played_at": datetime.datetime.fromtimestamp(played_at / 1000.0, tz=datetime.UTC).isoformat(),
+            }
+            for played_at, track_id in reversed(plays)
+        ]
+        cursors = {"after": str(plays[-1][0]), "before": str(plays[0][0])} if plays else None
+        return {"items": items, "cursors": cursors, "limit": limit}
+
+    def respond(self, endpoint: str, params: Dict[str, str]) -> Tuple[int, Optional[dict]]:
+        """
+        Returns the status and body of a response to a GET of an endpoint
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        name, _, resource_id = endpoint.partition("/")
+        with self._calls_lock:
+            self.calls[name if name in ("tracks", "artists") else endpoint] += 1
+        if name == "tracks":
+            if resource_id:
+                return 200, self.track(resource_id)
+            return 200, {"tracks": [self.track(track_id) for track_id in params["ids"].split(",")]}
+        if name == "artists":
+            if resource_id:
+                return 200, self.artist(resource_id)
+            return 200, {"artists": [self.artist(artist_id) for artist_id in params["ids"].split(",")]}
+        if endpoint == "me/player/currently-playing":
+            return (200, self.playing) if self.playing is not None else (204, None)
+        if endpoint == "me/player/recently-played":
+            return 200, self.recently_played_page(int(params.get("after", 0)), int(params.get("limit", 20)))
+        if endpoint == "me":
+            return 200, {"id": "benchmark"}
+        return 404, {"error": {"status": 404, "message": "Unknown endpoint " + endpoint}}
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    # keep connections alive, like the real api
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        endpoint = url.path[len(API_PATH) :].strip("/")
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        status, body = self.server.fake.respond(endpoint, params)
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
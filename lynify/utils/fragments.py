@@ -0,0 +1,39 @@
+"""
+Cached html fragments
+
+Table rows are rendered once and kept in the cache under a key made from
+everything the row shows, so a row is only rendered again after it changes.
+A page looks all of its rows up with a single get_many and renders only the
+ones that are missing.
+"""
+import hashlib
+from typing import Callable, List, Sequence
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import SafeString, mark_safe
+
+
+def fragment_key(template_name: str, values: Sequence) -> str:
+    """
+    Returns a cache key for a template rendered with the given values
+    """
+    digest = hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+    return "fragment:" + template_name + ":" + digest
+
+
+def cached_fragments(template_name: str, name: str, objects: list, values: Callable) -> List[SafeString]:
+    """
+    Render template_name once per object, with the object in the context as
+    `name`. values(object) returns everything the template shows of it.
+    """
+    keys = [fragment_key(template_name, values(obj)) for obj in objects]
+    fragments = cache.get_many(keys)
+    missing = {}
+    template = get_template(template_name)
+    for key, obj in zip(keys, objects):
+        if key not in fragments:
+            fragments[key] = missing[key] = template.render({name: obj})
+    if missing:
+        cache.set_many(missing)
+    return [mark_safe(fragments[key]) for key in keys]
@@ -0,0 +1,74 @@
+"""
+Incremental reading of large JSON arrays
+
+Reads a file holding one JSON array a chunk at a time and yields its items
+one by one, so only a chunk and the item being decoded are held in memory.
+"""
+import json
+from typing import IO, Any, Iterator
+
+# characters json allows between values
+WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(fp: IO[str], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Yield the items of the JSON array in fp.
+    Raises ValueError if fp doesn't hold a single array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                return ""
+            read_more()
+
+    if next_char() != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            # a value is only complete once the separator after it is read,
+            # a number at the end of the buffer may continue in the next chunk
+            following = end
+            while following < len(buffer) and buffer[following] in WHITESPACE:
+                following += 1
+            if not eof and (following == len(buffer) or buffer[following] not in ",]"):
+                read_more()
+                continue
+            break
+        pos = end
+        yield item
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError("expected ',' or ']' at position " + str(pos))
+        pos += 1
@@ -0,0 +1,163 @@
+"""
+Keyset (cursor) pagination
+
+Pages are ordered descending on a single column with the primary key as a
+tie-breaker. Instead of an offset, each page link carries the ordering values
+of the row it starts after (or ends before), so every page is a range scan on
+the matching index no matter how deep it is. Whether there is another page is
+decided by fetching one extra row rather than counting the table.
+
+Nullable ordering columns follow Postgres' default for descending indexes,
+which puts NULLs first.
+"""
+import base64
+import datetime
+import json
+from typing import List, NamedTuple, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, QuerySet
+
+
+class KeysetPage(NamedTuple):
+    rows: list
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder truncates times to milliseconds, a cursor has to keep them exact
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    Decode a cursor created by encode_cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) not in (1, 2):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _row_cursor(row, order_field: str, pk_name: str) -> str:
+    if order_field == pk_name:
+        return encode_cursor([row.pk])
+    return encode_cursor([getattr(row, order_field), row.pk])
+
+
+def _cursor_filters(queryset: QuerySet, order_field: str, cursor: str, forward: bool) -> List[Q]:
+    """
+    Build the conditions selecting rows after (forward) or before the cursor
+    in descending (order_field, pk) order with NULLs first.
+    Each condition bounds order_field so it is a range of the matching index,
+    and every row matching one comes before the rows matching the next, so
+    they are read in turn until the page is full.
+    """
+    meta = queryset.model._meta
+    pk_name = meta.pk.name
+    values = decode_cursor(cursor)
+    try:
+        pk_value = meta.pk.to_python(values[-1])
+        if order_field == pk_name:
+            return [Q(pk__lt=pk_value) if forward else Q(pk__gt=pk_value)]
+        if len(values) != 2:
+            raise ValueError("Invalid cursor")
+        value = values[0]
+        if value is not None:
+            value = meta.get_field(order_field).to_python(value)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+    if forward:
+        if value is None:
+            return [
+                Q(**{order_field + "__isnull": True, "pk__lt": pk_value}),
+                Q(**{order_field + "__isnull": False}),
+            ]
+        # the redundant bound on order_field alone is what the index scan can start from
+        return [
+            Q(**{order_field + "__lte": value})
+            & (Q(**{order_field + "__lt": value}) | Q(**{order_field: value, "pk__lt": pk_value}))
+        ]
+    if value is None:
+        return [Q(**{order_field + "__isnull": True, "pk__gt": pk_value})]
+    filters = [
+        Q(**{order_field + "__gte": value})
+        & (Q(**{order_field + "__gt": value}) | Q(**{order_field: value, "pk__gt": pk_value}))
+    ]
+    if meta.get_field(order_field).null:
+        filters.append(Q(**{order_field + "__isnull": True}))
+    return filters
+
+
+def keyset_page(
+    queryset: QuerySet, order_field: str, limit: int, after: Optional[str] = None, before: Optional[str] = None
+) -> KeysetPage:
+    """
+    Return one page of queryset ordered by -order_field, -pk.
+    `after` continues towards older/lower rows, `before` goes back towards newer/higher rows.
+    Raises ValueError if a cursor is malformed.
+    """
+    pk_name = queryset.model._meta.pk.name
+    forward = not before
+    if order_field == pk_name:
+        ordering = ["-pk"] if forward else ["pk"]
+    elif forward:
+        ordering = [F(order_field).desc(nulls_first=True), "-pk"]
+    else:
+        ordering = [F(order_field).asc(nulls_last=True), "pk"]
+
+    cursor = after if forward else before
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        # the rows matching a later filter are only read when the page isn't full yet,
+        # so deep pages cost one query like the first page
+        rows = []
+        for condition in _cursor_filters(queryset, order_field, cursor, forward):
+            rows += queryset.filter(condition)[: limit + 1 - len(rows)]
+            if len(rows) > limit:
+                break
+    else:
+        rows = list(queryset[: limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows, None, None)
+
+    first = _row_cursor(rows[0], order_field, pk_name)
+    last = _row_cursor(rows[-1], order_field, pk_name)
+    if forward:
+        return KeysetPage(rows, last if has_more else None, first if cursor else None)
+    return KeysetPage(rows, last, first if has_more else None)
+
+
+def paginate(request, queryset: QuerySet, order_field: str, limit: int) -> KeysetPage:
+    """
+    Page a queryset using the after and before query parameters.
+    Invalid cursors fall back to the first page.
+    """
+    after = request.GET.get("after") or None
+    before = request.GET.get("before") or None
+    try:
+        return keyset_page(queryset, order_field, limit, after=after, before=before)
+    except ValueError:
+        return keyset_page(queryset, order_field, limit)
@@ -0,0 +1,62 @@
+"""
+Full text search queries
+
+Search documents use the 'simple' text search config, which lowercases words
+without stemming them. Every word of a query has to match the start of a
+word in the document, so partly typed queries already find results.
+
+Queries with a typo match no words, so results are filled up with rows whose
+names are similar to the query by pg_trgm word similarity, found through the
+trigram indexes on those names.
+"""
+import re
+from functools import reduce
+from operator import or_
+from typing import Optional
+
+from django.contrib.postgres.search import SearchQuery, TrigramWordSimilarity
+from django.db.models import Q
+from django.db.models.expressions import Expression
+from django.db.models.functions import Greatest
+
+SEARCH_CONFIG = "simple"
+
+
+def _query(text: str, suffix: str) -> Optional[SearchQuery]:
+    # only word characters reach the raw query, so it needs no escaping
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    return SearchQuery(" & ".join(word + suffix for word in words), search_type="raw", config=SEARCH_CONFIG)
+
+
+def prefix_query(text: str) -> Optional[SearchQuery]:
+    """
+    Returns a query matching documents with words starting with each word of
+    text, or None if text has no words
+    """
+    return _query(text, ":*")
+
+
+def exact_query(text: str) -> Optional[SearchQuery]:
+    """
+    Returns a query matching documents with each word of text, for ranking
+    whole word matches above prefix matches
+    """
+    return _query(text, "")
+
+
+def fuzzy_filter(text: str, *fields: str) -> Q:
+    """
+    Returns a filter for rows where one of fields has a part similar to text
+    (the `%>` operator, which the trigram indexes serve)
+    """
+    return reduce(or_, [Q(**{field + "__trigram_word_similar": text}) for field in fields])
+
+
+def fuzzy_similarity(text: str, *fields: str) -> Expression:
+    """
+    Returns the best word similarity of text to any of fields, for ranking fuzzy matches
+    """
+    similarities = [TrigramWordSimilarity(text, field) for field in fields]
+    return Greatest(*similarities) if len(similarities) > 1 else similarities[0]
@@ -0,0 +1,129 @@
+"""
+Shared spotify clients
+
+Clients are built once per process and keep one requests session, so
+connections to the api stay alive between calls instead of paying for a new
+TLS handshake each time. They authenticate through AccessToken.get_token on
+every request, which picks up refreshed tokens without rebuilding the client.
+"""
+import threading
+from functools import cache
+from typing import Dict, Optional
+
+import requests
+from spotipy import Spotify
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+from lynify.metrics import MetricsAdapter, MetricsRetry
+from lynify.settings import (
+    SPOTIFY_API_URL,
+    SPOTIFY_CLIENT_ID,
+    SPOTIFY_CLIENT_SECRET,
+    SPOTIFY_USER_ID,
+    SPOTIPY_REDIRECT_URI,
+)
+
+SPOTIFY_SCOPE = "user-read-currently-playing user-read-recently-played"
+# connections kept alive per host, enough for the web workers' threads
+POOL_SIZE = 16
+
+_clients: Dict[str, Spotify] = {}
+_clients_lock = threading.Lock()
+# api the clients talk to, see use_api_url
+_api_url = SPOTIFY_API_URL
+
+
+class TokenAuthManager:
+    """
+    Minimal spotipy auth manager handing out the user's current access token
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+
+    def get_access_token(self, as_dict=False) -> str:
+        from lynify.models.tokens import AccessToken, TokenException
+
+        token = AccessToken.get_token(self.user_id)
+        if token is None:
+            raise TokenException("No access token for " + self.user_id)
+        return token.access_token
+
+
+@cache
+def get_session() -> requests.Session:
+    """
+    Returns the process wide requests session, retrying like spotipy's own
+    and recording metrics of every request
+    """
+    session = requests.Session()
+    retry = MetricsRetry(
+        total=Spotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=Spotify.max_retries,
+        backoff_factor=0.3,
+        status_forcelist=Spotify.default_retry_codes,
+    )
+    adapter = MetricsAdapter(max_retries=retry, pool_connections=4, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@cache
+def get_oauth() -> SpotifyOAuth:
+    # tokens are stored per user in the database, so don't let spotipy write
+    # whichever user logged in last to a cache file shared by all of them
+    return SpotifyOAuth(
+        client_id=SPOTIFY_CLIENT_ID,
+        client_secret=SPOTIFY_CLIENT_SECRET,
+        redirect_uri=SPOTIPY_REDIRECT_URI,
+        scope=SPOTIFY_SCOPE,
+        requests_session=get_session(),
+        cache_handler=MemoryCacheHandler(),
+    )
+
+
+def get_user_id(access_token: str) -> str:
+    """
+    Returns the id of the spotify user an access token belongs to
+    """
+    response = get_session().get(_api_url + "me", headers={"Authorization": "Bearer " + access_token})
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def get_spotify(user_id: Optional[str] = None) -> Spotify:
+    """
+    Returns the shared spotify client for a user
+    """
+    if user_id is None:
+        user_id = SPOTIFY_USER_ID
+    client = _clients.get(user_id)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(user_id)
+        if client is None:
+            client = Spotify(auth_manager=TokenAuthManager(user_id), requests_session=get_session())
+            client.prefix = _api_url
+            _clients[user_id] = client
+        return client
+
+
+def get_api_url() -> str:
+    return _api_url
+
+
+def use_api_url(api_url: str):
+    """
+    Point the spotify clients at another api, e.g. a local stand-in for benchmarks
+    """
+    global _api_url
+    with _clients_lock:
+        _api_url = api_url
+        for client in _clients.values():
+            client.prefix = api_url
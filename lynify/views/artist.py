@@ -1,28 +1,18 @@
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse
+from django.shortcuts import render
 
 from lynify.models.artists import ArtistModel
 from lynify.views.html import SpotifyLogin, header
 
 
-def artist(request):
-    html = header()
-    token_success, token_result = SpotifyLogin(request)
+async def artist(request):
+    token_success, token_result = await sync_to_async(SpotifyLogin)(request)
     if not token_success:
-        html += token_result
-        return HttpResponse(html)
+        return HttpResponse(header() + token_result)
 
     artist_id = request.GET.get("artist_id", "")
     if artist_id == "":
-        html += "No artist ID provided"
-        return HttpResponse(html)
-    artist = ArtistModel.objects.get(artist_id=artist_id)
-    html += "<table>"
-    html += "<tr><th>Artist</th><th>Genres</th><th>Popularity</th><th>Followers</th></tr>"
-    html += "<tr>"
-    artist_link = '<a href="/artist?artist_id=' + artist.artist_id + '">' + artist.artist_name + "</a>"
-    cols = [artist_link, str(artist.artist_genres), str(artist.artist_popularity), str(artist.artist_followers)]
-    for col in cols:
-        html += "<td>" + col + "</td>"
-    html += "</tr>"
-    html += "</table>"
-    return HttpResponse(html)
+        return HttpResponse(header() + "No artist ID provided")
+    artist = await ArtistModel.objects.prefetch_related("artist_genres").aget(artist_id=artist_id)
+    return render(request, "lynify/artist.html", {"header": header(), "artist": artist})
@@ -1,50 +1,44 @@
 from django.http import HttpResponse
+from django.shortcuts import render
 
 from lynify.models.artists import ArtistModel
-from lynify.views.html import SpotifyLogin, header
+from lynify.utils.pagination import paginate
+from lynify.views.conditional import conditional_page
+from lynify.views.html import SpotifyLogin, artist_rows, genre_params, header, pagination_links, sort_links
 
+# ways to sort the artists page, name -> ordering field
+ARTIST_SORTS = {
+    "followers": "artist_followers",
+    "plays": "artist_play_count",
+    "last_played": "artist_last_played_at",
+}
+SORT_LABELS = {"followers": "Followers", "plays": "Plays", "last_played": "Last Played"}
 
+
+@conditional_page
 def artists(request):
     limit = request.GET.get("limit", "25")
-    offset = request.GET.get("offset", "0")
     limit = int(limit)
-    offset = int(offset)
-    html = header()
     token_success, token_result = SpotifyLogin(request)
     if not token_success:
-        html += token_result
-        return HttpResponse(html)
-
-    artist_list = ArtistModel.objects.all()[offset : offset + limit]  # .get_all_limit_offset(limit, offset)
-    html += "<table>"
-    html += "<tr><th>Artist</th><th>Genres</th><th>Popularity</th><th>Followers</th></tr>"
-    for artist in artist_list:
-        html += "<tr>"
-        artist_link = '<a href="/artist?artist_id=' + artist.artist_id + '">' + artist.artist_name + "</a>"
-        cols = [artist_link, str(artist.artist_genres), str(artist.artist_popularity), str(artist.artist_followers)]
-        for col in cols:
-            html += "<td>" + col + "</td>"
-        html += "</tr>"
-    html += "</table>"
+        return HttpResponse(header() + token_result)
 
-    # add pagination
-    html += '<div class="w3-bar w3-black">'
-    if offset > 0:
-        prev_offset = max(0, offset - limit)
-        html += (
-            '<a href="/artists?limit='
-            + str(limit)
-            + "&offset="
-            + str(prev_offset)
-            + '" class="w3-bar-item w3-button">Previous</a>'
-        )
-    if offset + limit < ArtistModel.objects.count():
-        html += (
-            '<a href="/artists?limit='
-            + str(limit)
-            + "&offset="
-            + str(offset + limit)
-            + '" class="w3-bar-item w3-button">Next</a>'
-        )
-    html += "</div>"
-    return HttpResponse(html)
+    sort = request.GET.get("sort", "followers")
+    if sort not in ARTIST_SORTS:
+        sort = "followers"
+    genre = request.GET.get("genre", "")
+    params = {"sort": sort, **genre_params(genre)}
+    artist_list = ArtistModel.objects.prefetch_related("artist_genres")
+    if genre:
+        artist_list = artist_list.filter(artist_genres=genre)
+    if sort == "last_played":
+        artist_list = artist_list.filter(artist_last_played_at__isnull=False)
+    page = paginate(request, artist_list, ARTIST_SORTS[sort], limit)
+    context = {
+        "header": header(),
+        "genre": genre,
+        "sorts": sort_links(limit, SORT_LABELS, sort, genre_params(genre)),
+        "rows": artist_rows(page.rows),
+        **pagination_links(limit, page, params),
+    }
+    return render(request, "lynify/artists.html", context)
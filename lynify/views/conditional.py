@@ -0,0 +1,85 @@
+"""
+Conditional GET for pages that only change when plays are recorded or
+metadata is refreshed
+
+Every recorded play gets a new history id, and the page data (history rows,
+play counters, rollups) only changes along with it. Refreshed tracks and
+artists get a new refreshed time. So the newest history id and refresh
+times, together with the user and the page's query string, make the page's
+ETag, and a request with a matching If-None-Match gets a 304 before any of
+the page's queries run.
+
+There is no Last-Modified: plays are recorded with the time they started,
+which for recently played polls and imports is older than plays already
+recorded, so no stored time only moves forward when a page changes.
+"""
+import hashlib
+from functools import wraps
+from typing import Optional
+
+from django.db.models import F, Subquery
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from lynify.models.artists import ArtistModel
+from lynify.models.history import HistoryModel
+from lynify.models.tokens import AccessToken
+from lynify.models.tracks import TrackModel
+from lynify.views.html import current_user_id
+
+
+def page_etag(request) -> Optional[str]:
+    """
+    Returns the ETag of the page for this request, computed once per
+    request with a single query of index lookups
+    """
+    if hasattr(request, "_page_etag"):
+        return request._page_etag
+    user_id = current_user_id(request)
+    if "code" in request.GET or AccessToken.get_token(user_id) is None:
+        # logging in, the page depends on more than the history
+        etag = None
+    else:
+        # the most recently recorded play by the primary key index, and the
+        # latest refreshes by the refreshed indexes
+        newest = (
+            HistoryModel.objects.order_by("-id")
+            .values_list("id")
+            .annotate(
+                tracks_refreshed=Subquery(
+                    TrackModel.objects.order_by(F("track_refreshed_at").desc(nulls_last=True)).values(
+                        "track_refreshed_at"
+                    )[:1]
+                ),
+                artists_refreshed=Subquery(
+                    ArtistModel.objects.order_by(F("artist_refreshed_at").desc(nulls_last=True)).values(
+                        "artist_refreshed_at"
+                    )[:1]
+                ),
+            )
+            .first()
+        )
+        if newest is None:
+            newest = (None, None, None)
+        raw = "|".join([user_id or "", *map(str, newest), request.path, request.META.get("QUERY_STRING", "")])
+        etag = '"' + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest() + '"'
+    request._page_etag = etag
+    return etag
+
+
+def conditional_page(view):
+    """
+    Answer requests for an unchanged page with 304 Not Modified, and make
+    clients revalidate instead of reusing the page blindly
+    """
+
+    conditional_view = condition(etag_func=lambda request, *args, **kwargs: page_etag(request))(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        if page_etag(request) is not None:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
@@ -0,0 +1,205 @@
+"""
+Streaming CSV / NDJSON exports of history, tracks and artists
+
+Rows are read with a server-side cursor in chunks of EXPORT_CHUNK_SIZE and
+written out as they are read, so memory use doesn't grow with the table and
+the first bytes are sent right away. Under ASGI the lines are handed to the
+server as an async iterator, each batch read in the request's sync thread:
+Django would read a sync iterator into a list before sending any of it.
+"""
+import csv
+import datetime
+import json
+from typing import AsyncIterator, Iterable, Iterator, List
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+from lynify.models.artists import ArtistModel
+from lynify.models.history import HistoryModel
+from lynify.models.tracks import TrackModel
+from lynify.views.html import SpotifyLogin, current_user_id, header
+
+# rows fetched from the database at a time
+EXPORT_CHUNK_SIZE = 2000
+# rows written to the response at a time
+WRITE_BATCH_SIZE = 500
+
+HISTORY_COLUMNS = ["timestamp", "track_id", "track_name", "artists", "album", "ms_played"]
+TRACK_COLUMNS = [
+    "track_id",
+    "track_name",
+    "artists",
+    "album",
+    "duration",
+    "popularity",
+    "release_date",
+    "explicit",
+    "play_count",
+    "total_ms_played",
+    "last_played_at",
+]
+ARTIST_COLUMNS = [
+    "artist_id",
+    "artist_name",
+    "genres",
+    "popularity",
+    "followers",
+    "play_count",
+    "total_ms_played",
+    "last_played_at",
+]
+
+
+class Echo:
+    """
+    File-like object returning what is written, for csv.writer
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, list):
+        return "; ".join(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(columns: List[str], rows: Iterable[list]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    batch = []
+    for row in rows:
+        row = [csv_value(col) for col in row]
+        batch.append(writer.writerow(row))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def ndjson_lines(columns: List[str], rows: Iterable[list]) -> Iterator[str]:
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n")
+        if len(batch) >= WRITE_BATCH_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+async def async_lines(lines: Iterator[str]) -> AsyncIterator[str]:
+    """
+    Iterate over lines produced by sync code, a batch per thread hop. The rows
+    come from a server-side cursor, so every batch is read in the same thread,
+    the one thread sensitive code of the request runs in, with its connection.
+    """
+    next_batch = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            batch = await next_batch(lines, None)
+            if batch is None:
+                return
+            yield batch
+    finally:
+        # closes the cursor when the client goes away mid export
+        await sync_to_async(lines.close, thread_sensitive=True)()
+
+
+def export_response(request, name: str, columns: List[str], rows: Iterable[list]) -> StreamingHttpResponse:
+    """
+    Stream rows as csv, or as ndjson with ?format=ndjson.
+    Under ASGI the response is streamed from an async iterator.
+    """
+    if request.GET.get("format", "csv") == "ndjson":
+        lines, content_type, extension = ndjson_lines(columns, rows), "application/x-ndjson", "ndjson"
+    else:
+        lines, content_type, extension = csv_lines(columns, rows), "text/csv", "csv"
+    if isinstance(request, ASGIRequest):
+        lines = async_lines(lines)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Content-Disposition"] = 'attachment; filename="' + name + "." + extension + '"'
+    return response
+
+
+def history_rows(user_id: str) -> Iterator[list]:
+    entries = (
+        HistoryModel.objects.filter(user_id=user_id)
+        .select_related("track")
+        .prefetch_related("track__track_artists")
+        .order_by("timestamp")
+    )
+    for entry in entries.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        track = entry.track
+        yield [
+            entry.timestamp,
+            track.track_id,
+            track.track_name,
+            [artist.artist_name for artist in track.track_artists.all()],
+            track.track_album,
+            entry.ms_played if entry.ms_played is not None else track.track_duration,
+        ]
+
+
+def track_rows() -> Iterator[list]:
+    tracks = TrackModel.objects.prefetch_related("track_artists").order_by("track_id")
+    for track in tracks.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            track.track_id,
+            track.track_name,
+            [artist.artist_name for artist in track.track_artists.all()],
+            track.track_album,
+            track.track_duration,
+            track.track_popularity,
+            track.track_release_date,
+            track.track_explicit,
+            track.track_play_count,
+            track.track_total_ms_played,
+            track.track_last_played_at,
+        ]
+
+
+def artist_rows() -> Iterator[list]:
+    for artist in (
+        ArtistModel.objects.prefetch_related("artist_genres")
+        .order_by("artist_id")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    ):
+        yield [
+            artist.artist_id,
+            artist.artist_name,
+            [genre.genre_name for genre in artist.artist_genres.all()],
+            artist.artist_popularity,
+            artist.artist_followers,
+            artist.artist_play_count,
+            artist.artist_total_ms_played,
+            artist.artist_last_played_at,
+        ]
+
+
+def history_export(request):
+    token_success, token_result = SpotifyLogin(request)
+    if not token_success:
+        return HttpResponse(header() + token_result)
+    return export_response(request, "history", HISTORY_COLUMNS, history_rows(current_user_id(request)))
+
+
+def tracks_export(request):
+    token_success, token_result = SpotifyLogin(request)
+    if not token_success:
+        return HttpResponse(header() + token_result)
+    return export_response(request, "tracks", TRACK_COLUMNS, track_rows())
+
+
+def artists_export(request):
+    token_success, token_result = SpotifyLogin(request)
+    if not token_success:
+        return HttpResponse(header() + token_result)
+    return export_response(request, "artists", ARTIST_COLUMNS, artist_rows())
@@ -1,89 +1,209 @@
+import datetime
 import time
-from typing import Tuple
+from functools import cache
+from typing import List, Optional, Tuple
+from urllib.parse import urlencode
 
-from spotipy.oauth2 import SpotifyOAuth
+from asgiref.sync import sync_to_async
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import SafeString, mark_safe
 
+from lynify.models.artists import ArtistModel
 from lynify.models.history import HistoryModel
+from lynify.models.now_playing import NowPlayingModel
 from lynify.models.tokens import AccessToken
 from lynify.models.tracks import TrackModel
-from lynify.settings import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_USER_ID, SPOTIPY_REDIRECT_URI
+from lynify.settings import NOW_PLAYING_MAX_AGE, POLL_MODE, SPOTIFY_USER_ID
+from lynify.utils.fragments import cached_fragments
+from lynify.utils.pagination import KeysetPage
+from lynify.utils.spotify import get_oauth, get_user_id
 
 
-def nav_bar() -> str:
-    html = '<div class="w3-bar w3-black">'
-    html += '<a href="/" class="w3-bar-item w3-button">Currently Playing</a>'
-    html += '<a href="/history" class="w3-bar-item w3-button">History</a>'
-    html += '<a href="/artists" class="w3-bar-item w3-button">Artists</a>'
-    html += '<a href="/tracks" class="w3-bar-item w3-button">Tracks</a>'
-    html += "</div>"
-    return html
+@cache
+def header() -> SafeString:
+    """
+    Returns the page header and navigation bar, rendered once per process
+    """
+    return mark_safe(render_to_string("lynify/header.html"))
 
 
-def header() -> str:
-    html = "<head>"
-    html += '<link rel="stylesheet" href="https://www.w3schools.com/w3css/4/w3.css">'
-    html += '<link rel="shortcut icon" href="images/favicon.ico" type="image/svg">'
-    html += "</head>"
-    html += "<style>table, th, td {border: 1px solid black;}</style>"
-    html += "<style>table {border-collapse: collapse;}</style>"
-    html += "<style>th, td {padding: 5px;}</style>"
-    html += "<style>th {text-align: left;}</style>"
-    html += "<style>tr:nth-child(even) {background-color: #f2f2f2;}</style>"
-    html += nav_bar()
-    return html
+def pagination_links(limit: int, page: KeysetPage, params: Optional[dict] = None) -> dict:
+    """
+    Returns the query strings of the Previous/Next links for a keyset page,
+    for lynify/pagination_bar.html
+    params are extra query parameters kept in the links
+    """
+    params = params or {}
+    links = {}
+    if page.prev_cursor is not None:
+        links["prev_query"] = urlencode({**params, "limit": limit, "before": page.prev_cursor})
+    if page.next_cursor is not None:
+        links["next_query"] = urlencode({**params, "limit": limit, "after": page.next_cursor})
+    return links
 
 
-def SpotifyLoginButton() -> str:
-    oauth = SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIPY_REDIRECT_URI,
-        scope="user-read-currently-playing",
+def sort_links(limit: int, sorts: dict, sort: str, params: Optional[dict] = None) -> list:
+    """
+    Returns a link for each way to sort a page, for lynify/sort_bar.html
+    sorts is a dict of sort name to column label
+    params are extra query parameters kept in the links
+    """
+    params = params or {}
+    return [
+        {"label": label, "query": urlencode({**params, "limit": limit, "sort": name}), "selected": name == sort}
+        for name, label in sorts.items()
+    ]
+
+
+def track_values(track: TrackModel) -> tuple:
+    artists = tuple((artist.artist_id, artist.artist_name) for artist in track.track_artists.all())
+    return (
+        track.track_id,
+        track.track_name,
+        track.track_album,
+        artists,
+        track.track_duration,
+        track.track_popularity,
+        track.track_release_date,
+        track.track_explicit,
+        track.track_play_count,
+        track.track_last_played_at,
     )
-    auth_url = oauth.get_authorize_url()
-    htmlLoginButton = "<a href='" + auth_url + "'>Login to Spotify</a>"
-    return htmlLoginButton
 
 
-def display_currently_playing() -> str:
+def artist_values(artist: ArtistModel) -> tuple:
+    return (
+        artist.artist_id,
+        artist.artist_name,
+        tuple(genre.genre_name for genre in artist.artist_genres.all()),
+        artist.artist_popularity,
+        artist.artist_followers,
+        artist.artist_play_count,
+        artist.artist_last_played_at,
+    )
+
+
+def track_cells(tracks: list) -> List[SafeString]:
+    """
+    Returns the track, artists and album cells of each track, with the
+    track's artists prefetched
+    """
+    return cached_fragments("lynify/rows/track_cells.html", "track", tracks, lambda track: track_values(track)[:4])
+
+
+def track_rows(tracks: list) -> List[SafeString]:
+    return cached_fragments("lynify/rows/track.html", "track", tracks, track_values)
+
+
+def artist_rows(artists: list) -> List[SafeString]:
+    return cached_fragments("lynify/rows/artist.html", "artist", artists, artist_values)
+
+
+def SpotifyLoginButton() -> str:
+    oauth = get_oauth()
+    return render_to_string("lynify/login_button.html", {"auth_url": oauth.get_authorize_url()})
+
+
+def now_playing_html(snapshot: NowPlayingModel) -> str:
+    """
+    Returns a string of html containing a currently playing snapshot
+    If it has a spotify api error, includes a login button
+    """
+    context = {}
+    if snapshot.error is not None:
+        context["error"] = snapshot.error
+        context["login_button"] = mark_safe(SpotifyLoginButton())
+    elif snapshot.is_playing and snapshot.track is not None:
+        prefetch_related_objects([snapshot.track], "track_artists")
+        context["track"] = snapshot.track
+        context["started_at"] = snapshot.started_at
+    return render_to_string("lynify/currently_playing.html", context)
+
+
+async def anow_playing(user_id: Optional[str] = None) -> str:
     """
-    Returns a string of html containing the currently playing track
+    Returns a string of html containing the user's currently playing track,
+    from the snapshot published by the poller. Spotify is only called when
+    the snapshot is older than NOW_PLAYING_MAX_AGE (e.g. the poller runs in
+    recently_played mode), and that result is published for later views.
+    The playing track is recorded as a play too, unless the poller records
+    plays from recently played.
     If there is a spotify api error, returns a login button
     """
-    token = AccessToken.get_token()
+    token = await sync_to_async(AccessToken.get_token)(user_id)
     if token is None:
         return SpotifyLoginButton()
-    currently_playing = token.get_currently_playing()
-    html = "<h1>Currently Playing</h1>"
-    if currently_playing is None:
-        return html + "No currently playing track"
-    elif isinstance(currently_playing, Exception):
-        html += "Issue with token: " + str(currently_playing)
-        html += SpotifyLoginButton()
-        return html
-    elif not currently_playing["is_playing"]:
-        return html + "No currently playing track"
-    else:
-        # add to history
-        history = HistoryModel.from_spotify(currently_playing)
-        track = TrackModel.from_spotify(currently_playing["item"]["id"])
-        # create a table of the track information
-        html += "<table>"
-        html += "<tr><th>Track</th><th>Artist</th><th>Album</th><th>Date</th><th>Time</th></tr>"
-        html += "<tr>"
-        track_link = '<a href="/track?track_id=' + track.track_id + '">' + track.track_name + "</a>"
-        artist_links = []
-        for artist in track.track_artists.all():
-            artist_links.append('<a href="/artist?artist_id=' + artist.artist_id + '">' + artist.artist_name + "</a>")
-        artist_links = ", ".join(artist_links)
-        date = history.timestamp.strftime("%Y-%m-%d")
-        time = history.timestamp.strftime("%H:%M:%S")
-        cols = [track_link, artist_links, track.track_album, date, time]
-        for col in cols:
-            html += "<td>" + col + "</td>"
-        html += "</tr>"
-        html += "</table>"
-        return html
+    fresh_after = timezone.now() - datetime.timedelta(seconds=NOW_PLAYING_MAX_AGE)
+    snapshot = (
+        await NowPlayingModel.objects.filter(user_id=token.user_id, updated_at__gte=fresh_after)
+        .select_related("track")
+        .defer("track__track_search")
+        .afirst()
+    )
+    if snapshot is None:
+        currently_playing = await token.aget_currently_playing()
+        history = None
+        if (
+            isinstance(currently_playing, dict)
+            and currently_playing["is_playing"]
+            and currently_playing["item"] is not None
+        ):
+            if POLL_MODE == "recently_played":
+                # the poller records the play once it ends, keyed by its end less the track's duration.
+                # Recording it here too, keyed by when the currently playing response says it started,
+                # would store it twice.
+                history = await HistoryModel.aplaying(currently_playing, user_id=token.user_id)
+            else:
+                # add to history
+                history = await HistoryModel.afrom_spotify(currently_playing, user_id=token.user_id)
+        snapshot = await sync_to_async(NowPlayingModel.publish)(token.user_id, currently_playing, history)
+    return await sync_to_async(now_playing_html)(snapshot)
+
+
+def genre_params(genre: Optional[str]) -> dict:
+    """
+    Returns the query parameters keeping a genre filter in page links
+    """
+    return {"genre": genre} if genre else {}
+
+
+def date_range(date: str) -> Optional[Tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Returns the start and end (exclusive) of the year, month or day of a
+    YYYY, YYYY-MM or YYYY-MM-DD date filter in the current time zone,
+    or None if it isn't one
+    """
+    parts = date.split("-")
+    if len(parts[0]) != 4 or not all(part.isdigit() for part in parts):
+        return None
+    numbers = [int(part) for part in parts]
+    try:
+        if len(numbers) == 1:
+            start = datetime.date(numbers[0], 1, 1)
+            end = datetime.date(numbers[0] + 1, 1, 1)
+        elif len(numbers) == 2:
+            start = datetime.date(numbers[0], numbers[1], 1)
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+        elif len(numbers) == 3:
+            start = datetime.date(*numbers)
+            end = start + datetime.timedelta(days=1)
+        else:
+            return None
+    except (ValueError, OverflowError):
+        return None
+    return (
+        timezone.make_aware(datetime.datetime.combine(start, datetime.time())),
+        timezone.make_aware(datetime.datetime.combine(end, datetime.time())),
+    )
+
+
+def current_user_id(request) -> Optional[str]:
+    """
+    Returns the spotify user logged in with this session, or the default user
+    """
+    return request.session.get("user_id", SPOTIFY_USER_ID)
 
 
 def SpotifyLogin(request) -> Tuple[bool, str]:
@@ -92,29 +212,24 @@ def SpotifyLogin(request) -> Tuple[bool, str]:
     Returns False and a login button if otherwise
     """
 
-    oauth = SpotifyOAuth(
-        client_id=SPOTIFY_CLIENT_ID,
-        client_secret=SPOTIFY_CLIENT_SECRET,
-        redirect_uri=SPOTIPY_REDIRECT_URI,
-        scope="user-read-currently-playing",
-    )
+    oauth = get_oauth()
     if request.GET.get("code", "") != "":
         code = request.GET.get("code", "")
-        token = oauth.get_access_token(code)
+        token = oauth.get_access_token(code, check_cache=False)
         if token:
+            user_id = get_user_id(token["access_token"])
             AccessToken.from_spotify(
-                SPOTIFY_USER_ID,
+                user_id,
                 token["access_token"],
                 token["refresh_token"],
                 int(time.time() * 1000) + token["expires_in"] * 1000,
             )
+            request.session["user_id"] = user_id
             return True, token["access_token"]
 
     # try to get a token from the database or cache
-    token = AccessToken.get_token()
+    token = AccessToken.get_token(current_user_id(request))
     if token is not None:
         return True, token.access_token
 
-    auth_url = oauth.get_authorize_url()
-    htmlLoginButton = "<a href='" + auth_url + "'>Login to Spotify</a>"
-    return False, htmlLoginButton
+    return False, SpotifyLoginButton()
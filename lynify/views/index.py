@@ -1,14 +1,15 @@
+from asgiref.sync import sync_to_async
 from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils.safestring import mark_safe
 
-from lynify.views.html import SpotifyLogin, display_currently_playing, header
+from lynify.views.html import SpotifyLogin, anow_playing, current_user_id, header
 
 
-def index(request):
-    html = header()
-    token_success, token_result = SpotifyLogin(request)
+async def index(request):
+    token_success, token_result = await sync_to_async(SpotifyLogin)(request)
     if not token_success:
-        html += token_result
-        return HttpResponse(html)
-
-    html += display_currently_playing()
-    return HttpResponse(html)
+        return HttpResponse(header() + token_result)
+    user_id = await sync_to_async(current_user_id)(request)
+    now_playing = mark_safe(await anow_playing(user_id))
+    return render(request, "lynify/index.html", {"header": header(), "now_playing": now_playing})
@@ -0,0 +1,14 @@
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+from lynify.settings import PROMETHEUS_MULTIPROC_DIR
+
+
+def metrics(request):
+    if PROMETHEUS_MULTIPROC_DIR:
+        # the metrics of every web worker and the poller, read from their files
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,56 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+
+from lynify.broadcaster import get_broadcaster
+from lynify.models.tokens import AccessToken
+from lynify.settings import NOW_PLAYING_STREAM_DURATION
+from lynify.views.html import anow_playing, current_user_id
+
+# seconds between comments keeping an idle stream open through proxies
+KEEPALIVE_INTERVAL = 15
+# milliseconds browsers wait before reconnecting a closed stream
+RECONNECT_DELAY_MS = 1000
+
+
+def event(name: str, data: str) -> str:
+    # every line of the data needs its own field
+    return "event: " + name + "\n" + "".join("data: " + line + "\n" for line in data.splitlines()) + "\n"
+
+
+async def now_playing_stream(user_id: str):
+    """
+    Yield server-sent events of the user's now playing html, the current one
+    first and then every change. The stream ends after
+    NOW_PLAYING_STREAM_DURATION and the browser reconnects, so streams of
+    browsers that went away don't stay open.
+    """
+    broadcaster = get_broadcaster()
+    queue = broadcaster.subscribe(user_id)
+    try:
+        yield "retry: " + str(RECONNECT_DELAY_MS) + "\n\n"
+        yield event("now-playing", await anow_playing(user_id))
+        loop = asyncio.get_running_loop()
+        closes_at = loop.time() + NOW_PLAYING_STREAM_DURATION
+        while (remaining := closes_at - loop.time()) > 0:
+            try:
+                html = await asyncio.wait_for(queue.get(), timeout=min(KEEPALIVE_INTERVAL, remaining))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield event("now-playing", html)
+    finally:
+        broadcaster.unsubscribe(user_id, queue)
+
+
+async def now_playing_events(request):
+    user_id = await sync_to_async(current_user_id)(request)
+    token = await sync_to_async(AccessToken.get_token)(user_id)
+    if token is None:
+        # no content tells the browser not to reconnect
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(now_playing_stream(token.user_id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
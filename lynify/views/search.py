@@ -0,0 +1,63 @@
+from django.contrib.postgres.search import SearchRank, SearchVector
+from django.db.models import F
+from django.http import HttpResponse
+from django.shortcuts import render
+
+from lynify.models.artists import ArtistModel
+from lynify.models.tracks import TrackModel
+from lynify.utils.search import SEARCH_CONFIG, exact_query, fuzzy_filter, fuzzy_similarity, prefix_query
+from lynify.views.html import SpotifyLogin, artist_rows, header, track_rows
+
+
+def search(request):
+    """
+    Tracks and artists matching ?q=, best matches first, then ones with similar names
+    """
+    q = request.GET.get("q", "").strip()
+    limit = int(request.GET.get("limit", "25"))
+    token_success, token_result = SpotifyLogin(request)
+    if not token_success:
+        return HttpResponse(header() + token_result)
+
+    context = {"header": header(), "q": q, "track_rows": [], "artist_rows": []}
+    query = prefix_query(q)
+    if query is not None:
+        exact = exact_query(q)
+        # tracks match on their name, artists and album, names ranking highest
+        tracks = (
+            TrackModel.objects.filter(track_search=query)
+            .annotate(rank=SearchRank(F("track_search"), query) + SearchRank(F("track_search"), exact))
+            .order_by("-rank", "-track_popularity", "track_id")
+            .prefetch_related("track_artists")[:limit]
+        )
+        # the same expression as artists_search_idx, so the index is used
+        artist_search = SearchVector("artist_name", config=SEARCH_CONFIG)
+        artists = (
+            ArtistModel.objects.annotate(search=artist_search)
+            .filter(search=query)
+            .annotate(rank=SearchRank(artist_search, query) + SearchRank(artist_search, exact))
+            .order_by("-rank", "-artist_followers", "artist_id")
+            .prefetch_related("artist_genres")[:limit]
+        )
+        tracks = list(tracks)
+        artists = list(artists)
+        # fill up with names similar to the query, so misspelled queries still find something
+        if len(tracks) < limit:
+            tracks += (
+                TrackModel.objects.filter(fuzzy_filter(q, "track_name", "track_album"))
+                .exclude(track_id__in=[track.track_id for track in tracks])
+                .annotate(similarity=fuzzy_similarity(q, "track_name", "track_album"))
+                .order_by("-similarity", "-track_popularity", "track_id")
+                .prefetch_related("track_artists")[: limit - len(tracks)]
+            )
+        if len(artists) < limit:
+            artists += (
+                ArtistModel.objects.filter(fuzzy_filter(q, "artist_name"))
+                .exclude(artist_id__in=[artist.artist_id for artist in artists])
+                .annotate(similarity=fuzzy_similarity(q, "artist_name"))
+                .order_by("-similarity", "-artist_followers", "artist_id")
+                .prefetch_related("artist_genres")[: limit - len(artists)]
+            )
+        context["track_rows"] = track_rows(tracks)
+        context["artist_rows"] = artist_rows(artists)
+    return render(request, "lynify/search.html", context)
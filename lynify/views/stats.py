@@ -0,0 +1,56 @@
+import datetime
+
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from lynify.models.artists import ArtistModel
+from lynify.models.stats import DailyArtistStatsModel, DailyTrackStatsModel
+from lynify.models.tracks import TrackModel
+from lynify.views.html import SpotifyLogin, current_user_id, header
+
+
+def stats(request):
+    """
+    Listening stats over the last `days` days, read only from the daily rollups
+    """
+    days = int(request.GET.get("days", "30"))
+    limit = int(request.GET.get("limit", "10"))
+    token_success, token_result = SpotifyLogin(request)
+    if not token_success:
+        return HttpResponse(header() + token_result)
+
+    user_id = current_user_id(request)
+    since = timezone.now().date() - datetime.timedelta(days=days - 1)
+    track_stats = DailyTrackStatsModel.objects.filter(user_id=user_id, day__gte=since)
+    artist_stats = DailyArtistStatsModel.objects.filter(user_id=user_id, day__gte=since)
+
+    top_tracks = (
+        track_stats.values("track_id")
+        .annotate(plays=Sum("play_count"), ms=Sum("ms_played"))
+        .order_by("-plays", "-ms")[:limit]
+    )
+    tracks = TrackModel.objects.prefetch_related("track_artists").in_bulk([row["track_id"] for row in top_tracks])
+    top_artists = (
+        artist_stats.values("artist_id")
+        .annotate(plays=Sum("play_count"), ms=Sum("ms_played"))
+        .order_by("-plays", "-ms")[:limit]
+    )
+    artists = ArtistModel.objects.in_bulk([row["artist_id"] for row in top_artists])
+    per_day = track_stats.values("day").annotate(plays=Sum("play_count"), ms=Sum("ms_played")).order_by("-day")
+
+    context = {
+        "header": header(),
+        "periods": [7, 30, 365],
+        "top_tracks": [
+            {"track": tracks[row["track_id"]], "plays": row["plays"], "minutes": row["ms"] // 60000}
+            for row in top_tracks
+        ],
+        "top_artists": [
+            {"artist": artists[row["artist_id"]], "plays": row["plays"], "minutes": row["ms"] // 60000}
+            for row in top_artists
+        ],
+        "per_day": [{"day": row["day"], "plays": row["plays"], "minutes": row["ms"] // 60000} for row in per_day],
+    }
+    return render(request, "lynify/stats.html", context)
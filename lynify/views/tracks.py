@@ -1,74 +1,44 @@
 from django.http import HttpResponse
+from django.shortcuts import render
 
 from lynify.models.tracks import TrackModel
-from lynify.views.html import SpotifyLogin, header
+from lynify.utils.pagination import paginate
+from lynify.views.conditional import conditional_page
+from lynify.views.html import SpotifyLogin, genre_params, header, pagination_links, sort_links, track_rows
 
+# ways to sort the tracks page, name -> ordering field
+TRACK_SORTS = {
+    "popularity": "track_popularity",
+    "plays": "track_play_count",
+    "last_played": "track_last_played_at",
+}
+SORT_LABELS = {"popularity": "Popularity", "plays": "Plays", "last_played": "Last Played"}
 
+
+@conditional_page
 def tracks(request):
     limit = request.GET.get("limit", "25")
-    offset = request.GET.get("offset", "0")
     limit = int(limit)
-    offset = int(offset)
-    html = header()
     token_success, token_result = SpotifyLogin(request)
     if not token_success:
-        html += token_result
-        return HttpResponse(html)
+        return HttpResponse(header() + token_result)
 
-    tracks = TrackModel.objects.all()[offset : offset + limit]
-    html += "<table>"
-    col_names = [
-        "Track",
-        "Artists",
-        "Album",
-        "Duration",
-        "Popularity",
-        "Release Date",
-        "Explicit",
-    ]
-    html += "<tr>"
-    for col_name in col_names:
-        html += "<th>" + col_name + "</th>"
-    html += "</tr>"
-    for track in tracks:
-        html += "<tr>"
-        track_link = '<a href="/track?track_id=' + track.track_id + '">' + track.track_name + "</a>"
-        artists = track.track_artists.all()
-        artist_links = []
-        for artist in artists:
-            artist_links.append('<a href="/artist?artist_id=' + artist.artist_id + '">' + artist.artist_name + "</a>")
-        artist_links = ", ".join(artist_links)
-        cols = [
-            track_link,
-            artist_links,
-            track.track_album,
-            str(track.track_duration),
-            str(track.track_popularity),
-            track.track_release_date.strftime("%Y-%m-%d"),
-            str(track.track_explicit),
-        ]
-        for col in cols:
-            html += "<td>" + col + "</td>"
-        html += "</tr>"
-    html += "</table>"
-    # add pagination
-    html += '<div class="w3-bar w3-black">'
-    if offset > 0:
-        prev_offset = max(0, offset - limit)
-        html += (
-            '<a href="/tracks?limit='
-            + str(limit)
-            + "&offset="
-            + str(prev_offset)
-            + '" class="w3-bar-item w3-button">Previous</a>'
-        )
-    if offset + limit < TrackModel.objects.count():
-        html += (
-            '<a href="/tracks?limit='
-            + str(limit)
-            + "&offset="
-            + str(offset + limit)
-            + '" class="w3-bar-item w3-button">Next</a>'
-        )
-    html += "</div>"
-    return HttpResponse(html)
+    sort = request.GET.get("sort", "popularity")
+    if sort not in TRACK_SORTS:
+        sort = "popularity"
+    genre = request.GET.get("genre", "")
+    params = {"sort": sort, **genre_params(genre)}
+    tracks = TrackModel.objects.prefetch_related("track_artists")
+    if genre:
+        tracks = tracks.filter(TrackModel.genre_exists(genre))
+    if sort == "last_played":
+        tracks = tracks.filter(track_last_played_at__isnull=False)
+    page = paginate(request, tracks, TRACK_SORTS[sort], limit)
+    context = {
+        "header": header(),
+        "genre": genre,
+        "sorts": sort_links(limit, SORT_LABELS, sort, genre_params(genre)),
+        "rows": track_rows(page.rows),
+        **pagination_links(limit, page, params),
+    }
+    return render(request, "lynify/tracks.html", context)